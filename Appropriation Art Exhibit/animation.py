@@ -0,0 +1,277 @@
+"""Contain functions for applying effects to every frame of an animation.
+
+This module contains functions for processing multi-frame images such
+as animated GIFs and multi-page TIFFs. Frames are decoded one at a time,
+processed in batches with effect.Effect.apply_batch, optionally across a
+pool of worker processes, and passed straight on to the encoder along
+with their original durations and disposal methods.
+It also contains a function for rendering animations in which an
+effect parameter changes from frame to frame.
+
+Classes:
+Frame -- class for storing a frame and its timing information
+
+Functions:
+iter_frames -- return a generator of the frames of an image file
+apply_to_frames -- apply an effect to every frame of an image file
+render_parameter_sweep -- render an animation of an effect parameter changing
+"""
+
+
+# Standard Python libraries
+import itertools
+import multiprocessing
+
+# External libraries
+from PIL import Image
+from PIL import ImageSequence
+
+# Own modules
+import painting
+
+
+# Number of frames given to each worker at a time, which limits how many
+# decoded frames are held in memory at once
+FRAMES_PER_WORKER = 2
+# Number of frames processed together with effect.Effect.apply_batch when
+# there is only one worker
+FRAMES_PER_BATCH = 8
+# Time each frame of a parameter sweep is shown for in milliseconds
+DEFAULT_FRAME_DURATION = 100
+
+# Source painting shared by every frame a sweep worker process renders
+_sweep_source = None
+
+
+class Frame(object):
+
+    """Store a single frame of an animation and its timing information.
+
+    This class stores the painting.Painting of a frame along with the
+    information needed to put the frame back into an animation.
+    """
+
+    def __init__(self, frame_painting, duration, disposal):
+        """Initialise the properties.
+
+        Arguments:
+        frame_painting -- the frame as a painting.Painting
+        duration -- the time the frame is shown for in milliseconds, or None
+        disposal -- how the frame is disposed of before the next one, or None
+        """
+
+        self.__painting = frame_painting
+        self.__duration = duration
+        self.__disposal = disposal
+
+    @property
+    def painting(self):
+        return self.__painting
+
+    @property
+    def duration(self):
+        return self.__duration
+
+    @property
+    def disposal(self):
+        return self.__disposal
+
+
+def iter_frames(path):
+    """Return a generator of the frames of an image file as Frame objects.
+
+    Each frame is only decoded when the generator reaches it.
+    Palette frames are converted to "RGB", or "RGBA" if they have
+    transparency, so that effects can work on them.
+
+    Arguments:
+    path -- string containing the location of the image file
+    """
+
+    img = Image.open(path)
+    for img_frame in ImageSequence.Iterator(img):
+        frame_image = img_frame.copy()
+        if frame_image.mode == "P":
+            if "transparency" in frame_image.info:
+                frame_image = frame_image.convert("RGBA")
+            else:
+                frame_image = frame_image.convert("RGB")
+        yield Frame(painting.Painting(frame_image),
+                    img_frame.info.get("duration"),
+                    getattr(img_frame, "disposal_method", None))
+
+
+def apply_to_frames(effect, source_path, output_path, workers=1):
+    """Apply an effect to every frame of an image file and save the result.
+
+    This function applies an effect to each frame of the source image
+    and saves the processed frames as a new animation with the same
+    durations and disposal methods.
+    Frames are processed in batches so that only a few frames per worker
+    are decoded at any one time. Note that Pillow's GIF encoder keeps the
+    frames it has been given until the file is finished.
+
+    Arguments:
+    effect -- the effect.Effect that should be applied to each frame
+    source_path -- string containing the location of the image file
+    output_path -- string containing the location the result should be saved
+    workers -- the number of processes to process frames in as an int
+    """
+
+    durations = []
+    disposals = []
+    processed_frames = _iter_processed_frames(effect, iter_frames(source_path), workers)
+
+    def iter_images():
+        # The encoder reads the duration of each frame after receiving it,
+        # so the timing lists can be filled in as the frames are generated
+        for frame in processed_frames:
+            durations.append(frame.duration)
+            disposals.append(frame.disposal)
+            yield frame.painting.img
+
+    _save_animation(iter_images(), output_path, durations, disposals)
+
+
+def render_parameter_sweep(source_path, output_path, effect_class, parameter, values,
+                           fixed_parameters=None, duration=DEFAULT_FRAME_DURATION, workers=1):
+    """Render an animation of an effect with one parameter changing.
+
+    This function applies the effect to the source image once for every
+    value in values and saves the results as the frames of an animation.
+    The source is only decoded once, and each frame is worked out with
+    effect.Effect.get_result so the source painting isn't changed. This
+    means anything an effect caches on it, such as the resized tile and
+    luminance of TileEffect, is shared by every frame rendered in the
+    same process.
+
+    Arguments:
+    source_path -- string containing the location of the image file
+    output_path -- string containing the location the animation should be saved
+    effect_class -- the effect.Effect subclass to render
+    parameter -- name of the argument of effect_class that changes
+    values -- list of the values the parameter takes in each frame
+    fixed_parameters -- dictionary of the other arguments of effect_class
+    duration -- the time each frame is shown for in milliseconds
+    workers -- the number of processes to render frames in as an int
+    """
+
+    effects = []
+    for value in values:
+        parameters = dict(fixed_parameters or {})
+        parameters[parameter] = value
+        effects.append(effect_class(**parameters))
+
+    source_image = painting.Painting(source_path).img
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, _set_sweep_source, (source_image,))
+        try:
+            _save_animation(pool.imap(_render_sweep_frame, effects), output_path,
+                            [duration] * len(effects), None)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _set_sweep_source(source_image)
+        _save_animation((_render_sweep_frame(frame_effect) for frame_effect in effects),
+                        output_path, [duration] * len(effects), None)
+
+
+def _save_animation(images, output_path, durations, disposals):
+    """Save an iterable of images as the frames of an animation.
+
+    The timing lists only need to contain an entry for each frame by the
+    time the frame has been taken from images.
+
+    Arguments:
+    images -- iterable of Image.Image objects for each frame
+    output_path -- string containing the location the animation should be saved
+    durations -- list of the time each frame is shown for in milliseconds, or None
+    disposals -- list of how each frame is disposed of, or None
+    """
+
+    images = iter(images)
+    first_image = next(images)
+    save_options = {"save_all": True, "append_images": images}
+    if durations and durations[0] is not None:
+        save_options["duration"] = durations
+    if disposals and disposals[0] is not None:
+        save_options["disposal"] = disposals
+    first_image.save(output_path, **save_options)
+
+
+def _iter_processed_frames(effect, frames, workers):
+    """Return a generator of frames that the effect has been applied to.
+
+    Arguments:
+    effect -- the effect.Effect that should be applied to each frame
+    frames -- iterable of Frame objects
+    workers -- the number of processes to process frames in as an int
+    """
+
+    frames = iter(frames)
+    if workers <= 1:
+        while True:
+            batch = list(itertools.islice(frames, FRAMES_PER_BATCH))
+            if not batch:
+                break
+            effect.apply_batch([frame.painting for frame in batch])
+            for frame in batch:
+                yield frame
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        while True:
+            batch = list(itertools.islice(frames, workers * FRAMES_PER_WORKER))
+            if not batch:
+                break
+            # Each worker is given its frames together so it can apply the effect to them as a batch
+            jobs = [(effect, [frame.painting.img for frame in batch[start:start + FRAMES_PER_WORKER]])
+                    for start in range(0, len(batch), FRAMES_PER_WORKER)]
+            processed_images = itertools.chain.from_iterable(pool.map(_apply_effect, jobs))
+            for frame, processed_image in zip(batch, processed_images):
+                yield Frame(painting.Painting(processed_image), frame.duration, frame.disposal)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _apply_effect(job):
+    """Return the images of some frames that the effect has been applied to.
+
+    This function is run in the worker processes, so it takes and returns
+    Image.Image objects rather than painting.Painting objects.
+
+    Arguments:
+    job -- tuple of the effect and a list of the Image.Image of each frame
+    """
+
+    effect, images = job
+    frame_paintings = [painting.Painting(img) for img in images]
+    effect.apply_batch(frame_paintings)
+    return [frame_painting.img for frame_painting in frame_paintings]
+
+
+def _set_sweep_source(source_image):
+    """Set the source painting used to render the frames of a sweep.
+
+    This function is the initialiser of the sweep worker processes, so the
+    source image is only sent to each worker once.
+
+    Arguments:
+    source_image -- the decoded Image.Image of the source
+    """
+
+    global _sweep_source
+    _sweep_source = painting.Painting(source_image)
+
+
+def _render_sweep_frame(frame_effect):
+    """Return the image of one frame of a parameter sweep.
+
+    Arguments:
+    frame_effect -- the effect.Effect for the frame
+    """
+
+    return frame_effect.get_result(_sweep_source).img
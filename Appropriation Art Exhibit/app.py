@@ -0,0 +1,201 @@
+"""Contain a class that builds a Kivy application.
+
+This file contains a class for a Kivy application that
+displays both the input and output images.
+It should be started through main.py, which only imports
+this module once the application is actually run.
+"""
+
+
+# Standard Python libraries
+import os
+from multiprocessing.pool import ThreadPool
+
+# External libraries
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.core.window import Window
+from kivy.graphics.texture import Texture
+from kivy.logger import Logger
+from kivy.uix.carousel import Carousel
+from kivy.uix.image import Image
+from kivy.uix.label import Label
+
+# Own modules
+import exhibit
+import slides
+
+
+# Default memory cap of the cached slide textures, in megabytes
+DEFAULT_TEXTURE_CACHE_MB = 128
+TEXTURE_BYTES_PER_PIXEL = 4
+
+
+class ExhibitApp(App):
+
+    """Display the original images and new images.
+
+    This Kivy App displays each original image followed
+    by the processed image in a Kivy carousel.
+    Only the current slide and the ones next to it are loaded, shrunk
+    to the size of the window, in a background thread. Textures of
+    slides that have been moved away from are kept until they take up
+    more than the texture_cache_mb setting in the exhibit section of
+    the application's configuration.
+    Slides whose image can't be loaded show why instead, and aren't
+    loaded again.
+    """
+
+    def build_config(self, config):
+        config.setdefaults("exhibit", {"texture_cache_mb": DEFAULT_TEXTURE_CACHE_MB})
+
+    def build(self):
+        """Return the Kivy carousel of gallery images when the app is run."""
+
+        try:
+            gallery = exhibit.show_gallery()
+        except exhibit.GalleryError as error:
+            print "The gallery manifest is invalid:", error
+            return
+
+        self.__slide_paths = []
+        for source_path, output_path in gallery.get_display_pairs():
+            self.__slide_paths.extend((source_path, output_path))
+
+        cache_bytes = self.config.getint("exhibit", "texture_cache_mb") * 1024 * 1024
+        self.__textures = slides.SlideCache(cache_bytes)
+        self.__loading = set()
+        # Error messages of the slides that couldn't be loaded, keyed by path
+        self.__load_errors = {}
+        self.__loader = ThreadPool(1)
+        self.__previous_index = 0
+        self.__nearby = []
+
+        carousel = Carousel(direction='right')
+        # Empty images are cheap, their textures are only set once they are needed
+        self.__images = [Image(allow_stretch=True) for _ in self.__slide_paths]
+        for image in self.__images:
+            carousel.add_widget(image)
+        carousel.bind(index=self.__on_index)
+        self.__show_slides(0)
+        return carousel
+
+    def on_stop(self):
+        self.__loader.terminate()
+
+    def __on_index(self, carousel, index):
+        if index is not None:
+            self.__show_slides(index)
+
+    def __show_slides(self, index):
+        """Show the current slide and load the slides around it.
+
+        Slides that are no longer near the current one have their texture
+        removed from their image, so it can be freed once it leaves the cache.
+
+        Arguments:
+        index -- the index of the current slide
+        """
+
+        self.__nearby = slides.get_slides_to_load(index, self.__previous_index, len(self.__slide_paths))
+        self.__previous_index = index
+
+        for slide_index, image in enumerate(self.__images):
+            if slide_index not in self.__nearby:
+                image.texture = None
+
+        max_size = tuple(Window.size)
+        for slide_index in self.__nearby:
+            path = self.__slide_paths[slide_index]
+            texture = self.__textures.get(path)
+            if texture is not None:
+                self.__images[slide_index].texture = texture
+            elif path in self.__load_errors:
+                self.__show_load_error(slide_index)
+            elif path not in self.__loading:
+                self.__loading.add(path)
+                self.__loader.apply_async(_load_slide_image, (path, max_size),
+                                          callback=self.__get_loaded_callback(path))
+
+    def __get_loaded_callback(self, path):
+        """Return a function that passes a decoded image or error back to the main thread.
+
+        Kivy textures can only be made in the main thread, so the loader
+        thread schedules the rest of the work with the Kivy clock.
+
+        Arguments:
+        path -- the path of the image being loaded
+        """
+
+        def loaded(result):
+            slide_image, error_message = result
+            Clock.schedule_once(lambda dt: self.__add_texture(path, slide_image, error_message))
+        return loaded
+
+    def __add_texture(self, path, slide_image, error_message=None):
+        """Make a texture from a decoded image and show it on any nearby slides using it.
+
+        Arguments:
+        path -- the path of the image
+        slide_image -- the decoded "RGBA" image, or None if it couldn't be loaded
+        error_message -- why the image couldn't be loaded, or None if it was
+        """
+
+        self.__loading.discard(path)
+        if slide_image is None:
+            self.__load_errors[path] = error_message
+            for slide_index in self.__nearby:
+                if self.__slide_paths[slide_index] == path:
+                    self.__show_load_error(slide_index)
+            return
+        texture = Texture.create(size=slide_image.size, colorfmt="rgba")
+        texture.blit_buffer(slide_image.tobytes(), colorfmt="rgba", bufferfmt="ubyte")
+        # Pillow's rows start at the top, Kivy's at the bottom
+        texture.flip_vertical()
+
+        nearby_paths = set(self.__slide_paths[slide_index] for slide_index in self.__nearby)
+        texture_bytes = slide_image.size[0] * slide_image.size[1] * TEXTURE_BYTES_PER_PIXEL
+        self.__textures.put(path, texture, texture_bytes, in_use=nearby_paths)
+
+        for slide_index in self.__nearby:
+            if self.__slide_paths[slide_index] == path:
+                self.__images[slide_index].texture = texture
+
+    def __show_load_error(self, slide_index):
+        """Show why a slide's image couldn't be loaded in place of the image.
+
+        Arguments:
+        slide_index -- the index of the slide
+        """
+
+        image = self.__images[slide_index]
+        if image.children:
+            return
+        path = self.__slide_paths[slide_index]
+        message = "Could not load %s\n%s" % (os.path.basename(path), self.__load_errors[path])
+        label = Label(text=message, halign="center", valign="middle", pos=image.pos, size=image.size,
+                      text_size=image.size)
+        image.bind(pos=label.setter("pos"), size=label.setter("size"))
+        image.bind(size=label.setter("text_size"))
+        image.add_widget(label)
+
+
+def _load_slide_image(path, max_size):
+    """Return an image for a slide and None, or None and why it couldn't be loaded.
+
+    This function is run in the loader thread, so any exception is
+    logged here and its message returned for the main thread to show.
+    Pillow raises many kinds of exception for corrupt or truncated files,
+    such as ValueError, SyntaxError and DecompressionBombError, and an
+    uncaught one would be lost along with the slide.
+
+    Arguments:
+    path -- string containing the location of the image
+    max_size -- the largest size the image should be
+    """
+
+    try:
+        return slides.load_slide_image(path, max_size), None
+    except Exception as error:
+        Logger.exception("Exhibit: Could not load %s" % path)
+        return None, str(error) or error.__class__.__name__
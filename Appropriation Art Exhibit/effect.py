@@ -9,20 +9,85 @@ DotEffect(Effect) -- An effect that creates a pointillism-like image
 ShuffleEffect(Effect) -- An effect that shuffles the pixels in an image
 ThreeColorEffect(Effect) -- An effect that reduces an image to three colors
 TileEffect(Effect) -- an effect that posterises and tiles an image
+QuantizeEffect(Effect) -- an effect that reduces an image to a palette of colours
+
+Functions:
+set_backend -- choose how the effects are applied
+get_backend -- return the name of the backend in use
+using_backend -- use a backend in the current thread for the length of a with block
+create_effect -- return an effect from its class name and plain parameters
+map_colors -- return the bands of the values given for the colour of each pixel of an image
 """
 
 
 # Standard Python libraries
+import collections
+import contextlib
+import hashlib
+import math
+import os
 import random
-
-# External libraries
-from PIL import Image
+import threading
 
 # Own modules
 import color
 import painting
 import point
+import progress
 import shape
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+ImageChops = startup.LazyModule("PIL.ImageChops")
+ImageMath = startup.LazyModule("PIL.ImageMath")
+# offload imports this module, so it is only imported once it is first used
+offload = startup.LazyModule("offload")
+
+
+# The python backend applies effects a pixel at a time through painting.Painting.
+# The native backend builds them from Pillow's C operations on whole images,
+# giving exactly the same pixels. Effects it doesn't cover use the python backend.
+PYTHON_BACKEND = "python"
+NATIVE_BACKEND = "native"
+BACKENDS = (PYTHON_BACKEND, NATIVE_BACKEND)
+# Image modes the native backend handles, other modes use the python backend
+NATIVE_MODES = ("RGB", "RGBA")
+# Environment variable the backend is read from when this module is imported
+BACKEND_VARIABLE = "EXHIBIT_EFFECT_BACKEND"
+
+
+# Band index used for pixels that TileEffect leaves their original colour
+UNCHANGED_BAND = 255
+
+# Largest number of colours a "P" mode image can hold, and the size that
+# images are sampled down to when QuantizeEffect builds a palette
+MAX_PALETTE_COLORS = 256
+PALETTE_SAMPLE_SIZE = 256
+# Number of k-means iterations used to refine the sampled palette
+KMEANS_ITERATIONS = 4
+# QuantizeEffect groups colours into cubes this many values on a side, and
+# only searches the palette colours that could be nearest to each cube
+NEAREST_CUBE_SIZE = 8
+# Number of entries in a table that Pillow can map an "I" image to "L"
+# through, enough for every pair of red and green values
+PAIR_TABLE_SIZE = 256 * 256
+# Table that turns a difference into a mask of the pixels where it isn't 0
+NONZERO_MASK_TABLE = [0] + [255] * 255
+
+# Number of random bits in the seed ShuffleEffect picks when none is given
+SEED_BITS = 64
+
+# DotEffect refines its result by drawing every 4th circle across and
+# down, then every 2nd, then the rest
+REFINEMENT_STRIDES = (4, 2, 1)
+# TileEffect's first refinement is posterised from a tile this many times smaller
+COARSE_TILE_SCALE = 4
+
+# Largest number of pixels stacked into one image when a pointwise effect
+# is applied to a batch, which limits the extra memory the stack takes up
+BATCH_STACK_PIXELS = 16 * 1024 * 1024
 
 
 class Effect():
@@ -30,15 +95,197 @@ class Effect():
     """Abstract class for effects.
 
     This class is an abstract class that all effects will inherit from.
-    It has one method that should be implemented in all of its subclasses.
+    It has one method and one property that should be implemented in all
+    of its subclasses.
+    Effects whose result for each pixel only depends on the colour of that
+    pixel should set pointwise to True so that they can be compiled into
+    a colour lookup table.
+    do_effect and get_result take an optional progress callback, which is
+    called with the work done and the total work, and a
+    progress.CancellationToken. Both are checked between rows or blocks
+    of work. If the effect is cancelled, progress.Cancelled is raised and
+    the painting is left unchanged, as effects work on a copy that only
+    replaces the painting's image once it is finished.
 
     Public methods:
     do_effect -- method to be implemented in subclasses that carries out the effect
+    get_result -- return the result of the effect without changing the painting
+    get_output_size -- return the size of the image that the effect produces
+    get_required_size -- return the resolution of the image the effect needs to read
+    apply_strip -- return a horizontal strip of the result of the effect
+    iter_refinements -- yield paintings that get closer to the result, ending with it
+    apply_batch -- apply the effect to each of a list of paintings
+    apply_async -- start applying the effect in the background and return a future
     """
 
-    def do_effect(self, painting):
+    pointwise = False
+
+    @property
+    def parameters(self):
+        """Return the parameters of the effect as a tuple of plain values"""
+
+        raise NotImplementedError("Subclasses must implement parameters")
+
+    @property
+    def splits_into_strips(self):
+        """Return whether apply_strip works out a strip without working out the whole result"""
+
+        return self.pointwise or self.__class__.apply_strip.im_func is not Effect.apply_strip.im_func
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
         raise NotImplementedError("Subclasses must implement do_effect")
 
+    def get_result(self, painting, progress_callback=None, cancel_token=None):
+        """Return the result of the effect as a new painting.Painting.
+
+        The supplied painting is left unchanged, so anything it has
+        cached can be reused when applying other effects to it.
+        Subclasses that don't need to copy the painting first should
+        override this.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
+        """
+
+        result = painting.copy()
+        self.do_effect(result, progress_callback, cancel_token)
+        return result
+
+    def get_output_size(self, size):
+        """Return the size of the image the effect produces as a tuple.
+
+        Subclasses that change the size of the image should override this.
+
+        Arguments:
+        size -- the size of the image the effect is applied to as a tuple
+        """
+
+        return size
+
+    def get_required_size(self, size):
+        """Return the smallest size of the image that the effect needs as a tuple.
+
+        Sources can be decoded at any size from this up to their full size,
+        and the effect still produces an image of get_output_size(size).
+        Subclasses that only read the image at a lower resolution, and
+        handle paintings whose size is smaller than their source_size,
+        should override this.
+
+        Arguments:
+        size -- the full size of the image the effect is applied to as a tuple
+        """
+
+        return size
+
+    def apply_strip(self, painting, top, bottom):
+        """Return a strip of rows of the result of applying the effect.
+
+        This method returns a new painting.Painting containing rows top to
+        bottom of the image that do_effect would produce, without changing
+        the supplied painting. Strips of the same painting can be worked out
+        independently, for example in different processes, and pasted
+        together to give exactly the same result as do_effect.
+        Pointwise effects only process the rows of the strip. Other effects
+        process the whole image unless they override this method, and
+        splits_into_strips is False for them.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        top -- the first row of the strip as an int
+        bottom -- the row after the last row of the strip as an int
+        """
+
+        if self.pointwise:
+            strip = painting.crop((0, top, painting.width, bottom))
+            self.do_effect(strip)
+            return strip
+
+        result = self.get_result(painting)
+        return result.crop((0, top, result.width, bottom))
+
+    def iter_refinements(self, painting):
+        """Yield paintings that get closer to the result of the effect.
+
+        This method lets something like a preview show a rough result
+        quickly and improve it. The last painting yielded is identical to
+        the result of get_result, and the supplied painting is left
+        unchanged. Effects that can work out a rough result sooner should
+        override this, otherwise only the exact result is yielded.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        """
+
+        yield self.get_result(painting)
+
+    def apply_batch(self, paintings):
+        """Apply the effect to each of a list of paintings.
+
+        Paintings of the same mode and size are processed one after the
+        other, so anything the effect keeps for the last size, such as
+        DotEffect's circle centres, is only worked out once for them.
+        Pointwise effects are applied once to paintings of the same mode
+        and width stacked on top of each other, so the lookup tables and
+        masks they build are shared by the whole stack. Each painting ends
+        up exactly as if do_effect had been applied to it on its own.
+
+        Arguments:
+        paintings -- list of the painting.Painting that the effect should be applied to
+        """
+
+        groups = collections.OrderedDict()
+        for batch_painting in paintings:
+            # Palettes differ between "P" images, and reduced paintings keep their source size
+            can_stack = self.pointwise and batch_painting.mode != "P" and not batch_painting.is_reduced
+            size = batch_painting.width if can_stack else batch_painting.size
+            groups.setdefault((can_stack, batch_painting.mode, size), []).append(batch_painting)
+
+        for (can_stack, mode, size), group in groups.items():
+            if not can_stack or len(group) == 1:
+                for batch_painting in group:
+                    self.do_effect(batch_painting)
+                continue
+            for stack in _get_stacks(group):
+                self.__apply_stacked(stack)
+
+    def apply_async(self, painting, executor=None):
+        """Start applying the effect in the background and return an offload.Future.
+
+        The future's result is a new painting.Painting, as returned by
+        get_result, and the supplied painting is left unchanged.
+        Cancelling the future stops the effect at its next progress check.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        executor -- the offload.Executor to apply it in, defaults to offload.get_default_executor()
+        """
+
+        executor = executor or offload.get_default_executor()
+        return executor.apply_async(self, painting)
+
+    def __apply_stacked(self, stack):
+        """Apply the effect to paintings of the same mode and width stacked into one image.
+
+        Arguments:
+        stack -- list of the painting.Painting to stack, from top to bottom
+        """
+
+        width = stack[0].width
+        height = sum(stack_painting.height for stack_painting in stack)
+        stacked_painting = painting.Painting(Image.new(stack[0].mode, (width, height)))
+        top = 0
+        for stack_painting in stack:
+            stacked_painting.img.paste(stack_painting.img, (0, top))
+            top += stack_painting.height
+
+        self.do_effect(stacked_painting)
+        top = 0
+        for stack_painting in stack:
+            stack_painting.img = stacked_painting.img.crop((0, top, width, top + stack_painting.height))
+            top += stack_painting.height
+
 
 class DotEffect(Effect):
 
@@ -49,6 +296,9 @@ class DotEffect(Effect):
 
     Public methods:
     do_effect -- applies the effect to the supplied Painting
+    apply_strip -- return a strip of the result, only drawing the circles that cross it
+    get_required_size -- return the resolution of the image the effect needs to read
+    iter_refinements -- yield the circles drawn a coarse grid at a time
     """
 
     def __init__(self, radius, gap, background):
@@ -63,6 +313,9 @@ class DotEffect(Effect):
         self.__radius = radius
         self.__gap = gap
         self.__background = background
+        # Centres are kept for the last image size so frames can share them,
+        # with the size replaced at the same time so threads never see half of them
+        self.__sized_centres = (None, [])
 
     @property
     def radius(self):
@@ -73,6 +326,10 @@ class DotEffect(Effect):
         # Diameter is twice the radius
         return self.__radius*2
 
+    @property
+    def distance_between_centres(self):
+        return self.diameter + self.gap
+
     @property
     def gap(self):
         return self.__gap
@@ -81,7 +338,11 @@ class DotEffect(Effect):
     def background(self):
         return self.__background
 
-    def do_effect(self, painting):
+    @property
+    def parameters(self):
+        return self.radius, self.gap, self.background.color
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
         """Process an image so that it is made up of circles.
 
         This method processes an image so that it is made up of circles
@@ -91,22 +352,213 @@ class DotEffect(Effect):
 
         Arguments:
         painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
         """
 
-        distance_between_centres = self.diameter + self.gap
-        # Half of distance so that circles fully visible on top and left edges
-        first_centre = distance_between_centres/2
-        canvas = painting.copy()
-        canvas.clear_image(self.background)
+        painting.img = self.get_result(painting, progress_callback, cancel_token)
+
+    def get_result(self, painting, progress_callback=None, cancel_token=None):
+        """Return a new painting.Painting made up of circles.
 
-        for x in range(first_centre, painting.width, distance_between_centres):
-            for y in range(first_centre, painting.height, distance_between_centres):
-                centre = point.Point(x, y)
-                centre_color = painting.get_pixel_color(centre)
-                circle = shape.Circle(centre, self.radius, centre_color)
-                circle.draw(canvas)
+        If the painting was decoded at a reduced scale, the result is
+        still the size of the source and the colour of each circle is
+        taken from the matching pixel of the reduced image.
+        Progress is reported after each circle.
 
-        painting.img = canvas
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
+        """
+
+        canvas = self.__get_canvas(painting)
+        samples = self.__get_samples(painting)
+        tracker = progress.Tracker(progress_callback, cancel_token, len(samples))
+        self.__draw_circles(painting, canvas, samples, tracker)
+        tracker.finish()
+        return canvas
+
+    def apply_strip(self, painting, top, bottom):
+        """Return a strip of rows of the result, only drawing the circles that cross it.
+
+        Circles are never drawn on the first row of the canvas, so below
+        the first row of the image the strip is drawn on a canvas that
+        starts a row above it, which is then cropped off.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        top -- the first row of the strip as an int
+        bottom -- the row after the last row of the strip as an int
+        """
+
+        canvas_top = max(0, top - 1)
+        canvas = self.__get_canvas(painting, canvas_top, bottom)
+        samples = [(point.Point(centre.x, centre.y - canvas_top), sample)
+                   for centre, sample in self.__get_samples(painting)
+                   if centre.y - self.radius < bottom and centre.y + self.radius >= canvas_top]
+        self.__draw_circles(painting, canvas, samples, progress.Tracker())
+        if canvas_top == top:
+            return canvas
+        return canvas.crop((0, top - canvas_top, canvas.width, canvas.height))
+
+    def iter_refinements(self, painting):
+        """Yield the circles drawn on the canvas a coarse grid at a time.
+
+        The first painting only has every REFINEMENT_STRIDES[0]th circle
+        across and down, and each one after fills in the circles between
+        them, until the last is identical to the result of get_result.
+        The same painting.Painting is yielded each time, with its dirty
+        regions covering what changed, so it should be copied to be kept.
+        Circles that overlap have to be drawn in order to cover each other
+        the same way, so for those the last painting is drawn again from scratch.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        """
+
+        canvas = self.__get_canvas(painting)
+        samples = self.__get_samples(painting)
+        mask = shape.get_circle_mask(self.radius)[0]
+        overlapping = mask is not None and max(mask.size) > self.distance_between_centres
+        distance_between_centres = self.distance_between_centres
+
+        def in_grid(centre, stride):
+            return (centre.x / distance_between_centres) % stride == 0 and \
+                (centre.y / distance_between_centres) % stride == 0
+
+        drawn_stride = None
+        for stride in REFINEMENT_STRIDES:
+            if overlapping and stride == 1:
+                exact_canvas = self.__get_canvas(painting)
+                self.__draw_circles(painting, exact_canvas, samples, progress.Tracker())
+                canvas.img = exact_canvas
+            else:
+                pass_samples = [(centre, sample) for centre, sample in samples if in_grid(centre, stride) and
+                                not (drawn_stride and in_grid(centre, drawn_stride))]
+                if not pass_samples and stride != 1:
+                    continue
+                self.__draw_circles(painting, canvas, pass_samples, progress.Tracker())
+            drawn_stride = stride
+            yield canvas
+
+    def get_required_size(self, size):
+        """Return the smallest size of the image that the effect needs as a tuple.
+
+        Only one pixel is read for each circle, so an image with a pixel
+        for every circle is enough.
+
+        Arguments:
+        size -- the full size of the image the effect is applied to as a tuple
+        """
+
+        return (max(1, size[0] / self.distance_between_centres),
+                max(1, size[1] / self.distance_between_centres))
+
+    def __get_samples(self, source_painting):
+        """Return a list of (centre, sample) of where each circle goes and where its colour is read.
+
+        Arguments:
+        source_painting -- the painting.Painting that the effect is applied to
+        """
+
+        source_width, source_height = source_painting.source_size
+        samples = []
+        for centre in self.__get_centres(source_painting.source_size):
+            sample = centre
+            if source_painting.is_reduced:
+                sample = point.Point(centre.x * source_painting.width / source_width,
+                                     centre.y * source_painting.height / source_height)
+            samples.append((centre, sample))
+        return samples
+
+    def __draw_circles(self, source_painting, canvas, samples, tracker):
+        """Draw circles on the canvas with the backend in use.
+
+        Arguments:
+        source_painting -- the painting.Painting that the effect is applied to
+        canvas -- the painting.Painting that the circles are drawn on
+        samples -- list of (centre, sample) of where each circle goes and where its colour is read
+        tracker -- the progress.Tracker advanced after each circle
+        """
+
+        if get_backend() == NATIVE_BACKEND and source_painting.mode in NATIVE_MODES:
+            self.__draw_circles_native(source_painting, canvas, samples, tracker)
+            return
+
+        for centre, sample in samples:
+            centre_color = source_painting.get_pixel_color(sample)
+            circle = shape.Circle(centre, self.radius, centre_color)
+            circle.draw(canvas)
+            tracker.advance()
+
+    def __draw_circles_native(self, source_painting, canvas, samples, tracker):
+        """Draw the circles by pasting their colours through a circle mask.
+
+        Each circle is a single paste, in the same order as the python
+        backend so that overlapping circles cover each other the same way.
+        Circle.draw never sets the first row and column of the canvas, so
+        they are filled with the background again afterwards.
+
+        Arguments:
+        source_painting -- the painting.Painting that the effect is applied to
+        canvas -- the painting.Painting filled with the background that the circles are drawn on
+        samples -- list of (centre, sample) of where each circle goes and where its colour is read
+        tracker -- the progress.Tracker advanced after each circle
+        """
+
+        mask, (left, top) = shape.get_circle_mask(self.radius)
+        if mask is None:
+            return
+
+        background = canvas.img.getpixel((0, 0))
+        for centre, sample in samples:
+            centre_color = source_painting.pixels[sample.coordinates]
+            canvas.img.paste(centre_color, (centre.x + left, centre.y + top), mask)
+            tracker.advance()
+        canvas.img.paste(background, (0, 0, canvas.width, 1))
+        canvas.img.paste(background, (0, 0, 1, canvas.height))
+        canvas.mark_dirty((0, 0, canvas.width, canvas.height))
+
+    def __get_canvas(self, source_painting, top=0, bottom=None):
+        """Return a painting.Painting the size of the source filled with the background.
+
+        Arguments:
+        source_painting -- the painting.Painting that the effect is applied to
+        top -- the first row of the source the canvas covers as an int
+        bottom -- the row after the last row the canvas covers, or None for the last row of the source
+        """
+
+        width, height = source_painting.source_size
+        if bottom is None:
+            bottom = height
+        return painting.Painting(Image.new(source_painting.mode, (width, bottom - top), self.background.color))
+
+    def __get_centres(self, size):
+        """Return the centres of the circles for an image of the given size.
+
+        The centres are only worked out again when the size changes, so
+        they are shared between images of the same size such as the frames
+        of an animation. The list is built before it is kept, so threads
+        applying the effect to images of other sizes never share it.
+
+        Arguments:
+        size -- the size of the image as a tuple
+        """
+
+        centres_size, centres = self.__sized_centres
+        if size != centres_size:
+            distance_between_centres = self.distance_between_centres
+            # Half of distance so that circles fully visible on top and left edges
+            first_centre = distance_between_centres/2
+            width, height = size
+
+            centres = []
+            for x in range(first_centre, width, distance_between_centres):
+                for y in range(first_centre, height, distance_between_centres):
+                    centres.append(point.Point(x, y))
+            self.__sized_centres = (size, centres)
+        return centres
 
 
 class ShuffleEffect(Effect):
@@ -115,21 +567,28 @@ class ShuffleEffect(Effect):
 
     This class contains fields and methods that relate to shuffling the
     pixels in an image.
+    It works a pixel at a time with either backend, as each square is
+    shuffled differently.
 
     Public methods:
     do_effect -- applies the effect to the supplied Painting
     """
 
-    def __init__(self, shuffle_step, randomness):
+    def __init__(self, shuffle_step, randomness, seed=None):
         """Initialise the properties.
 
+        If no seed is given, a different one is picked each time the
+        effect is applied, so the result is different every time.
+
         Arguments:
         shuffle_step -- base amount that the pixels are allowed to move as an int
         randomness -- amount that the shuffle_step is allowed to vary for each pixel as an int
+        seed -- integer that the random square sizes and shuffles are derived from
         """
 
         self.__shuffle_step = shuffle_step
         self.__randomness = randomness
+        self.__seed = seed
 
     @property
     def shuffle_step(self):
@@ -139,32 +598,116 @@ class ShuffleEffect(Effect):
     def randomness(self):
         return self.__randomness
 
-    def do_effect(self, painting):
+    @property
+    def seed(self):
+        return self.__seed
+
+    @property
+    def parameters(self):
+        return self.shuffle_step, self.randomness, self.seed
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
         """Process an image so that its pixels are shuffled.
 
         This method processes an image so that the pixels of the
         image are shuffled with nearby pixels.
+        Progress is reported after each column of squares.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
+        """
+
+        seed = self.seed
+        if seed is None:
+            seed = random.getrandbits(SEED_BITS)
+
+        tracker = progress.Tracker(progress_callback, cancel_token, len(range(0, painting.width, self.shuffle_step)))
+        shuffled_painting = painting.copy()
+        self.__shuffle_squares(painting, shuffled_painting, 0, seed, tracker)
+        tracker.finish()
+        painting.img = shuffled_painting
+
+    def apply_strip(self, painting, top, bottom):
+        """Return a strip of rows of the shuffled image.
+
+        Only the squares that overlap the strip are shuffled. As the
+        randomness for each square only depends on the seed and the
+        position of the square, the strips are identical to the same rows
+        of the result of do_effect, however the image is split up.
 
         Arguments:
         painting -- the painting.Painting that the effect should be applied to
+        top -- the first row of the strip as an int
+        bottom -- the row after the last row of the strip as an int
+        """
+
+        if self.seed is None:
+            raise ValueError("ShuffleEffect needs a seed to be applied in strips")
+
+        strip = painting.crop((0, top, painting.width, bottom))
+        self.__shuffle_squares(painting, strip, top, self.seed, progress.Tracker())
+        return strip
+
+    def __shuffle_squares(self, original_painting, canvas, top, seed, tracker):
+        """Shuffle the pixels in each square onto the canvas.
+
+        This method shuffles the pixels in the square around each step of
+        the image and draws them onto the canvas. The canvas can be a strip
+        of the image starting at the row top, in which case only squares
+        that overlap it are shuffled and only pixels inside it are drawn.
+
+        Arguments:
+        original_painting -- the painting.Painting that pixels are taken from
+        canvas -- the painting.Painting that shuffled pixels are drawn on
+        top -- the row of the original painting that the canvas starts at
+        seed -- integer that the randomness of each square is derived from
+        tracker -- the progress.Tracker advanced after each column of squares
         """
 
-        original_painting = painting.copy()
-        for x in range(0, painting.width, self.shuffle_step):
-            for y in range(0, painting.height, self.shuffle_step):
+        bottom = top + canvas.height
+
+        for x in range(0, original_painting.width, self.shuffle_step):
+            for y in range(0, original_painting.height, self.shuffle_step):
+                square_random = self.__get_square_random(seed, x / self.shuffle_step, y / self.shuffle_step)
+                squaresize = self.__get_random_squaresize(square_random)
+                # Squares that don't overlap the canvas can be skipped entirely
+                if y + squaresize/2 <= top or y - squaresize/2 >= bottom:
+                    continue
+
                 current_coordinate = point.Point(x, y)
-                squaresize = self.__get_random_squaresize()
                 pixel_square = original_painting.get_square(current_coordinate,
                                                             squaresize, squaresize)
                 shuffled_pixel_square = pixel_square
-                random.shuffle(shuffled_pixel_square)
+                square_random.shuffle(shuffled_pixel_square)
 
                 for pixel in pixel_square:
                     new_pixel_color = original_painting.get_pixel_color(pixel)
                     pixel_to_be_replaced = shuffled_pixel_square.pop()
-                    painting.set_pixel_color(pixel_to_be_replaced, new_pixel_color)
+                    if top <= pixel_to_be_replaced.y < bottom:
+                        canvas_coordinate = point.Point(pixel_to_be_replaced.x, pixel_to_be_replaced.y - top)
+                        canvas.set_pixel_color(canvas_coordinate, new_pixel_color)
+            tracker.advance()
+
+    def __get_square_random(self, seed, block_x, block_y):
+        """Return the random number generator for one square.
+
+        This method returns a random.Random seeded from the effect's seed
+        and the position of the square in the grid of squares, so that each
+        square always gets the same random numbers no matter what order
+        the squares are processed in.
+
+        Arguments:
+        seed -- integer that the randomness of each square is derived from
+        block_x -- column of the square in the grid of squares
+        block_y -- row of the square in the grid of squares
+        """
+
+        square_key = "%d:%d:%d" % (seed, block_x, block_y)
+        return random.Random(int(hashlib.sha1(square_key).hexdigest(), 16))
 
-    def __get_random_squaresize(self):
+    def __get_random_squaresize(self, square_random):
         """Return a random square size.
 
         This method returns a random integer based on the
@@ -172,10 +715,13 @@ class ShuffleEffect(Effect):
         the square size.
         The square size is random so that the resulting image
         is less uniform and grid-like.
+
+        Arguments:
+        square_random -- the random.Random of the square
         """
 
-        squaresize = random.randrange(self.shuffle_step,
-                                      self.shuffle_step * self.randomness)
+        squaresize = square_random.randrange(self.shuffle_step,
+                                             self.shuffle_step * self.randomness)
         return squaresize
 
 
@@ -190,6 +736,8 @@ class ThreeColorEffect(Effect):
     do_effect -- applies the effect to the supplied Painting
     """
 
+    pointwise = True
+
     def __init__(self, threshold, difference, replacement_colors):
         """Initialises the properties.
 
@@ -215,7 +763,12 @@ class ThreeColorEffect(Effect):
     def replacement_colors(self):
         return self.__replacement_colors
 
-    def do_effect(self, painting):
+    @property
+    def parameters(self):
+        replacement_colors = tuple(replacement_color.color for replacement_color in self.replacement_colors)
+        return self.threshold, self.difference, replacement_colors
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
         """Process an image so that it is made up of three colours and black.
 
         This method processes an image so that it is made up of three colours and
@@ -223,16 +776,107 @@ class ThreeColorEffect(Effect):
         dependant on the dominant colour component of the pixel.
         Note that this effect is currently only compatible with RGB images that
         don't have an alpha channel.
+        Progress is reported after each column of each pass over the image.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
+        """
+
+        if get_backend() == NATIVE_BACKEND and painting.mode in NATIVE_MODES:
+            tracker = progress.Tracker(progress_callback, cancel_token, color.RGB_COMPONENT_COUNT + 1)
+            new_image = self.__get_image_native(painting, tracker)
+            tracker.finish()
+            painting.img = new_image
+            return
+
+        tracker = progress.Tracker(progress_callback, cancel_token, (color.RGB_COMPONENT_COUNT + 1) * painting.width)
+        new_painting = painting.copy()
+        for component_index in range(color.RGB_COMPONENT_COUNT):
+            self.__change_dominant_color(component_index, new_painting, tracker)
+        self.__change_rest_to_black(new_painting, tracker)
+        tracker.finish()
+        painting.img = new_painting
+
+    def __get_image_native(self, painting, tracker):
+        """Return the processed image, built from Pillow operations on whole bands.
+
+        Like the python backend, each replacement colour is applied in
+        turn to the result of the one before, and then every pixel that
+        isn't exactly one of the replacement colours becomes black.
 
         Arguments:
         painting -- the painting.Painting that the effect should be applied to
+        tracker -- the progress.Tracker advanced after each replacement colour
+        """
+
+        new_image = painting.img.copy()
+        for component_index in range(color.RGB_COMPONENT_COUNT):
+            dominant_mask = self.__get_dominant_mask(new_image.split(), component_index)
+            replacement_color = _get_stored_color(new_image.mode, self.replacement_colors[component_index].color)
+            new_image.paste(replacement_color, None, dominant_mask)
+            tracker.advance()
+
+        result = Image.new(new_image.mode, new_image.size, _get_stored_color(new_image.mode, color.BLACK))
+        replaced_mask = self.__get_replaced_mask(new_image)
+        if replaced_mask is not None:
+            result.paste(new_image, None, replaced_mask)
+        return result
+
+    def __get_dominant_mask(self, bands, target_component_index):
+        """Return an "L" mask of the pixels whose target component is dominant.
+
+        The check that another component is less than the target component
+        times the difference is done with a lookup table of the largest
+        value the other component can have for each value of the target
+        component, so it matches the python backend's floating point
+        comparison exactly.
+
+        Arguments:
+        bands -- tuple of an "L" image of each band of the image
+        target_component_index -- the index of the RGB colour component to be checked
         """
 
+        values = range(color.MAX_COMPONENT_VALUE + 1)
+        # Other components have to be less than value * difference, so at most this
+        limits = [int(math.ceil(value * self.difference)) - 1 for value in values]
+        target_band = bands[target_component_index]
+
+        dominant_mask = target_band.point([255 if value > self.threshold and limits[value] >= 0 else 0
+                                           for value in values])
+        limit_band = target_band.point([max(0, min(limit, color.MAX_COMPONENT_VALUE)) for limit in limits])
         for component_index in range(color.RGB_COMPONENT_COUNT):
-            self.__change_dominant_color(component_index, painting)
-        self.__change_rest_to_black(painting)
+            if component_index != target_component_index:
+                # Zero wherever the component is no more than its limit
+                excess = ImageChops.subtract(bands[component_index], limit_band)
+                dominant_mask = ImageChops.darker(dominant_mask, excess.point([255] + [0] * color.MAX_COMPONENT_VALUE))
+        return dominant_mask
+
+    def __get_replaced_mask(self, new_image):
+        """Return an "L" mask of the pixels that are exactly one of the replacement colours.
 
-    def __change_dominant_color(self, current_component_index, painting):
+        Returns None if no pixel can match, for example because the
+        replacement colours have a different number of components to the image.
+
+        Arguments:
+        new_image -- the image after the replacement colours have been applied
+        """
+
+        bands = new_image.split()
+        replaced_mask = None
+        for replacement_color in self.replacement_colors:
+            if len(replacement_color.color) != len(bands):
+                continue
+            color_mask = None
+            for band, component in zip(bands, replacement_color.color):
+                band_mask = band.point([255 if value == component else 0
+                                        for value in range(color.MAX_COMPONENT_VALUE + 1)])
+                color_mask = band_mask if color_mask is None else ImageChops.darker(color_mask, band_mask)
+            replaced_mask = color_mask if replaced_mask is None else ImageChops.lighter(replaced_mask, color_mask)
+        return replaced_mask
+
+    def __change_dominant_color(self, current_component_index, painting, tracker):
         """Change the pixel to the appropriate replacement colour.
 
         This method changes the colour of the pixel to the replacement
@@ -241,6 +885,7 @@ class ThreeColorEffect(Effect):
         Arguments:
         current_component_index -- the index of the RGB colour component to be checked
         painting -- the Painting to be processed
+        tracker -- the progress.Tracker advanced after each column
         """
 
         for x in range(painting.width):
@@ -251,6 +896,7 @@ class ThreeColorEffect(Effect):
 
                 if can_change:
                     painting.set_pixel_color(current_coordinate, self.replacement_colors[current_component_index])
+            tracker.advance()
 
     def __check_dominant_color(self, current_pixel_color, target_component_index):
         """Check if the target colour component in a pixel is dominant.
@@ -282,7 +928,7 @@ class ThreeColorEffect(Effect):
 
         return can_change
 
-    def __change_rest_to_black(self, painting):
+    def __change_rest_to_black(self, painting, tracker):
         """Change the remaining pixels to black.
 
         This method changes the colour of any pixel that
@@ -290,6 +936,7 @@ class ThreeColorEffect(Effect):
 
         Arguments:
         painting -- the painting.Painting to be processed
+        tracker -- the progress.Tracker advanced after each column
         """
 
         for x in range(painting.width):
@@ -298,6 +945,7 @@ class ThreeColorEffect(Effect):
                 current_pixel_color = painting.get_pixel_color(current_coordinate)
                 if current_pixel_color not in self.replacement_colors:
                     painting.set_pixel_color(current_coordinate, color.Color(*color.BLACK))
+            tracker.advance()
 
 
 class TileEffect(Effect):
@@ -306,9 +954,14 @@ class TileEffect(Effect):
 
     This class contains fields and methods that relate to posterising an
     image based on given colours and then tiling them in a grid.
+    It is built from Pillow operations with either backend.
 
     Public methods:
     do_effect -- applies the effect to the supplied Painting
+    apply_strip -- return a strip of the result, only pasting the tiles that cross it
+    get_output_size -- return the size of the tiled image
+    get_required_size -- return the resolution of the image the effect needs to read
+    iter_refinements -- yield coarsely posterised tiles, then the exact ones
     """
 
     def __init__(self, colors, levels, size):
@@ -323,6 +976,9 @@ class TileEffect(Effect):
         self.__colors = colors
         self.__levels = levels
         self.__size = size
+        # These only depend on the properties, so are shared between images
+        self.__band_table = None
+        self.__palettes = {}
 
     @property
     def colors(self):
@@ -340,7 +996,11 @@ class TileEffect(Effect):
     def size(self):
         return self.__size
 
-    def do_effect(self, painting):
+    @property
+    def parameters(self):
+        return tuple(tile_color.color for tile_color in self.colors), self.levels, self.size
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
         """Process an image so that it is posterised and tiled.
 
         This method processes an image so that the resulting image is
@@ -350,33 +1010,90 @@ class TileEffect(Effect):
 
         Arguments:
         painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
         """
 
-        paintings = self.__get_paintings(painting)
-        # No need to assign/return as lists in python are passed by reference!
-        self.__color_posterise(paintings)
-        new_painting = self.__tile_images(paintings)
-        painting.img = new_painting
+        painting.img = self.get_result(painting, progress_callback, cancel_token)
+
+    def get_result(self, painting, progress_callback=None, cancel_token=None):
+        """Return a new painting.Painting that is posterised and tiled.
+
+        The resized painting and its luminance are cached on the supplied
+        painting, so they are shared with any other TileEffect of the same
+        size applied to it.
+        Progress is reported once the band map is ready and after each tile.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
+        """
+
+        tracker = progress.Tracker(progress_callback, cancel_token, self.size * self.size + 1)
+        tile_size = self.__get_tile_size(painting)
+        smaller_painting = painting.get_derived(("resized", tile_size),
+                                                lambda: self.__resize_painting(painting))
+        band_map = self.__get_band_map(smaller_painting)
+        tracker.advance()
+        canvas = self.__tile_images(smaller_painting, band_map, tracker)
+        tracker.finish()
+        return canvas
+
+    def apply_strip(self, painting, top, bottom):
+        """Return a strip of rows of the result, only pasting the tiles that cross it.
+
+        The painting is still resized to the size of a tile and made into a
+        band map as a whole, as every tile is made from all of it.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        top -- the first row of the strip as an int
+        bottom -- the row after the last row of the strip as an int
+        """
+
+        tile_size = self.__get_tile_size(painting)
+        smaller_painting = painting.get_derived(("resized", tile_size),
+                                                lambda: self.__resize_painting(painting))
+        band_map = self.__get_band_map(smaller_painting)
+        return self.__tile_images(smaller_painting, band_map, progress.Tracker(), top, bottom)
 
-    def __get_paintings(self, painting):
-        """Return a list of copies of the painting suitable for tiling.
+    def iter_refinements(self, painting):
+        """Yield coarsely posterised tiles, then the exact result.
 
-        This method resizes the painting so that the resulting
-        image after tiling is roughly the same size as the original image.
-        It then adds a number of copies of the resized painting corresponding
-        to the number of colours to a list and returns it.
+        The coarse tiles are posterised from the painting shrunk to a tile
+        COARSE_TILE_SCALE times smaller without any filtering, and
+        stretched to the size of the result, so they are ready long before
+        the painting is resized properly. The same painting.Painting is
+        yielded each time, so it should be copied to be kept. Tiles too
+        small to shrink only yield the exact result.
 
         Arguments:
-        painting -- the painting to be resize, duplicated, and added to the list
+        painting -- the painting.Painting that the effect should be applied to
         """
 
-        paintings = []
-        smaller_painting = self.__resize_painting(painting)
+        tile_width, tile_height = self.__get_tile_size(painting)
+        if min(tile_width, tile_height) <= COARSE_TILE_SCALE:
+            yield self.get_result(painting)
+            return
+
+        canvas = self.__get_coarse_tiles(painting, (tile_width / COARSE_TILE_SCALE, tile_height / COARSE_TILE_SCALE))
+        yield canvas
+        canvas.img = self.get_result(painting)
+        yield canvas
 
-        for i in range(self.number_of_colors):
-            new_painting = smaller_painting.copy()
-            paintings.append(new_painting)
-        return paintings
+    def __get_coarse_tiles(self, source_painting, coarse_size):
+        """Return a painting.Painting of tiles posterised from a tiny copy of the painting.
+
+        Arguments:
+        source_painting -- the painting.Painting that the effect is applied to
+        coarse_size -- the size of each coarse tile as a tuple
+        """
+
+        coarse_painting = painting.Painting(source_painting.img.resize(coarse_size, Image.NEAREST))
+        coarse_tiles = self.__tile_images(coarse_painting, self.__get_band_map(coarse_painting), progress.Tracker())
+        output_size = self.get_output_size(source_painting.source_size)
+        return painting.Painting(coarse_tiles.img.resize(output_size, Image.NEAREST))
 
     def __resize_painting(self, painting):
         """Return a copy of the painting that is the size of a tile.
@@ -393,63 +1110,120 @@ class TileEffect(Effect):
         smaller_painting = painting.resize(tile_size)
         return smaller_painting
 
-    def __color_posterise(self, paintings):
-        """Posterise each painting in the supplied list.
+    def __get_band_table(self):
+        """Return a lookup table from luminance to posterisation band.
 
-        This method posterises each painting.Painting in the
-        supplied list based on the colours in self.colors.
+        This method returns a list with an entry for every possible
+        luminance value, giving the index of the posterisation band that
+        the luminance falls into.
+        Luminance values that don't fall into any band map to UNCHANGED_BAND
+        so that those pixels keep their original colour.
+        """
+
+        lum_step = float(color.MAX_COMPONENT_VALUE) / self.levels
+        band_table = []
+
+        for luminance in range(color.MAX_COMPONENT_VALUE + 1):
+            if luminance <= lum_step:
+                band_table.append(0)
+            else:
+                band = UNCHANGED_BAND
+                lum = lum_step
+                next_lum = lum + lum_step
+                # It has done 1 iteration of luminance checking at this stage
+                iterations = 1
+
+                # Cycle through the luminance thresholds
+                while lum < color.MAX_COMPONENT_VALUE:
+                    if lum < luminance <= next_lum:
+                        band = iterations
+                        break
+                    else:
+                        lum = next_lum
+                        next_lum = lum + lum_step
+                        iterations += 1
+                band_table.append(band)
+        return band_table
+
+    def __get_band_map(self, painting):
+        """Return an index image of the posterisation band of each pixel.
+
+        This method returns an "L" mode image the same size as the painting
+        where each pixel holds the index of the posterisation band that the
+        luminance of the corresponding pixel falls into.
+        All tiles share this band map and only differ in their palette.
 
         Arguments:
-        paintings -- list of identical paintings to be processed
+        painting -- the painting.Painting that the band map should be based on
         """
 
-        # All paintings in paintings are the same at this point, so
-        # arbitrarily using paintings[0] to get the data from the image
-        for x in range(paintings[0].width):
-            for y in range(paintings[0].height):
-                current_coordinate = point.Point(x, y)
-                current_pixel_color = paintings[0].get_pixel_color(current_coordinate)
-                lum_step = float(color.MAX_COMPONENT_VALUE) / self.levels
-                difference = color.MAX_COMPONENT_VALUE / self.levels
-
-                if current_pixel_color.luminance <= lum_step:
-                    for i in range(self.number_of_colors):
-                        target_color = self.colors[i].copy()
-                        paintings[i].set_pixel_color(current_coordinate, target_color)
-                else:
-                    lum = lum_step
-                    next_lum = lum + lum_step
-                    # It has done 1 iteration of luminance checking at this stage
-                    iterations = 1
-
-                    # Cycle through the luminance thresholds
-                    while lum < color.MAX_COMPONENT_VALUE:
-                        if lum < current_pixel_color.luminance <= next_lum:
-                            for i in range(self.number_of_colors):
-                                target_color = self.colors[i].copy()
-                                target_color.color = target_color + (difference * iterations)
-                                paintings[i].set_pixel_color(current_coordinate, target_color)
-                            # Move on to next pixel when threshold is found
-                            break
-
-                        else:
-                            lum = next_lum
-                            next_lum = lum + lum_step
-                            iterations += 1
+        luminance = painting.get_luminance()
+        if self.__band_table is None:
+            self.__band_table = self.__get_band_table()
+        band_map = luminance.point(self.__band_table)
+        return band_map
+
+    def __get_palette(self, base_color):
+        """Return the palette that colours the band map for one tile.
+
+        This method returns a flat list of RGB values where the entry
+        at each band index is the posterised colour for that band.
+
+        Arguments:
+        base_color -- the color.Color that the posterisation is based on
+        """
+
+        if base_color.color in self.__palettes:
+            return self.__palettes[base_color.color]
+
+        difference = color.MAX_COMPONENT_VALUE / self.levels
+        palette = []
+
+        for band in range(UNCHANGED_BAND + 1):
+            for component_index in range(color.RGB_COMPONENT_COUNT):
+                component = base_color.get_component_by_index(component_index) + (difference * band)
+                # Pixels can't store values outside of the valid range
+                palette.append(max(0, min(component, color.MAX_COMPONENT_VALUE)))
+        self.__palettes[base_color.color] = palette
+        return palette
+
+    def get_output_size(self, size):
+        """Return the size of the tiled image as a tuple.
+
+        Arguments:
+        size -- the size of the image the effect is applied to as a tuple
+        """
+
+        tile_width = size[0] / self.size
+        tile_height = size[1] / self.size
+        return tile_width * self.size, tile_height * self.size
+
+    def get_required_size(self, size):
+        """Return the smallest size of the image that the effect needs as a tuple.
+
+        The image is shrunk to the size of a tile before anything else,
+        so it only needs to be decoded at that size.
+
+        Arguments:
+        size -- the full size of the image the effect is applied to as a tuple
+        """
+
+        return max(1, size[0] / self.size), max(1, size[1] / self.size)
 
     def __get_tile_size(self, painting):
         """Return the size of that each tile should be.
 
         This method returns the size that each tile should be
         as a tuple such that the resulting image will be roughly
-        the same size as the original image.
+        the same size as the original image, before it was decoded at
+        a reduced scale.
 
         Arguments:
         painting -- the painting.Painting the size should be based on
         """
 
-        tile_width = painting.width / self.size
-        tile_height = painting.height / self.size
+        tile_width = painting.source_size[0] / self.size
+        tile_height = painting.source_size[1] / self.size
         return tile_width, tile_height
 
     def __get_canvas_size(self, painting):
@@ -466,29 +1240,442 @@ class TileEffect(Effect):
         canvas_height = painting.height * self.size
         return canvas_width, canvas_height
 
-    def __tile_images(self, paintings):
-        """Tile each painting in the list into a grid of the given size.
+    def __tile_images(self, smaller_painting, band_map, tracker, top=0, bottom=None):
+        """Tile the band map coloured by each colour into a grid of the given size.
 
-        This method tiles each Painting in the supplied list of paintings
-        in a grid of self.size*self.size tiles.
-        It loops back to first Painting in paintings if there are more tiles
+        This method tiles the band map in a grid of self.size*self.size
+        tiles, swapping in the palette for the next colour before each
+        tile is pasted.
+        It loops back to first colour in colors if there are more tiles
         than colors provided.
+        Any pixels whose luminance didn't fall into a band are restored
+        from the resized painting.
+        The canvas can be a strip of the grid from the row top, in which
+        case only the tiles that overlap it are pasted.
 
         Arguments:
-        paintings -- list of Painting object instances
+        smaller_painting -- the resized painting.Painting the band map was made from
+        band_map -- "L" mode image of the posterisation band of each pixel
+        tracker -- the progress.Tracker advanced after each tile
+        top -- the first row of the grid the canvas covers as an int
+        bottom -- the row after the last row the canvas covers, or None for the bottom of the grid
         """
 
-        # Start at first painting in list, index 0
+        unchanged_mask = band_map.point(lambda band: 255 if band == UNCHANGED_BAND else 0)
+        has_unchanged = unchanged_mask.getbbox() is not None
+        # Start at first colour in list, index 0
         index = 0
-        current_painting = paintings[index]
-        # Can use any of the paintings to get the size as they are all same size
-        canvas = painting.Painting(Image.new(current_painting.mode, self.__get_canvas_size(current_painting)))
-
-        for x in range(0, canvas.width, current_painting.width):
-            for y in range(0, canvas.height, current_painting.height):
-                coordinates = point.Point(x, y)
-                canvas.paste(current_painting, coordinates)
+        grid_width, grid_height = self.__get_canvas_size(smaller_painting)
+        if bottom is None:
+            bottom = grid_height
+        canvas = painting.Painting(Image.new(smaller_painting.mode, (grid_width, bottom - top)))
+
+        for x in range(0, grid_width, smaller_painting.width):
+            for y in range(0, grid_height, smaller_painting.height):
+                # Tiles outside the canvas still use up their colour
+                if top < y + smaller_painting.height and y < bottom:
+                    coordinates = point.Point(x, y - top)
+                    # So that it doesn't matter if there are more tiles than colours
+                    # Setting the palette turns the band map into a "P" image in place
+                    band_map.putpalette(self.__get_palette(self.colors[index % self.number_of_colors]))
+                    canvas.img.paste(band_map, coordinates.coordinates)
+                    if has_unchanged:
+                        canvas.img.paste(smaller_painting.img, coordinates.coordinates, unchanged_mask)
                 index += 1
-                # So that it doesn't matter if there are more tiles than colours
-                current_painting = paintings[index % len(paintings)]
-        return canvas
\ No newline at end of file
+                tracker.advance()
+        return canvas
+
+
+class QuantizeEffect(Effect):
+
+    """Store fields and methods used to reduce an image to a palette.
+
+    This class contains fields and methods that relate to processing an
+    image so that every pixel is replaced by the nearest colour in a palette.
+    The palette can either be supplied, or built from the image by giving
+    the number of colours it should contain. Images that already have no
+    more than k colours are left as they are, as each colour is its own
+    nearest.
+
+    Public methods:
+    do_effect -- applies the effect to the supplied Painting
+    """
+
+    def __init__(self, palette=None, k=None):
+        """Initialises the properties.
+
+        Exactly one of palette and k should be given.
+
+        Arguments:
+        palette -- a list of color.Color that pixels will be replaced by
+        k -- the number of colours to build the palette from as an integer
+        """
+
+        if (palette is None) == (k is None):
+            raise ValueError("Exactly one of palette and k must be given")
+        number_of_colors = k if palette is None else len(palette)
+        if not 0 < number_of_colors <= MAX_PALETTE_COLORS:
+            raise ValueError("Palette must have between 1 and %d colours" % MAX_PALETTE_COLORS)
+
+        self.__palette = palette
+        self.__k = k
+
+    @property
+    def palette(self):
+        return self.__palette
+
+    @property
+    def k(self):
+        return self.__k
+
+    @property
+    def pointwise(self):
+        # A palette built from the image depends on more than one pixel
+        return self.palette is not None
+
+    @property
+    def parameters(self):
+        palette = None
+        if self.palette is not None:
+            palette = tuple(palette_color.color for palette_color in self.palette)
+        return palette, self.k
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
+        """Process an image so that it is made up of the palette colours.
+
+        This method processes an image so that each pixel is replaced by
+        the palette colour nearest to it, with ties going to the earlier
+        palette colour. If no palette was given, one with k colours is
+        built from a sample of the image first, unless the image has no
+        more than k colours.
+        The nearest colour is worked out once for each distinct colour in
+        the image, and the pixels are mapped to them with Pillow's lookup
+        tables rather than one at a time.
+        The alpha channel of RGBA images is left untouched.
+        Progress is reported once the palette is ready, once the nearest
+        colours are found and once the image is quantized.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        progress_callback -- function called with the work done and the total work, or None
+        cancel_token -- progress.CancellationToken the effect can be cancelled with, or None
+        """
+
+        tracker = progress.Tracker(progress_callback, cancel_token, 3)
+        rgb_image = painting.img.convert("RGB")
+        alpha = None
+        if painting.mode == "RGBA":
+            alpha = painting.get_channels()[color.A_INDEX]
+
+        if self.palette is None and rgb_image.getcolors(self.k) is not None:
+            new_image = rgb_image
+        else:
+            palette = self.__get_palette(rgb_image)
+            tracker.advance()
+            new_image = self.__quantize(rgb_image, palette, tracker)
+        if alpha is not None:
+            new_image.putalpha(alpha)
+        new_image = new_image.convert(painting.mode)
+        tracker.finish()
+        painting.img = new_image
+
+    def __get_palette(self, rgb_image):
+        """Return the palette to quantize to as a list of RGB tuples.
+
+        Arguments:
+        rgb_image -- the "RGB" Image.Image the palette may be built from
+        """
+
+        if self.palette is not None:
+            return [tuple(palette_color.color[:color.RGB_COMPONENT_COUNT]) for palette_color in self.palette]
+
+        flat_palette = self.__build_palette(rgb_image)
+        return [tuple(flat_palette[index:index + color.RGB_COMPONENT_COUNT])
+                for index in range(0, len(flat_palette), color.RGB_COMPONENT_COUNT)]
+
+    def __quantize(self, rgb_image, palette, tracker):
+        """Return an "RGB" image with each pixel replaced by the nearest palette colour.
+
+        Arguments:
+        rgb_image -- the "RGB" Image.Image to quantize
+        palette -- list of the RGB tuples to quantize to
+        tracker -- the progress.Tracker advanced once the nearest colours are found
+        """
+
+        colors = [pixel_color for count, pixel_color in rgb_image.getcolors(rgb_image.width * rgb_image.height)]
+        nearest_indexes = _get_nearest_indexes(colors, palette)
+        tracker.advance()
+
+        index_values = dict((pixel_color, (index,)) for pixel_color, index in nearest_indexes.iteritems())
+        index_image, = map_colors(rgb_image, index_values)
+        flat_palette = []
+        for palette_color in palette:
+            flat_palette.extend(palette_color)
+        index_image.putpalette(flat_palette)
+        return index_image.convert("RGB")
+
+    def __build_palette(self, rgb_image):
+        """Return a flat list of k RGB colours representative of the image.
+
+        This method samples the image down to a small size without blending
+        any colours, then builds the palette with median cut refined by a
+        few iterations of k-means.
+
+        Arguments:
+        rgb_image -- the "RGB" Image.Image the palette should be built from
+        """
+
+        sample = rgb_image
+        if max(sample.size) > PALETTE_SAMPLE_SIZE:
+            scale = float(PALETTE_SAMPLE_SIZE) / max(sample.size)
+            sample_size = (max(1, int(sample.width * scale)), max(1, int(sample.height * scale)))
+            sample = sample.resize(sample_size, Image.NEAREST)
+
+        quantized_sample = sample.quantize(self.k, method=Image.MEDIANCUT, kmeans=KMEANS_ITERATIONS)
+        return quantized_sample.getpalette()[:self.k * color.RGB_COMPONENT_COUNT]
+
+
+# Effects that can be created by name, for example from a job description
+EFFECTS = {"DotEffect": DotEffect,
+           "ShuffleEffect": ShuffleEffect,
+           "ThreeColorEffect": ThreeColorEffect,
+           "TileEffect": TileEffect,
+           "QuantizeEffect": QuantizeEffect}
+
+
+def set_backend(name):
+    """Choose how the effects are applied from now on.
+
+    Arguments:
+    name -- PYTHON_BACKEND or NATIVE_BACKEND
+    """
+
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend %s" % name)
+    _backend = name
+
+
+def get_backend():
+    """Return the name of the backend the effects are applied with in the current thread"""
+
+    return getattr(_thread_backend, "name", None) or _backend
+
+
+@contextlib.contextmanager
+def using_backend(name):
+    """Use a backend in the current thread for the length of a with block.
+
+    Other threads keep using the backend chosen with set_backend, so
+    several threads can apply effects with different backends at once.
+
+    Arguments:
+    name -- PYTHON_BACKEND or NATIVE_BACKEND
+    """
+
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend %s" % name)
+    previous_name = getattr(_thread_backend, "name", None)
+    _thread_backend.name = name
+    try:
+        yield
+    finally:
+        _thread_backend.name = previous_name
+
+
+def create_effect(name, parameters, effects=EFFECTS):
+    """Return an effect from the name of its class and its arguments.
+
+    This function creates an effect from plain values, such as ones read
+    from JSON. Colours are given as lists of their components, and lists
+    of colours as lists of those.
+
+    Arguments:
+    name -- the name of the effect class as a string
+    parameters -- dictionary of the arguments of the effect class
+    effects -- dictionary of the effect classes that can be created, keyed by name
+    """
+
+    if name not in effects:
+        raise ValueError("Unknown effect %s" % name)
+
+    arguments = {}
+    for key, value in parameters.items():
+        arguments[str(key)] = _get_effect_argument(value)
+    return effects[name](**arguments)
+
+
+def _get_effect_argument(value):
+    """Return a plain value converted to the type an effect expects.
+
+    Arguments:
+    value -- the plain value of an argument
+    """
+
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(component, int) for component in value):
+            return color.Color(*value)
+        return [_get_effect_argument(item) for item in value]
+    return value
+
+
+def _get_stacks(paintings):
+    """Return the paintings split into lists of at most BATCH_STACK_PIXELS pixels.
+
+    A painting larger than BATCH_STACK_PIXELS is given a list of its own.
+
+    Arguments:
+    paintings -- list of painting.Painting of the same width
+    """
+
+    stacks = [[]]
+    stack_pixels = 0
+    for stack_painting in paintings:
+        pixels = stack_painting.width * stack_painting.height
+        if stacks[-1] and stack_pixels + pixels > BATCH_STACK_PIXELS:
+            stacks.append([])
+            stack_pixels = 0
+        stacks[-1].append(stack_painting)
+        stack_pixels += pixels
+    return stacks
+
+
+def _get_nearest_indexes(colors, palette):
+    """Return a dictionary of the index of the palette colour nearest to each colour.
+
+    Ties go to the earlier palette colour. The colours are grouped into
+    cubes NEAREST_CUBE_SIZE values on a side, and each is only compared
+    with the palette colours that could be nearest to part of its cube.
+
+    Arguments:
+    colors -- iterable of RGB tuples
+    palette -- list of RGB tuples
+    """
+
+    cube_candidates = {}
+    nearest_indexes = {}
+    for pixel_color in colors:
+        red, green, blue = pixel_color
+        cube = (red // NEAREST_CUBE_SIZE, green // NEAREST_CUBE_SIZE, blue // NEAREST_CUBE_SIZE)
+        candidates = cube_candidates.get(cube)
+        if candidates is None:
+            candidates = cube_candidates[cube] = _get_cube_candidates(cube, palette)
+        if len(candidates) == 1:
+            nearest_indexes[pixel_color] = candidates[0]
+            continue
+        # min keeps the first of equally near candidates, which are in palette order
+        nearest_indexes[pixel_color] = min(candidates, key=lambda index: (
+            (red - palette[index][0]) ** 2 + (green - palette[index][1]) ** 2 + (blue - palette[index][2]) ** 2))
+    return nearest_indexes
+
+
+def map_colors(image, color_values):
+    """Return an "L" image of each band of the values given for the colour of each pixel.
+
+    Along each line of colours with the same red and green, the values
+    form runs of the remaining bands, in the order the colours sort in.
+    The values of the first run, and the last colour before and values of
+    each later run, are put in tables of every red and green pair, so each
+    run is a few of Pillow's operations on the whole image however many
+    pixels or colours there are.
+
+    Arguments:
+    image -- the "RGB" or "RGBA" Image.Image
+    color_values -- dictionary of a tuple of band values from 0 to 255 for every colour in the image
+    """
+
+    rest_count = len(image.getbands()) - 2
+    band_count = len(next(color_values.itervalues()))
+    first_values = [bytearray(PAIR_TABLE_SIZE) for _ in range(band_count)]
+    # Tables of the remaining bands of the colour before, and the values of, each later run
+    later_runs = []
+    previous_pair = previous_values = previous_rest = None
+    run = 0
+    for pixel_color, values in sorted(color_values.iteritems()):
+        pair = pixel_color[0] * 256 + pixel_color[1]
+        value_tables = None
+        if pair != previous_pair:
+            value_tables = first_values
+            run = 0
+        elif values != previous_values:
+            if run == len(later_runs):
+                # Pairs without this many runs never get past the largest remaining bands
+                later_runs.append(([bytearray([color.MAX_COMPONENT_VALUE]) * PAIR_TABLE_SIZE
+                                    for _ in range(rest_count)],
+                                   [bytearray(PAIR_TABLE_SIZE) for _ in range(band_count)]))
+            start_tables, value_tables = later_runs[run]
+            for start_table, rest_value in zip(start_tables, previous_rest):
+                start_table[pair] = rest_value
+            run += 1
+        if value_tables is not None:
+            for value_table, value in zip(value_tables, values):
+                value_table[pair] = value
+        previous_pair, previous_values, previous_rest = pair, values, pixel_color[2:]
+
+    bands = image.split()
+    pairs = ImageMath.eval("red * 256 + green", red=bands[0], green=bands[1])
+    if rest_count > 1:
+        rest = ImageMath.eval("blue * 256 + alpha", blue=bands[2], alpha=bands[3])
+    value_images = [pairs.point(value_table, "L") for value_table in first_values]
+    for start_tables, value_tables in later_runs:
+        starts = [pairs.point(start_table, "L") for start_table in start_tables]
+        if rest_count > 1:
+            in_run = ImageMath.eval("(rest > blue * 256 + alpha) * 255",
+                                    rest=rest, blue=starts[0], alpha=starts[1]).convert("L")
+        else:
+            in_run = ImageChops.subtract(bands[2], starts[0]).point(NONZERO_MASK_TABLE)
+        for value_image, value_table in zip(value_images, value_tables):
+            value_image.paste(pairs.point(value_table, "L"), None, in_run)
+    return value_images
+
+
+def _get_cube_candidates(cube, palette):
+    """Return the indexes of the palette colours that could be nearest to part of a cube.
+
+    A palette colour can only be nearest to a point in the cube if its
+    distance to the closest point of the cube is no more than the
+    smallest distance from any palette colour to the farthest point.
+
+    Arguments:
+    cube -- tuple of the cube's position along each component, in cubes
+    palette -- list of RGB tuples
+    """
+
+    lows = [position * NEAREST_CUBE_SIZE for position in cube]
+    highs = [low + NEAREST_CUBE_SIZE - 1 for low in lows]
+    nearest_distances = []
+    farthest_distances = []
+    for palette_color in palette:
+        nearest_distance = 0
+        farthest_distance = 0
+        for component, low, high in zip(palette_color, lows, highs):
+            nearest_distance += max(low - component, 0, component - high) ** 2
+            farthest_distance += max(component - low, high - component) ** 2
+        nearest_distances.append(nearest_distance)
+        farthest_distances.append(farthest_distance)
+
+    limit = min(farthest_distances)
+    return [index for index, distance in enumerate(nearest_distances) if distance <= limit]
+
+
+def _get_stored_color(mode, color_tuple):
+    """Return a colour as it would be stored in an image of the given mode.
+
+    Pixels are clamped to the range of their components, and RGB colours
+    set on RGBA images become opaque, so this is the colour that
+    painting.Painting.set_pixel_color would leave in the image.
+
+    Arguments:
+    mode -- the mode of the image
+    color_tuple -- the colour as a tuple of components
+    """
+
+    pixel_image = Image.new(mode, (1, 1))
+    pixel_image.load()[0, 0] = color_tuple
+    return pixel_image.getpixel((0, 0))
+
+
+_backend = PYTHON_BACKEND
+# Backends chosen for a single thread with using_backend
+_thread_backend = threading.local()
+set_backend(os.environ.get(BACKEND_VARIABLE, PYTHON_BACKEND))
@@ -1,93 +1,72 @@
 """Contain a function that processes and saves images for the gallery.
 
-This module has a function that applies specific effects to specific images
-and saves them for the Appropriation Art Exhibit.
+This module has a function that applies the effects described in the
+gallery manifest to the source images and saves them for the
+Appropriation Art Exhibit.
 """
 
 # Standard python libraries
 import os
-import time
 
 # Own modules
-import color
 import effect
-import painting
+import manifest
+import startup
 
 
-def show_gallery():
-    """Apply effects to and display images.
+# The tuner brings in the modules for splitting effects between processes,
+# so it is only imported once the gallery is run
+tuner = startup.LazyModule("tuner")
 
-    This function applies effects to images that will be
-    used for the Appropriation Art Exhibit and saves the
-    outputted images.
-    If this function is run directly from this module, it
-    will display the images in the default windows image
-    viewer.
-
-    Note that it takes a few minutes to process all of the images.
-    """
-
-    input_dir = "source-images"
-    output_dir = "output-images"
 
-    filenames = ["alf.png",
-                 "hug.png",
-                 "sad.jpg",
-                 "jegermeister.jpg"]
+MANIFEST_PATH = "gallery.json"
+TUNING_PATH = "tuning.json"
 
-    paintings = []
-    for filename in filenames:
-        paintings.append(painting.Painting(os.path.join(input_dir, filename)))
+# Kept here so that callers can keep catching exhibit.GalleryError
+GalleryError = manifest.GalleryError
 
-    effects = []
-    # These colour values were arrived at through experimentation
-    colors = (color.Color(150, 0, 150),             # Pinky colour
-              color.Color(150, 150, 0),             # Yellowy colour
-              color.Color(0, 150, 0),               # Light green
-              color.Color(0, 150, 150))             # Light blue
-    # Posterisation level 6 looked good when experimenting, and I wanted a 2x2 grid.
-    tile_effect = effect.TileEffect(colors, 6, 2)
-    effects.append(tile_effect)
 
-    # Circle size and gap arrived at through experimentation
-    dot_effect = effect.DotEffect(10, 5, color.Color(*color.BLACK))
-    effects.append(dot_effect)
+def show_gallery(manifest_path=MANIFEST_PATH, force=False):
+    """Apply effects to and display images, and return the gallery.
 
-    # Shuffle step and randomness arrived at through experimentation
-    shuffle_effect = effect.ShuffleEffect(10, 3)
-    effects.append(shuffle_effect)
-
-    colors = (color.Color(*color.MAGENTA),
-              color.Color(*color.YELLOW),
-              color.Color(*color.CYAN))
-    # Theshold and difference arrived at through experimentation
-    colorchange_effect = effect.ThreeColorEffect(50, 0.9, colors)
-    effects.append(colorchange_effect)
-
-    for i in range(len(effects)):
-        if len(effects) == len(paintings):
-            start = time.clock()
-            # So that you can see its doing something
-            print '%s' % 'processing ' '%s' % filenames[i], '%s' % '... '
+    This function applies the effects in the gallery manifest to
+    images that will be used for the Appropriation Art Exhibit and
+    saves the outputted images. Images whose source and effect haven't
+    changed since they were last saved aren't processed again.
+    Each effect is applied in whichever way was fastest when it was
+    first timed on this computer. The timings are kept in tuning.json
+    next to the manifest. A backend chosen with the EXHIBIT_EFFECT_BACKEND
+    environment variable is always used.
+    If this function is run directly from this module, it
+    will display the images in the default windows image
+    viewer.
 
-            effects[i].do_effect(paintings[i])
-            if __name__ == '__main__':
-                paintings[i].show()
+    Note that it takes a few minutes to process all of the images.
 
-            end = time.clock()
-            # So that you can see progress has been made
-            print '%s' % filenames[i], '%s' % 'took ' '%f' % (end-start), '%s' % 'seconds'
+    Arguments:
+    manifest_path -- string containing the location of the gallery manifest
+    force -- whether to process every image even if it is up to date
+    """
 
-        else:
-            raise GalleryError("Number of input images is not equal to number of effects.")
+    gallery = manifest.Gallery(manifest_path)
+    forced = {"backend": os.environ[effect.BACKEND_VARIABLE]} if os.environ.get(effect.BACKEND_VARIABLE) else None
+    auto_tuner = tuner.AutoTuner(os.path.join(os.path.dirname(manifest_path), TUNING_PATH), forced)
 
-    for i in range(len(paintings)):
-        paintings[i].save(os.path.join(output_dir, filenames[i]))
+    def report(stage, seconds):
+        # So that you can see progress has been made
+        print '%s' % stage["name"], '%s' % 'took ' '%f' % seconds, '%s' % 'seconds'
 
+    # So that you can see its doing something
+    print 'processing', ', '.join(stage["name"] for stage in gallery.stages), '...'
+    results = gallery.run(force=force, report=report, tuner=auto_tuner)
+    auto_tuner.save()
 
-class GalleryError(Exception):
-    pass
+    if __name__ == '__main__':
+        for stage in gallery.stages:
+            if stage["name"] in results:
+                results[stage["name"]].show()
+    return gallery
 
 
 if __name__ == '__main__':
-    show_gallery()
\ No newline at end of file
+    show_gallery(os.path.join(os.path.dirname(os.path.abspath(__file__)), MANIFEST_PATH))
@@ -0,0 +1,417 @@
+"""Contain functions for checking faster effects against the reference versions.
+
+This module runs the per-pixel reference versions of the effects in the
+reference module and each backend that applies the effects in a faster
+way on the same randomised images and parameters. It reports any pixels
+that differ and how much faster each backend is. It also checks the
+outputs of the four exhibit images against golden digests, which are
+worked out once with the reference versions.
+
+The reference versions are slow, so run this directly when changing an
+effect rather than as part of the application:
+    python harness.py --cases 50 --golden
+
+Functions:
+get_random_case -- return a random painting and parameters for an effect
+run_random_cases -- compare every backend with the reference on random cases
+get_report -- return the results of run_random_cases as a string
+check_golden -- compare every backend with the golden digests
+update_golden -- work out the golden digests with the reference versions
+main -- run the harness from the command line
+"""
+
+
+# Standard Python libraries
+import argparse
+import collections
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+
+# Own modules
+import color
+import effect
+import exhibit
+import lut
+import painting
+import parallel
+import point
+import reference
+import shape
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+
+
+# Name used for cases that draw circles directly rather than apply an effect
+CIRCLE = "Circle"
+CASE_NAMES = ("DotEffect", "ShuffleEffect", "ThreeColorEffect", "TileEffect", CIRCLE)
+CASE_MODES = ("RGB", "RGBA")
+# Random images are kept small as the reference versions are slow
+MAX_CASE_SIZE = 48
+DEFAULT_CASES = 20
+# Odd so that strips don't line up with the squares, circles or tiles
+STRIP_HEIGHT = 7
+# Each strip of an effect that isn't pointwise still goes through every
+# square, circle or tile, so large images are split into at most this many strips
+MAX_STRIPS = 8
+
+# Fraction of random images made of a few colours, like drawn artwork
+FLAT_CASE_FRACTION = 0.25
+MAX_FLAT_CASE_COLORS = 16
+
+GOLDEN_PATH = "golden-digests.json"
+# ShuffleEffect needs a seed for its output to be repeatable
+GOLDEN_SHUFFLE_SEED = 2016
+
+
+def get_random_case(name, case_random):
+    """Return a random painting.Painting and parameters for an effect.
+
+    The sizes go down to a single pixel, so that cases where the image is
+    smaller than a circle, square or grid of tiles are covered as well.
+    Some images only have a few colours, so that ways of applying the
+    effects once per colour are covered.
+
+    Arguments:
+    name -- the name of the effect class, or CIRCLE
+    case_random -- the random.Random the case is picked with
+    """
+
+    mode = case_random.choice(CASE_MODES)
+    size = case_random.randint(1, MAX_CASE_SIZE), case_random.randint(1, MAX_CASE_SIZE)
+    band_count = Image.getmodebands(mode)
+    if case_random.random() < FLAT_CASE_FRACTION:
+        case_colors = [[case_random.randrange(color.MAX_COMPONENT_VALUE + 1) for _ in range(band_count)]
+                       for _ in range(case_random.randint(1, MAX_FLAT_CASE_COLORS))]
+        pixel_bytes = bytearray(component for _ in range(size[0] * size[1])
+                                for component in case_random.choice(case_colors))
+    else:
+        pixel_bytes = bytearray(case_random.randrange(color.MAX_COMPONENT_VALUE + 1)
+                                for _ in range(size[0] * size[1] * band_count))
+    case_painting = painting.Painting(Image.frombytes(mode, size, str(pixel_bytes)))
+
+    def random_color():
+        return [case_random.randrange(color.MAX_COMPONENT_VALUE + 1) for _ in range(color.RGB_COMPONENT_COUNT)]
+
+    if name == "DotEffect":
+        parameters = {"radius": case_random.randint(1, 8),
+                      "gap": case_random.randint(0, 6),
+                      "background": random_color()}
+    elif name == "ShuffleEffect":
+        parameters = {"shuffle_step": case_random.randint(1, 8),
+                      "randomness": case_random.randint(2, 4),
+                      "seed": case_random.getrandbits(effect.SEED_BITS)}
+    elif name == "ThreeColorEffect":
+        parameters = {"threshold": case_random.randrange(color.MAX_COMPONENT_VALUE + 1),
+                      "difference": round(case_random.uniform(0.5, 1.5), 2),
+                      "replacement_colors": [random_color() for _ in range(color.RGB_COMPONENT_COUNT)]}
+    elif name == "TileEffect":
+        parameters = {"colors": [random_color() for _ in range(case_random.randint(1, 5))],
+                      "levels": case_random.randint(1, 10),
+                      "size": case_random.randint(1, 4)}
+    elif name == CIRCLE:
+        radius = case_random.randint(0, 10)
+        parameters = {"centres": [(case_random.randint(-radius, size[0] + radius),
+                                   case_random.randint(-radius, size[1] + radius))
+                                  for _ in range(case_random.randint(1, 4))],
+                      "radius": radius,
+                      "color": random_color()}
+    else:
+        raise ValueError("Unknown case %s" % name)
+    return case_painting, parameters
+
+
+def run_random_cases(cases=DEFAULT_CASES, seed=None, names=CASE_NAMES):
+    """Compare every backend with the reference on random cases.
+
+    This function returns an ordered dictionary keyed by (name, backend)
+    of dictionaries with the number of cases, the number that didn't
+    match the reference, the most pixels that differed in one case, the
+    first failing parameters, and the total seconds taken by the reference
+    and the backend.
+    A case matches if the backend gives exactly the same pixels, or raises
+    the same type of exception as the reference.
+
+    Arguments:
+    cases -- the number of random cases for each effect
+    seed -- integer the cases are picked from, or None for different cases each time
+    names -- the names of the effects to check, which can include CIRCLE
+    """
+
+    case_random = random.Random(seed)
+    results = collections.OrderedDict()
+
+    for name in names:
+        for _ in range(cases):
+            case_painting, parameters = get_random_case(name, case_random)
+            expected, reference_time = _time_call(_apply_reference, name, parameters, case_painting)
+
+            for backend, apply_backend in BACKENDS.items():
+                actual, backend_time = _time_call(apply_backend, name, parameters, case_painting)
+                if actual is None:
+                    continue
+
+                result = results.setdefault((name, backend), {"cases": 0, "failures": 0, "max_diff": 0,
+                                                              "failing_case": None, "reference_time": 0.0,
+                                                              "backend_time": 0.0})
+                diff = _count_differences(expected, actual)
+                result["cases"] += 1
+                result["reference_time"] += reference_time
+                result["backend_time"] += backend_time
+                if diff:
+                    result["failures"] += 1
+                    result["max_diff"] = max(result["max_diff"], diff)
+                    if result["failing_case"] is None:
+                        result["failing_case"] = (case_painting.mode, case_painting.size, parameters)
+    return results
+
+
+def get_report(results):
+    """Return the results of run_random_cases as a string.
+
+    Arguments:
+    results -- the dictionary returned by run_random_cases
+    """
+
+    lines = ["%-18s %-8s %6s %8s %9s %8s" % ("effect", "backend", "cases", "failures", "max diff", "speedup")]
+    for (name, backend), result in results.items():
+        speedup = result["reference_time"] / max(result["backend_time"], 1e-9)
+        lines.append("%-18s %-8s %6d %8d %9d %7.1fx" % (name, backend, result["cases"], result["failures"],
+                                                        result["max_diff"], speedup))
+        if result["failing_case"] is not None:
+            lines.append("    first failure: mode %s, size %s, parameters %r" % result["failing_case"])
+    return "\n".join(lines)
+
+
+def check_golden(golden_path=GOLDEN_PATH, manifest_path=exhibit.MANIFEST_PATH):
+    """Compare every backend with the golden digests of the exhibit images.
+
+    This function returns a list of (stage name, backend) that didn't
+    match their golden digest.
+
+    Arguments:
+    golden_path -- string containing the location of the golden digests
+    manifest_path -- string containing the location of the gallery manifest
+    """
+
+    with open(golden_path) as golden_file:
+        golden = json.load(golden_file)
+
+    mismatches = []
+    for stage_name, name, parameters, source_path in _get_golden_cases(manifest_path):
+        source_painting = painting.Painting(source_path)
+        for backend, apply_backend in BACKENDS.items():
+            actual, seconds = _time_call(apply_backend, name, parameters, source_painting)
+            if actual is None:
+                continue
+            matches = _get_digest(actual) == golden.get(stage_name)
+            print "%-28s %-8s %-8s %8.2f seconds" % (stage_name, backend, "ok" if matches else "MISMATCH", seconds)
+            if not matches:
+                mismatches.append((stage_name, backend))
+    return mismatches
+
+
+def update_golden(golden_path=GOLDEN_PATH, manifest_path=exhibit.MANIFEST_PATH):
+    """Work out the golden digests of the exhibit images with the reference versions.
+
+    This takes about a minute, and only needs doing when the exhibit
+    images or the reference versions change.
+
+    Arguments:
+    golden_path -- string containing the location the golden digests are saved
+    manifest_path -- string containing the location of the gallery manifest
+    """
+
+    golden = {}
+    for stage_name, name, parameters, source_path in _get_golden_cases(manifest_path):
+        expected, seconds = _time_call(_apply_reference, name, parameters, painting.Painting(source_path))
+        golden[stage_name] = _get_digest(expected)
+        print "%-28s %8.2f seconds" % (stage_name, seconds)
+
+    with open(golden_path, "w") as golden_file:
+        json.dump(golden, golden_file, indent=4, sort_keys=True)
+
+
+def main(arguments):
+    """Run the harness and return 1 if any backend didn't match the reference.
+
+    Arguments:
+    arguments -- list of command line arguments, not including the program name
+    """
+
+    parser = argparse.ArgumentParser(description="Check faster effects against the reference versions.")
+    parser.add_argument("--cases", type=int, default=DEFAULT_CASES,
+                        help="number of random cases for each effect")
+    parser.add_argument("--seed", type=int, default=None, help="seed the random cases are picked from")
+    parser.add_argument("--golden", action="store_true", help="also check the exhibit images")
+    parser.add_argument("--update-golden", action="store_true",
+                        help="work out the golden digests with the reference versions and exit")
+    arguments = parser.parse_args(arguments)
+
+    if arguments.update_golden:
+        update_golden()
+        return 0
+
+    results = run_random_cases(arguments.cases, arguments.seed)
+    print get_report(results)
+    failed = any(result["failures"] for result in results.values())
+
+    if arguments.golden:
+        failed = bool(check_golden()) or failed
+    return 1 if failed else 0
+
+
+def _get_golden_cases(manifest_path):
+    """Return (stage name, effect name, parameters, source path) for the stages applied to sources.
+
+    Arguments:
+    manifest_path -- string containing the location of the gallery manifest
+    """
+
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    source_dir = os.path.join(os.path.dirname(manifest_path), manifest["source_dir"])
+    golden_cases = []
+    for stage in manifest["stages"]:
+        if stage["input"] in manifest["sources"] and stage["effect"] in reference.EFFECTS:
+            parameters = dict(stage.get("parameters", {}))
+            if stage["effect"] == "ShuffleEffect":
+                parameters["seed"] = GOLDEN_SHUFFLE_SEED
+            source_path = str(os.path.join(source_dir, manifest["sources"][stage["input"]]))
+            golden_cases.append((stage["name"], stage["effect"], parameters, source_path))
+    return golden_cases
+
+
+def _get_digest(result):
+    """Return a hash of the mode, size and pixels of a painting.Painting"""
+
+    digest = hashlib.sha1("%s %dx%d " % ((result.mode,) + result.size))
+    digest.update(result.img.tobytes())
+    return digest.hexdigest()
+
+
+def _time_call(function, name, parameters, source):
+    """Return the result of a backend, or the exception it raised, and the seconds it took"""
+
+    start = time.time()
+    try:
+        result = function(name, parameters, source)
+    except Exception as error:
+        result = error
+    return result, time.time() - start
+
+
+def _count_differences(expected, actual):
+    """Return the number of pixels that differ between two results.
+
+    Results that are exceptions match if they are of the same type. Any
+    other difference in type, mode or size counts as every pixel differing.
+    """
+
+    if isinstance(expected, Exception) or isinstance(actual, Exception):
+        if type(expected) is type(actual):
+            return 0
+        if isinstance(expected, painting.Painting):
+            return max(1, expected.width * expected.height)
+        return max(1, getattr(actual, "width", 1) * getattr(actual, "height", 1))
+
+    if expected.mode != actual.mode or expected.size != actual.size:
+        return max(1, expected.width * expected.height, actual.width * actual.height)
+    return sum(1 for expected_pixel, actual_pixel in zip(expected.img.getdata(), actual.img.getdata())
+               if expected_pixel != actual_pixel)
+
+
+def _draw_circles(circle_class, parameters, source):
+    """Return a copy of the painting with the circles in the parameters drawn on it"""
+
+    canvas = source.copy()
+    for x, y in parameters["centres"]:
+        circle = circle_class(point.Point(x, y), parameters["radius"], color.Color(*parameters["color"]))
+        circle.draw(canvas)
+    return canvas
+
+
+def _apply_reference(name, parameters, source):
+    """Return the result of the reference version of an effect"""
+
+    if name == CIRCLE:
+        return _draw_circles(reference.Circle, parameters, source)
+    return effect.create_effect(name, parameters, reference.EFFECTS).get_result(source)
+
+
+def _apply_with_backend(backend, name, parameters, source):
+    """Return the result of the effect module's version of an effect with a backend selected"""
+
+    with effect.using_backend(backend):
+        return effect.create_effect(name, parameters).get_result(source)
+
+
+def _apply_python(name, parameters, source):
+    """Return the result of an effect applied with the python backend"""
+
+    if name == CIRCLE:
+        return _draw_circles(shape.Circle, parameters, source)
+    return _apply_with_backend(effect.PYTHON_BACKEND, name, parameters, source)
+
+
+def _apply_native(name, parameters, source):
+    """Return the result of an effect applied with the native backend.
+
+    Circles are pasted through shape.get_circle_mask, keeping the first
+    row and column of the canvas as they were.
+    """
+
+    if name == CIRCLE:
+        canvas = source.copy()
+        mask, (left, top) = shape.get_circle_mask(parameters["radius"])
+        if mask is not None:
+            for x, y in parameters["centres"]:
+                canvas.img.paste(tuple(parameters["color"]), (x + left, y + top), mask)
+            canvas.img.paste(source.img.crop((0, 0, source.width, 1)), (0, 0))
+            canvas.img.paste(source.img.crop((0, 0, 1, source.height)), (0, 0))
+        return canvas
+    return _apply_with_backend(effect.NATIVE_BACKEND, name, parameters, source)
+
+
+def _apply_in_strips(name, parameters, source):
+    """Return the result of an effect put together from strips by parallel.apply_in_strips"""
+
+    if name == CIRCLE:
+        return None
+    result = source.copy()
+    strip_height = max(STRIP_HEIGHT, -(-source.height // MAX_STRIPS))
+    parallel.apply_in_strips(effect.create_effect(name, parameters), result, strip_height)
+    return result
+
+
+def _apply_lut(name, parameters, source):
+    """Return the result of a pointwise effect applied through a lut.ColorLUT.
+
+    The table isn't saved, so nothing is written to the cache directory.
+    """
+
+    if name == CIRCLE or not effect.create_effect(name, parameters).pointwise:
+        return None
+    result = source.copy()
+    color_lut = lut.ColorLUT(effect.create_effect(name, parameters), result.mode)
+    color_lut.apply(result)
+    return result
+
+
+# Each way of applying the effects that is compared with the reference,
+# as functions that return None for effects they don't apply to
+BACKENDS = collections.OrderedDict([("python", _apply_python),
+                                    ("native", _apply_native),
+                                    ("strips", _apply_in_strips),
+                                    ("lut", _apply_lut)])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,325 @@
+"""Contain a class for compiling pointwise effects into colour lookup tables.
+
+This module contains a class that evaluates a pointwise effect once for
+each distinct colour and stores the results in a lookup table that is
+kept on disk, so that applying the same effect with the same settings to
+many images only pays for the effect logic once per colour.
+Drawn artwork has few distinct colours compared to its number of pixels,
+so this is much faster than the effect for such images. Tables are
+applied with Pillow's lookup tables rather than pixel by pixel, palette
+images only have their palette rewritten, and images with more colours
+than a limit can be left to the effect.
+
+Classes:
+ColorLUT -- class for compiling, storing and applying colour lookup tables
+
+Functions:
+get_lut -- return the shared ColorLUT for an effect and image mode
+apply_effect -- apply a pointwise effect to a painting through its ColorLUT
+"""
+
+
+# Standard Python libraries
+import cPickle
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+
+# External libraries
+from PIL import Image
+from PIL import ImageChops
+
+# Own modules
+import color
+import effect
+import painting
+
+
+# Directory that compiled tables are kept in between runs
+CACHE_DIR = "lut-cache"
+# Number of colours evaluated by the effect at a time when compiling
+COMPILE_CHUNK_SIZE = 65536
+# Images with more distinct colours than this are usually faster to leave to the effect
+MAX_UNIQUE_COLORS = 65536
+# Images with at most this many colours are remapped through a palette
+MAX_PALETTE_COLORS = 256
+# Mode of the colours in the palette of a "P" image
+PALETTE_MODE = "RGB"
+# Modes of the images that tables can be applied to
+TABLE_MODES = ("L", "RGB", "RGBA")
+# Most colours a table keeps, so that it and its file don't grow with every image
+MAX_TABLE_COLORS = 4 * MAX_UNIQUE_COLORS
+
+# Tables already loaded in this process, keyed by their file name
+_luts = {}
+# Lock held while looking up or adding to the loaded tables, as threads share them
+_luts_lock = threading.Lock()
+
+
+class ColorLUT(object):
+
+    """Store properties and methods relating to colour lookup tables.
+
+    This class stores a table mapping each input colour of an image mode
+    to the colour a pointwise effect turns it into.
+    The table is filled in lazily: colours that haven't been seen before are
+    evaluated exactly by running the effect on them, so applying the table
+    always gives the same result as the effect itself. Once it holds more
+    than MAX_TABLE_COLORS colours, the colours that aren't being looked up
+    are forgotten.
+    The table is saved in the cache directory under a name derived from the
+    effect class, its parameters and the image mode.
+    Tables are shared between threads, so the table is only changed, read
+    or saved while holding a lock.
+
+    Public methods:
+    compile -- evaluate the effect for any of the given colours not in the table
+    apply -- apply the table to a painting
+    apply_to_palette -- apply the table to the palette of a "P" painting
+    save -- save the table to the cache directory
+    """
+
+    def __init__(self, effect, mode, cache_dir=CACHE_DIR):
+        """Initialise the properties and load the table if it has been cached.
+
+        Arguments:
+        effect -- the pointwise effect.Effect that the table is compiled from
+        mode -- the mode of the images that the table will be applied to
+        cache_dir -- directory the table is saved in as a string
+        """
+
+        if not effect.pointwise:
+            raise ValueError("Only pointwise effects can be compiled into a lookup table")
+        if mode not in TABLE_MODES:
+            raise ValueError("Tables can't be applied to %s images" % mode)
+
+        self.__effect = effect
+        self.__mode = mode
+        self.__path = os.path.join(cache_dir, get_table_name(effect, mode))
+        self.__table = {}
+        self.__changed = False
+        self.__lock = threading.RLock()
+
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as table_file:
+                self.__table = cPickle.load(table_file)
+
+    @property
+    def effect(self):
+        return self.__effect
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def size(self):
+        """Return the number of colours in the table"""
+
+        return len(self.__table)
+
+    def compile(self, colors):
+        """Evaluate the effect for any of the given colours not in the table.
+
+        The missing colours are laid out in a strip that is one pixel high,
+        and the effect is applied to the whole strip at once. If there would
+        be more than MAX_TABLE_COLORS colours in the table, only the given
+        colours are kept.
+
+        Arguments:
+        colors -- iterable of pixel values as tuples in the table's mode
+        """
+
+        colors = set(colors)
+        with self.__lock:
+            missing_colors = [pixel_color for pixel_color in colors if pixel_color not in self.__table]
+            if missing_colors and self.size + len(missing_colors) > MAX_TABLE_COLORS:
+                self.__table = dict((pixel_color, self.__table[pixel_color])
+                                    for pixel_color in colors if pixel_color in self.__table)
+                self.__changed = True
+
+            for start in range(0, len(missing_colors), COMPILE_CHUNK_SIZE):
+                chunk = missing_colors[start:start + COMPILE_CHUNK_SIZE]
+                strip = Image.new(self.mode, (len(chunk), 1))
+                strip.putdata(chunk)
+                strip_painting = painting.Painting(strip)
+                self.effect.do_effect(strip_painting)
+                self.__table.update(zip(chunk, strip_painting.img.getdata()))
+                self.__changed = True
+
+    def apply(self, painting):
+        """Apply the table to the supplied painting.
+
+        Any colours in the painting that aren't in the table yet are
+        compiled first. "L" images are mapped with a single lookup table.
+        "RGB" images with few enough colours are turned into a palette
+        image holding each of their colours, so only the palette has to be
+        looked up, and other images are mapped with effect.map_colors.
+
+        Arguments:
+        painting -- the painting.Painting that the table should be applied to
+        """
+
+        if painting.mode != self.mode:
+            raise ValueError("Table was compiled for %s images, not %s" % (self.mode, painting.mode))
+
+        colors = [pixel_color for count, pixel_color in painting.get_colors()]
+
+        if self.mode == PALETTE_MODE and len(colors) <= MAX_PALETTE_COLORS:
+            palette_image = painting.img.quantize(len(colors))
+            # Quantizing keeps every colour when there are few enough, but is checked to be sure
+            if ImageChops.difference(palette_image.convert(self.mode), painting.img).getbbox() is None:
+                self.__remap_palette(palette_image, len(colors))
+                painting.img = palette_image.convert(self.mode)
+                return
+
+        color_values = dict(zip(colors, self.__get_values(colors)))
+        if self.mode == "L":
+            lookup_table = [color_values.get(value, value) for value in range(color.MAX_COMPONENT_VALUE + 1)]
+            painting.img = painting.img.point(lookup_table)
+            return
+
+        painting.img = Image.merge(self.mode, effect.map_colors(painting.img, color_values))
+
+    def apply_to_palette(self, painting):
+        """Apply the table to the colours of the palette of a "P" painting.
+
+        The painting stays a "P" image, with every pixel the colour its
+        palette entry was turned into, so the pixels themselves are untouched.
+
+        Arguments:
+        painting -- the "P" mode painting.Painting that the table should be applied to
+        """
+
+        if painting.mode != "P" or self.mode != PALETTE_MODE:
+            raise ValueError("Only %s tables can be applied to the palette of a P image" % PALETTE_MODE)
+
+        palette_image = painting.img.copy()
+        used_indexes = [index for count, index in palette_image.getcolors(MAX_PALETTE_COLORS)]
+        self.__remap_palette(palette_image, max(used_indexes) + 1)
+        painting.img = palette_image
+
+    def __remap_palette(self, palette_image, color_count):
+        """Replace the first colours of the palette of a "P" image with their entries in the table.
+
+        Arguments:
+        palette_image -- the "P" Image.Image whose palette is replaced in place
+        color_count -- the number of palette entries that are used
+        """
+
+        palette = palette_image.getpalette()
+        component_count = len(PALETTE_MODE)
+        palette_colors = [tuple(palette[index:index + component_count])
+                          for index in range(0, color_count * component_count, component_count)]
+        new_palette = []
+        for new_color in self.__get_values(palette_colors):
+            new_palette.extend(new_color)
+        palette_image.putpalette(new_palette + palette[len(new_palette):])
+
+    def __get_values(self, colors):
+        """Return a list of the entry in the table for each colour, compiling any that are missing.
+
+        Arguments:
+        colors -- list of pixel values as tuples in the table's mode
+        """
+
+        with self.__lock:
+            self.compile(colors)
+            return [self.__table[pixel_color] for pixel_color in colors]
+
+    def save(self):
+        """Save the table to the cache directory if it has changed.
+
+        The table is written to a temporary file with a name of its own
+        that is then renamed, so other threads and processes saving the
+        same table never share the file, and never read a half written table.
+        """
+
+        with self.__lock:
+            if not self.__changed:
+                return
+
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir and not os.path.isdir(cache_dir):
+                try:
+                    os.makedirs(cache_dir)
+                except OSError as error:
+                    # Another process may have made it first
+                    if error.errno != errno.EEXIST:
+                        raise
+
+            table_descriptor, temporary_path = tempfile.mkstemp(".tmp", os.path.basename(self.path) + ".",
+                                                                cache_dir or os.curdir)
+            with os.fdopen(table_descriptor, "wb") as table_file:
+                cPickle.dump(self.__table, table_file, cPickle.HIGHEST_PROTOCOL)
+            os.rename(temporary_path, self.path)
+            self.__changed = False
+
+
+def get_table_name(effect, mode):
+    """Return the file name of the table for an effect and image mode.
+
+    Arguments:
+    effect -- the effect.Effect the table is compiled from
+    mode -- the mode of the images the table applies to
+    """
+
+    key = repr((effect.__class__.__name__, effect.parameters, mode))
+    return "%s-%s.lut" % (effect.__class__.__name__, hashlib.sha1(key).hexdigest())
+
+
+def get_lut(effect, mode, cache_dir=CACHE_DIR):
+    """Return the shared ColorLUT for an effect and image mode.
+
+    Tables are only loaded from disk once per process, so a batch of
+    images with the same settings all share the same table.
+
+    Arguments:
+    effect -- the pointwise effect.Effect the table is compiled from
+    mode -- the mode of the images the table applies to
+    cache_dir -- directory the table is saved in as a string
+    """
+
+    path = os.path.join(cache_dir, get_table_name(effect, mode))
+    with _luts_lock:
+        if path not in _luts:
+            _luts[path] = ColorLUT(effect, mode, cache_dir)
+        return _luts[path]
+
+
+def apply_effect(effect, painting, cache_dir=CACHE_DIR, max_colors=None):
+    """Apply a pointwise effect to a painting through its ColorLUT.
+
+    This function returns True if the table was used. If the painting's
+    mode can't have a table, or max_colors is given and the painting has
+    more distinct colours than it, the effect is applied with do_effect
+    instead and False is returned.
+    "P" images always use the table, as only their palette is changed.
+    The table is saved afterwards if applying it added any colours.
+
+    Arguments:
+    effect -- the pointwise effect.Effect to apply
+    painting -- the painting.Painting that the effect should be applied to
+    cache_dir -- directory the table is saved in as a string
+    max_colors -- the most distinct colours the painting can have to use the table, or None for any number
+    """
+
+    if painting.mode == "P":
+        color_lut = get_lut(effect, PALETTE_MODE, cache_dir)
+        color_lut.apply_to_palette(painting)
+    elif (painting.mode not in TABLE_MODES
+          or max_colors is not None and painting.get_unique_color_count() > max_colors):
+        effect.do_effect(painting)
+        return False
+    else:
+        color_lut = get_lut(effect, painting.mode, cache_dir)
+        color_lut.apply(painting)
+
+    color_lut.save()
+    return True
@@ -1,54 +1,72 @@
-"""Contain a class that builds a Kivy application.
+"""Start the Appropriation Art Exhibit application.
 
-This file contains a class for a Kivy application that
-displays both the input and output images.
+This file starts the Kivy application that displays both the input
+and output images. Kivy, Pillow and the gallery are only imported once
+they are needed, so options that don't run the application start quickly.
+
+Options:
+--profile-startup -- report how long each module takes to import and exit
 """
 
 
 # Standard Python libraries
 import os
-
-# External libraries
-from kivy.app import App
-from kivy.uix.carousel import Carousel
-from kivy.uix.image import AsyncImage
+import sys
 
 # Own modules
-import exhibit
+import startup
 
 
-class ExhibitApp(App):
+# Most time importing the application's modules should take, in seconds
+STARTUP_BUDGET = 2.0
+# Modules the application imports before it shows anything
+STARTUP_MODULES = ("app", "exhibit", "effect", "painting", "PIL.Image", "PIL.ImageMath")
 
-    """Display the original images and new images.
 
-    This Kivy App displays each original image followed
-    by the processed image in a Kivy carousel.
+def profile_startup():
+    """Import the application's modules and report how long each one took.
+
+    Returns 0 if the total import time is within STARTUP_BUDGET,
+    otherwise 1, so that this can be used as a check in scripts.
     """
 
-    def build(self):
-        """Return the Kivy carousel of gallery images when the app is run."""
+    # Stop Kivy from treating this program's options as its own
+    os.environ["KIVY_NO_ARGS"] = "1"
+
+    missing_modules = []
+    profiler = startup.ImportProfiler()
+    profiler.start()
+    try:
+        for name in STARTUP_MODULES:
+            try:
+                __import__(name)
+            except ImportError as error:
+                missing_modules.append("%s (%s)" % (name, error))
+    finally:
+        profiler.stop()
 
-        try:
-            exhibit.show_gallery()
-        except exhibit.GalleryError:
-            print "Number of input images is not equal to number of effects."
-            return
+    print profiler.get_report(STARTUP_BUDGET)
+    for missing_module in missing_modules:
+        print "Could not import", missing_module
+    if profiler.total_time > STARTUP_BUDGET:
+        return 1
+    return 0
+
+
+def main(arguments):
+    """Run the application, or profile its start-up.
+
+    Arguments:
+    arguments -- list of command line arguments, not including the program name
+    """
 
-        output_dir = "output-images"
-        input_dir = "source-images"
+    if "--profile-startup" in arguments:
+        return profile_startup()
 
-        carousel = Carousel(direction='right')
-        source = ["alf.png",
-                 "hug.png",
-                 "sad.jpg",
-                 "jegermeister.jpg"]
-        for filename in source:
-            original_image = AsyncImage(source=(os.path.join(input_dir, filename)), allow_stretch=True)
-            carousel.add_widget(original_image)
-            new_image = AsyncImage(source=(os.path.join(output_dir, filename)), allow_stretch=True)
-            carousel.add_widget(new_image)
-        return carousel
+    import app
+    app.ExhibitApp().run()
+    return 0
 
 
 if __name__ == '__main__':
-    ExhibitApp().run()
\ No newline at end of file
+    sys.exit(main(sys.argv[1:]))
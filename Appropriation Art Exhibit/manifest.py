@@ -0,0 +1,357 @@
+"""Contain a class for running a gallery described by a manifest file.
+
+This module contains a class that reads a JSON manifest describing the
+source images of a gallery, the effects applied to them and where the
+results are saved, and runs it as a graph of stages.
+Each source is only decoded once however many stages use it, at the
+smallest scale that all of them can work from, and stages applied to the
+same painting share anything the effects cache on it.
+Stages that don't depend on each other run at the same time, and stages
+whose source, effect and parameters haven't changed since their output
+was last saved are skipped.
+
+The manifest is a JSON object with the keys
+source_dir -- directory the source images are in
+output_dir -- directory the outputs are saved in
+sources -- object of source names and their file names
+stages -- list of objects with the keys
+    name -- unique name of the stage
+    input -- name of the source or earlier stage the effect is applied to
+    effect -- name of the effect class, such as "TileEffect"
+    parameters -- object of the effect's arguments, with colours as lists
+    output -- optional file name the result is saved as
+    description -- optional notes about the stage
+
+Classes:
+Gallery -- class for reading and running a gallery manifest
+GalleryError -- exception raised when a manifest is invalid
+"""
+
+
+# Standard Python libraries
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+# Own modules
+import effect
+import painting
+
+
+# File in the output directory recording what each output was made from
+STATE_FILENAME = ".gallery-state.json"
+DEFAULT_WORKERS = 4
+
+
+class GalleryError(Exception):
+    pass
+
+
+class Gallery(object):
+
+    """Store properties and methods relating to a gallery manifest.
+
+    This class reads a gallery manifest and runs its stages in the order
+    their inputs allow.
+
+    Public methods:
+    get_display_pairs -- return the source and output path of each saved stage
+    get_jobs -- return a self-contained job description for each saved stage
+    run -- run the stages that are out of date
+    """
+
+    def __init__(self, manifest_path):
+        """Initialise the properties from a manifest file.
+
+        Paths in the manifest are relative to the directory the manifest is in.
+
+        Arguments:
+        manifest_path -- string containing the location of the manifest
+        """
+
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        base_dir = os.path.dirname(manifest_path)
+        self.__source_dir = os.path.join(base_dir, manifest.get("source_dir", ""))
+        self.__output_dir = os.path.join(base_dir, manifest.get("output_dir", ""))
+        self.__sources = manifest.get("sources", {})
+        self.__stages = manifest.get("stages", [])
+        self.__check_stages()
+
+    @property
+    def source_dir(self):
+        return self.__source_dir
+
+    @property
+    def output_dir(self):
+        return self.__output_dir
+
+    @property
+    def sources(self):
+        return dict(self.__sources)
+
+    @property
+    def stages(self):
+        return list(self.__stages)
+
+    def get_display_pairs(self):
+        """Return a list of (source path, output path) for each stage that is saved.
+
+        The source path is the source image the stage is ultimately based on.
+        """
+
+        pairs = []
+        for stage in self.__stages:
+            if "output" in stage:
+                pairs.append((self.__get_source_path(self.__get_root_source(stage["name"])),
+                              os.path.join(self.output_dir, stage["output"])))
+        return pairs
+
+    def get_jobs(self):
+        """Return a list of job descriptions, one for each stage that is saved.
+
+        Each job is a dictionary that can be run on its own, for example by
+        another machine, with the keys
+        source -- path of the source image the stage is ultimately based on
+        effects -- list of {"effect": name, "parameters": object} applied in order
+        output -- path the result is saved to
+
+        The effects are the stage's own and those of the stages it is applied
+        to, so intermediate stages are worked out again by each job that needs them.
+        """
+
+        jobs = []
+        for stage in self.__stages:
+            if "output" not in stage:
+                continue
+            chain = []
+            name = stage["name"]
+            while name not in self.__sources:
+                chain_stage = self.__get_stage(name)
+                chain.append({"effect": chain_stage["effect"], "parameters": chain_stage.get("parameters", {})})
+                name = chain_stage["input"]
+            jobs.append({"source": self.__get_source_path(name),
+                         "effects": list(reversed(chain)),
+                         "output": os.path.join(self.output_dir, stage["output"])})
+        return jobs
+
+    def run(self, workers=DEFAULT_WORKERS, force=False, report=None, tuner=None):
+        """Run the stages that are out of date and return their results.
+
+        This method returns a dictionary of the painting.Painting made by
+        each stage that was run, keyed by stage name.
+        The stages are run in a pool of threads. Pillow releases the
+        interpreter lock during its own image operations, so independent
+        stages overlap while still sharing decoded sources.
+        Each output is recorded in the state file as soon as it is saved,
+        so if a stage fails or the run is interrupted, the stages that
+        finished are skipped next time. If a stage fails, the other stages
+        of its level still finish, then its exception is raised.
+
+        Arguments:
+        workers -- the number of stages that can run at once
+        force -- whether to run every stage even if it is up to date
+        report -- function called with each stage and the seconds it took once it finishes
+        tuner -- optional tuner.AutoTuner that picks how each effect is applied
+        """
+
+        state = self.__load_state()
+        keys = self.__get_stage_keys()
+        stages_to_run = self.__get_stages_to_run(state, keys, force)
+        effects = dict((stage["name"], effect.create_effect(stage["effect"], stage.get("parameters", {})))
+                       for stage in stages_to_run)
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        sources = {}
+        results = {}
+        pool = ThreadPool(workers)
+        try:
+            for level in self.__get_levels(stages_to_run):
+                # Every source needed by this level is decoded once, up front
+                for stage in level:
+                    if stage["input"] in self.__sources and stage["input"] not in sources:
+                        sources[stage["input"]] = self.__decode_source(stage["input"], stages_to_run, effects)
+
+                inputs = [sources[stage["input"]] if stage["input"] in sources else results[stage["input"]]
+                          for stage in level]
+                pending_results = [pool.apply_async(_run_stage, ((effects[stage["name"]], stage_input, tuner),))
+                                   for stage, stage_input in zip(level, inputs)]
+                error_info = None
+                for stage, pending_result in zip(level, pending_results):
+                    try:
+                        stage_painting, seconds = pending_result.get()
+                    except Exception:
+                        error_info = error_info or sys.exc_info()
+                        continue
+                    results[stage["name"]] = stage_painting
+                    if "output" in stage:
+                        stage_painting.save(os.path.join(self.output_dir, stage["output"]))
+                        state[stage["name"]] = keys[stage["name"]]
+                        self.__save_state(state)
+                    if report is not None:
+                        report(stage, seconds)
+                if error_info is not None:
+                    raise error_info[0], error_info[1], error_info[2]
+        finally:
+            pool.close()
+            pool.join()
+            self.__save_state(state)
+
+        return results
+
+    def __check_stages(self):
+        """Raise a GalleryError if the stages don't form a valid graph"""
+
+        names = set()
+        for stage in self.__stages:
+            for key in ("name", "input", "effect"):
+                if key not in stage:
+                    raise GalleryError("Stage %r is missing %s" % (stage.get("name"), key))
+            if stage["name"] in names or stage["name"] in self.__sources:
+                raise GalleryError("Name %s is used more than once" % stage["name"])
+            # Stages can only use sources or stages that come before them,
+            # which also means there can't be any cycles
+            if stage["input"] not in names and stage["input"] not in self.__sources:
+                raise GalleryError("Input %s of stage %s doesn't come before it" % (stage["input"], stage["name"]))
+            if stage["effect"] not in effect.EFFECTS:
+                raise GalleryError("Unknown effect %s in stage %s" % (stage["effect"], stage["name"]))
+            names.add(stage["name"])
+
+        for name in self.__sources.values():
+            if not os.path.exists(os.path.join(self.source_dir, name)):
+                raise GalleryError("Source image %s doesn't exist" % name)
+
+    def __get_stage(self, name):
+        for stage in self.__stages:
+            if stage["name"] == name:
+                return stage
+
+    def __get_source_path(self, source_name):
+        # JSON strings are unicode, but painting.Painting opens str paths
+        return str(os.path.join(self.source_dir, self.__sources[source_name]))
+
+    def __get_root_source(self, name):
+        """Return the name of the source a stage is ultimately applied to"""
+
+        while name not in self.__sources:
+            name = self.__get_stage(name)["input"]
+        return name
+
+    def __decode_source(self, source_name, stages, effects):
+        """Return a source as a painting.Painting decoded at the scale its stages need.
+
+        Arguments:
+        source_name -- the name of the source in the manifest
+        stages -- list of the stages being run
+        effects -- dictionary of the effect.Effect of each stage being run
+        """
+
+        source_effects = [effects[stage["name"]] for stage in stages if stage["input"] == source_name]
+
+        def get_required_size(size):
+            required_sizes = [source_effect.get_required_size(size) for source_effect in source_effects]
+            return max(width for width, height in required_sizes), max(height for width, height in required_sizes)
+
+        return painting.Painting(self.__get_source_path(source_name), get_required_size)
+
+    def __get_stage_keys(self):
+        """Return a dictionary of a hash of everything each stage's result depends on.
+
+        The key of a stage depends on the contents of its source image and
+        the effect and parameters of it and every stage before it.
+        """
+
+        keys = {}
+        for name, filename in self.__sources.items():
+            with open(os.path.join(self.source_dir, filename), "rb") as source_file:
+                keys[name] = hashlib.sha1(source_file.read()).hexdigest()
+
+        for stage in self.__stages:
+            stage_spec = json.dumps([keys[stage["input"]], stage["effect"], stage.get("parameters", {})],
+                                    sort_keys=True)
+            keys[stage["name"]] = hashlib.sha1(stage_spec).hexdigest()
+        return keys
+
+    def __get_stages_to_run(self, state, keys, force):
+        """Return the stages that need to be run, in manifest order.
+
+        A stage needs to be run if its output is missing or out of date, or
+        if a stage that needs to be run uses it as its input.
+
+        Arguments:
+        state -- dictionary of the keys each output was last saved with
+        keys -- dictionary of the current key of each stage
+        force -- whether every stage should be run
+        """
+
+        needed = set()
+        for stage in reversed(self.__stages):
+            if force or stage["name"] in needed:
+                needed.add(stage["name"])
+            elif "output" in stage:
+                output_path = os.path.join(self.output_dir, stage["output"])
+                if not os.path.exists(output_path) or state.get(stage["name"]) != keys[stage["name"]]:
+                    needed.add(stage["name"])
+
+            if stage["name"] in needed:
+                needed.add(stage["input"])
+
+        return [stage for stage in self.__stages if stage["name"] in needed]
+
+    def __get_levels(self, stages):
+        """Return the stages split into lists that only depend on earlier lists.
+
+        Arguments:
+        stages -- list of stages in manifest order
+        """
+
+        depths = {}
+        levels = []
+        for stage in stages:
+            depth = depths.get(stage["input"], -1) + 1
+            depths[stage["name"]] = depth
+            if depth == len(levels):
+                levels.append([])
+            levels[depth].append(stage)
+        return levels
+
+    def __load_state(self):
+        state_path = os.path.join(self.output_dir, STATE_FILENAME)
+        if os.path.exists(state_path):
+            with open(state_path) as state_file:
+                return json.load(state_file)
+        return {}
+
+    def __save_state(self, state):
+        """Save the key of each output, replacing the state file in one step so it is never half written"""
+
+        state_descriptor, temporary_path = tempfile.mkstemp(".tmp", STATE_FILENAME + ".", self.output_dir)
+        with os.fdopen(state_descriptor, "w") as state_file:
+            json.dump(state, state_file, indent=4, sort_keys=True)
+        os.rename(temporary_path, os.path.join(self.output_dir, STATE_FILENAME))
+
+
+def _run_stage(job):
+    """Return the result of a stage and how long it took in seconds.
+
+    The input painting isn't changed, so it can be shared by other stages.
+
+    Arguments:
+    job -- tuple of the stage's effect.Effect, the painting.Painting it is
+           applied to and the tuner.AutoTuner to apply it with, or None
+    """
+
+    stage_effect, input_painting, stage_tuner = job
+    start = time.time()
+    if stage_tuner is None:
+        result = stage_effect.get_result(input_painting)
+    else:
+        result = stage_tuner.get_result(stage_effect, input_painting)
+    return result, time.time() - start
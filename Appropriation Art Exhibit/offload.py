@@ -0,0 +1,347 @@
+"""Contain classes for applying effects and saving paintings without blocking.
+
+This module contains an executor that applies effects and saves
+paintings in a pool of threads or processes, and a future for the result
+of each, so an application with an event loop doesn't stop responding
+while an image is processed. At most max_concurrent pieces of work run
+at once and the rest wait their turn. Cancelling a future stops its work
+if it hasn't started, and effects running in a thread stop at their next
+progress check. Callbacks added to a future are called in the thread the
+work ran in, so an event loop should pass the result back to its own
+thread, as the Kivy application does with its clock.
+
+Classes:
+Future -- class for the result of work running in the background
+Executor -- class for running effects and saves within a concurrency limit
+
+Functions:
+get_default_executor -- return the executor used when none is given
+set_default_executor -- replace the executor used when none is given
+"""
+
+
+# Standard Python libraries
+import multiprocessing
+import threading
+from multiprocessing.pool import ThreadPool
+
+# Own modules
+import effect
+import painting
+import progress
+
+
+THREAD_EXECUTOR = "thread"
+PROCESS_EXECUTOR = "process"
+EXECUTOR_KINDS = (THREAD_EXECUTOR, PROCESS_EXECUTOR)
+DEFAULT_MAX_CONCURRENT = multiprocessing.cpu_count()
+
+PENDING = "pending"
+RUNNING = "running"
+FINISHED = "finished"
+CANCELLED = "cancelled"
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+class Future(object):
+
+    """Store the result of work that runs in the background.
+
+    This class has the same methods as concurrent.futures.Future.
+    Once it has been cancelled, result raises progress.Cancelled and any
+    result the work goes on to produce is thrown away.
+
+    Public methods:
+    run -- run the work unless the future has been cancelled
+    cancel -- stop the work, or stop it from starting
+    cancelled -- return whether the future was cancelled
+    running -- return whether the work is running
+    done -- return whether the work has finished or been cancelled
+    result -- wait for the work and return its result
+    exception -- wait for the work and return the exception it raised
+    add_done_callback -- call a function with the future once it is done
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__state = PENDING
+        self.__result = None
+        self.__error = None
+        self.__callbacks = []
+        self.__cancel_token = progress.CancellationToken()
+
+    @property
+    def cancel_token(self):
+        """Return the progress.CancellationToken that is cancelled along with the future"""
+
+        return self.__cancel_token
+
+    def run(self, function, *arguments):
+        """Run the work and store its result, unless the future has been cancelled.
+
+        Arguments:
+        function -- the function that does the work
+        arguments -- the arguments the function is called with
+        """
+
+        with self.__condition:
+            if self.__state != PENDING:
+                return
+            self.__state = RUNNING
+
+        try:
+            result = function(*arguments)
+        except progress.Cancelled:
+            self.cancel()
+            return
+        except Exception as error:
+            self.__finish(None, error)
+            return
+        self.__finish(result, None)
+
+    def cancel(self):
+        """Cancel the future and return whether it was cancelled.
+
+        Work that has already started is asked to stop through the cancel
+        token. Work running in another process can't be stopped, but its
+        result is thrown away. Futures that are already finished can't be
+        cancelled.
+        """
+
+        with self.__condition:
+            if self.__state == FINISHED:
+                return False
+            if self.__state == CANCELLED:
+                return True
+            self.__state = CANCELLED
+            self.__cancel_token.cancel()
+            self.__condition.notify_all()
+        self.__call_callbacks()
+        return True
+
+    def cancelled(self):
+        return self.__state == CANCELLED
+
+    def running(self):
+        return self.__state == RUNNING
+
+    def done(self):
+        return self.__state in (FINISHED, CANCELLED)
+
+    def result(self, timeout=None):
+        """Wait for the work to finish and return its result.
+
+        Raises the exception the work raised, progress.Cancelled if the
+        future was cancelled, or multiprocessing.TimeoutError if the work
+        didn't finish in time.
+
+        Arguments:
+        timeout -- the most seconds to wait, or None to wait for as long as it takes
+        """
+
+        error = self.exception(timeout)
+        if error is not None:
+            raise error
+        return self.__result
+
+    def exception(self, timeout=None):
+        """Wait for the work to finish and return the exception it raised, or None.
+
+        Raises progress.Cancelled if the future was cancelled, or
+        multiprocessing.TimeoutError if the work didn't finish in time.
+
+        Arguments:
+        timeout -- the most seconds to wait, or None to wait for as long as it takes
+        """
+
+        with self.__condition:
+            if not self.done():
+                self.__condition.wait(timeout)
+            if self.__state == CANCELLED:
+                raise progress.Cancelled("The work was cancelled")
+            if self.__state != FINISHED:
+                raise multiprocessing.TimeoutError()
+            return self.__error
+
+    def add_done_callback(self, callback):
+        """Call a function with the future once it is done.
+
+        The function is called straight away if the future is already done.
+
+        Arguments:
+        callback -- function that takes the future
+        """
+
+        with self.__condition:
+            if not self.done():
+                self.__callbacks.append(callback)
+                return
+        callback(self)
+
+    def __finish(self, result, error):
+        with self.__condition:
+            if self.__state != RUNNING:
+                return
+            self.__result = result
+            self.__error = error
+            self.__state = FINISHED
+            self.__condition.notify_all()
+        self.__call_callbacks()
+
+    def __call_callbacks(self):
+        with self.__condition:
+            callbacks = self.__callbacks
+            self.__callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class Executor(object):
+
+    """Store the pools that effects are applied and paintings saved in.
+
+    The work is started by a pool of max_concurrent threads. A thread
+    executor does the work in those threads, where Pillow's operations
+    run without holding the interpreter lock. A process executor sends
+    it on to a pool of as many processes, so the python backend's
+    pixel loops don't hold up the application either.
+
+    Public methods:
+    apply_async -- start applying an effect to a painting
+    save_async -- start saving a painting
+    close -- wait for the work to finish and stop the pools
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT, kind=THREAD_EXECUTOR):
+        """Initialise the properties and start the pools.
+
+        Arguments:
+        max_concurrent -- the most effects and saves that run at once
+        kind -- THREAD_EXECUTOR or PROCESS_EXECUTOR
+        """
+
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError("Unknown executor kind %s" % kind)
+
+        self.__max_concurrent = max_concurrent
+        self.__kind = kind
+        self.__thread_pool = ThreadPool(max_concurrent)
+        self.__process_pool = multiprocessing.Pool(max_concurrent) if kind == PROCESS_EXECUTOR else None
+
+    @property
+    def max_concurrent(self):
+        return self.__max_concurrent
+
+    @property
+    def kind(self):
+        return self.__kind
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    def apply_async(self, effect_to_apply, source_painting):
+        """Start applying an effect and return a Future for the new painting.Painting.
+
+        The effect is applied with the backend in use in the calling
+        thread. The supplied painting is left unchanged, but it shouldn't
+        be changed until the future is done. Process executors can't be
+        given paintings decoded at a reduced scale, as only the decoded
+        pixels are sent to the processes.
+
+        Arguments:
+        effect_to_apply -- the effect.Effect to apply
+        source_painting -- the painting.Painting it should be applied to
+        """
+
+        future = Future()
+        backend = effect.get_backend()
+        if self.kind == THREAD_EXECUTOR:
+            self.__thread_pool.apply_async(future.run, (_get_result, effect_to_apply, source_painting, backend,
+                                                        future.cancel_token))
+            return future
+
+        if source_painting.is_reduced:
+            raise ValueError("Paintings decoded at a reduced scale can't be sent to other processes")
+        self.__thread_pool.apply_async(future.run, (self.__get_result_in_process, effect_to_apply,
+                                                    source_painting.img, backend))
+        return future
+
+    def save_async(self, painting_to_save, path):
+        """Start saving a painting and return a Future that is done once it is saved.
+
+        Arguments:
+        painting_to_save -- the painting.Painting to save
+        path -- string containing the location the painting should be saved
+        """
+
+        future = Future()
+        if self.kind == THREAD_EXECUTOR:
+            self.__thread_pool.apply_async(future.run, (painting_to_save.save, path))
+        else:
+            self.__thread_pool.apply_async(future.run, (self.__process_pool.apply, _save_image,
+                                                        (painting_to_save.img, path)))
+        return future
+
+    def close(self):
+        """Wait for the work that has been started to finish, then stop the pools"""
+
+        self.__thread_pool.close()
+        self.__thread_pool.join()
+        if self.__process_pool is not None:
+            self.__process_pool.close()
+            self.__process_pool.join()
+
+    def __get_result_in_process(self, effect_to_apply, img, backend):
+        return painting.Painting(self.__process_pool.apply(_get_result_image, (effect_to_apply, img, backend)))
+
+
+def get_default_executor():
+    """Return the executor used when none is given, starting a thread executor if there isn't one"""
+
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = Executor()
+        return _default_executor
+
+
+def set_default_executor(executor):
+    """Replace the executor used when none is given.
+
+    The previous executor isn't closed, so work it has started carries on.
+
+    Arguments:
+    executor -- the Executor to use
+    """
+
+    global _default_executor
+    with _default_executor_lock:
+        _default_executor = executor
+
+
+def _get_result(effect_to_apply, source_painting, backend, cancel_token=None):
+    """Return the result of an effect applied with a backend as a new painting.Painting"""
+
+    with effect.using_backend(backend):
+        return effect_to_apply.get_result(source_painting, None, cancel_token)
+
+
+def _get_result_image(effect_to_apply, img, backend):
+    """Return the image of the result of an effect.
+
+    This function is run in the worker processes, so it takes and returns
+    Image.Image objects rather than painting.Painting objects.
+    """
+
+    return _get_result(effect_to_apply, painting.Painting(img), backend).img
+
+
+def _save_image(img, path):
+    """Save an image. This function is run in the worker processes."""
+
+    img.save(path)
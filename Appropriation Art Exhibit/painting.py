@@ -8,12 +8,20 @@ Painting -- class for storing and manipulating images
 """
 
 
-# External libraries
-from PIL import Image
-
 # Own modules
 import color
 import point
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+ImageMath = startup.LazyModule("PIL.ImageMath")
+# offload imports this module, so it is only imported once it is first used
+offload = startup.LazyModule("offload")
+
+# Most changed rectangles a Painting keeps before merging the closest ones
+MAX_DIRTY_REGIONS = 16
 
 
 class Painting(object):
@@ -27,27 +35,53 @@ class Painting(object):
     Public methods:
     show -- shows the painting in default image viewer
     save -- save the painting in specified location
+    save_async -- start saving the painting in the background and return a future
     copy -- make a copy of the painting
     paste -- insert painting into another painting
     resize - copy and resize the painting-
+    crop -- copy a rectangular region of the painting
     set_pixel_color -- sets the colour of a given pixel
     get_pixel_color -- returns the colour of a given pixel
     clear image -- clears the painting to one colour
     is_in_image -- check if a point is inside the painting
     get_square -- return a square of pixels from the painting
+    get_derived -- return data worked out from the image, computing it only once
+    get_luminance -- return an "L" image of the luminance of each pixel
+    get_channels -- return an "L" image of each band of the image
+    get_histogram -- return the histogram of the image
+    get_colors -- return each colour in the image and how many pixels have it
+    get_unique_color_count -- return the number of different colours in the image
+    mark_dirty -- record that a rectangle of the image has changed
+    pop_dirty_regions -- return the rectangles changed since the last call and forget them
     """
 
-    def __init__(self, img):
+    def __init__(self, img, required_size=None):
         """Initialise the properties.
 
         The intialiser can take arguments of type Painting,
-        Image.Image or a string of the path to an image file
+        Image.Image or a string of the path to an image file.
+        When opening a file, required_size can be given so that
+        the image is decoded at the smallest scale that is still
+        at least the size it returns. Only JPEG files can be decoded
+        at a reduced scale, other files are always decoded in full.
+        The size of the image in the file is kept as source_size.
 
         Arguments:
         img -- image as a Painting, Image.Image or file path string
+        required_size -- function that takes the size of the image in the file and returns the size needed
         """
 
+        source_size = None
+        if isinstance(img, str) and required_size is not None:
+            img = Image.open(img)
+            source_size = img.size
+            needed_size = required_size(source_size)
+            if needed_size != source_size:
+                img.draft(img.mode, needed_size)
+
         self.img = img
+        if source_size is not None:
+            self.__source_size = source_size
 
     @property
     def img(self):
@@ -59,6 +93,7 @@ class Painting(object):
 
         if isinstance(new_image, Painting):
             self.__img = new_image.__img
+            self.__source_size = new_image.__source_size
         elif isinstance(new_image, Image.Image):
             self.__img = new_image
         elif isinstance(new_image, str):
@@ -68,9 +103,17 @@ class Painting(object):
 
         self.__pixels = self.img.load()
         self.__size = self.img.size
+        if not isinstance(new_image, Painting):
+            self.__source_size = self.__size
         self.__width = self.size[0]
         self.__height = self.size[1]
         self.__mode = self.img.mode
+        # Data worked out from the image, which is out of date once it changes
+        self.__derived = {}
+        # A new image has changed everywhere
+        self.__dirty_regions = [(0, 0, self.__width, self.__height)]
+        # Box around the pixels set since the dirty regions were last used, empty while left >= right
+        self.__pixel_box = [self.__width, self.__height, 0, 0]
 
     @property
     def pixels(self):
@@ -80,6 +123,27 @@ class Painting(object):
     def size(self):
         return self.__size
 
+    @property
+    def source_size(self):
+        """Return the size of the image before it was decoded at a reduced scale.
+
+        This is the same as size unless the image was opened with a
+        required_size smaller than the image in the file.
+        """
+
+        return self.__source_size
+
+    @property
+    def is_reduced(self):
+        return self.__source_size != self.__size
+
+    @property
+    def dirty_regions(self):
+        """Return a list of the (left, top, right, bottom) rectangles changed since they were last popped"""
+
+        self.__add_pixel_box()
+        return list(self.__dirty_regions)
+
     @property
     def width(self):
         return self.__width
@@ -92,6 +156,16 @@ class Painting(object):
     def mode(self):
         return self.__mode
 
+    @property
+    def frame_count(self):
+        """Return the number of frames in the image.
+
+        Only the first frame is stored in the Painting. The animation
+        module should be used to process every frame of animated images.
+        """
+
+        return getattr(self.img, "n_frames", 1)
+
     def show(self):
         """Show the image in default windows image viewer"""
 
@@ -100,7 +174,9 @@ class Painting(object):
     def copy(self):
         """Return a copy of the Painting instance"""
 
-        return Painting(self.img.copy())
+        painting_copy = Painting(self.img.copy())
+        painting_copy.__source_size = self.source_size
+        return painting_copy
 
     def save(self, path):
         """Save the image in the location specified by the path string
@@ -110,6 +186,19 @@ class Painting(object):
 
         self.img.save(path)
 
+    def save_async(self, path, executor=None):
+        """Start saving the image in the background and return an offload.Future.
+
+        The image shouldn't be changed until the future is done.
+
+        Arguments:
+        path -- string containing location that the image should be saved
+        executor -- the offload.Executor to save it in, defaults to offload.get_default_executor()
+        """
+
+        executor = executor or offload.get_default_executor()
+        return executor.save_async(self, path)
+
     def paste(self, painting, top_left):
         """Paste the image from a Painting into this instance of Painting
 
@@ -123,6 +212,8 @@ class Painting(object):
         """
 
         self.img.paste(painting.img, top_left.coordinates)
+        self.__derived.clear()
+        self.mark_dirty((top_left.x, top_left.y, top_left.x + painting.width, top_left.y + painting.height))
 
     def resize(self, size):
         """Return a copy of a Painting resized to the specified size
@@ -133,9 +224,22 @@ class Painting(object):
 
         return Painting(self.img.resize(size))
 
+    def crop(self, box):
+        """Return a copy of a rectangular region of the Painting
+
+        Arguments:
+        box -- the region as a (left, top, right, bottom) tuple
+        """
+
+        return Painting(self.img.crop(box))
+
     def set_pixel_color(self, coordinates, color):
         """Set pixel at the given coordinates to a given color.
 
+        Effects set pixels one at a time, so this only grows a box around
+        the pixels that have been set. The box is added to the dirty
+        regions, and the derived data is cleared, when either is next used.
+
         Arguments:
         coordinates -- coordinates of the pixel as a point.Point
         color -- colour of pixel as a color.Color
@@ -143,6 +247,17 @@ class Painting(object):
 
         self.pixels[coordinates.coordinates] = color.color
 
+        x, y = coordinates.coordinates
+        pixel_box = self.__pixel_box
+        if x < pixel_box[0]:
+            pixel_box[0] = x
+        if x >= pixel_box[2]:
+            pixel_box[2] = x + 1
+        if y < pixel_box[1]:
+            pixel_box[1] = y
+        if y >= pixel_box[3]:
+            pixel_box[3] = y + 1
+
     def get_pixel_color(self, coordinates):
         """Return the color.Color of the pixel at the given coordinates
 
@@ -204,4 +319,151 @@ class Painting(object):
                 coord = point.Point(x, y)
                 if self.is_in_image(coord):
                     pixel_square.append(coord)
-        return pixel_square
\ No newline at end of file
+        return pixel_square
+
+    def mark_dirty(self, box):
+        """Record that a rectangle of the image has changed.
+
+        This method is called by the methods that change the image, and
+        should be called after changing it directly through the pixels
+        property or img. Rectangles that overlap or touch are merged, and
+        once there are more than MAX_DIRTY_REGIONS the two whose merged
+        rectangle adds the least area are merged, so a rectangle can cover
+        some pixels that haven't changed.
+
+        Arguments:
+        box -- the changed region as a (left, top, right, bottom) tuple
+        """
+
+        left, top, right, bottom = box
+        box = max(left, 0), max(top, 0), min(right, self.width), min(bottom, self.height)
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return
+        if self.__derived:
+            self.__derived.clear()
+
+        self.__add_dirty_region(box)
+        if len(self.__dirty_regions) > MAX_DIRTY_REGIONS:
+            self.__merge_closest_regions()
+
+    def pop_dirty_regions(self):
+        """Return the rectangles changed since the last call, and forget them.
+
+        Something that keeps its own copy of the image, such as a texture
+        or an encoder, can call this to update only the regions that changed.
+        """
+
+        self.__add_pixel_box()
+        dirty_regions = self.__dirty_regions
+        self.__dirty_regions = []
+        return dirty_regions
+
+    def __add_pixel_box(self):
+        """Add the box around the pixels set since it was last added to the dirty regions"""
+
+        left, top, right, bottom = self.__pixel_box
+        if left < right:
+            self.__pixel_box = [self.width, self.height, 0, 0]
+            self.mark_dirty((left, top, right, bottom))
+
+    def __add_dirty_region(self, box):
+        """Add a rectangle to the dirty regions, merged with any it overlaps or touches"""
+
+        # Merging can make the rectangle touch others, so keep going until it doesn't
+        merged = True
+        while merged:
+            merged = False
+            for region in self.__dirty_regions:
+                if (region[0] <= box[2] and box[0] <= region[2] and
+                        region[1] <= box[3] and box[1] <= region[3]):
+                    self.__dirty_regions.remove(region)
+                    box = _get_bounding_box(region, box)
+                    merged = True
+                    break
+        self.__dirty_regions.append(box)
+
+    def __merge_closest_regions(self):
+        """Merge the two dirty regions whose bounding box adds the least area.
+
+        The bounding box can reach other regions, so it is merged with
+        them too, and the regions never overlap or touch.
+        """
+
+        def added_area(pair):
+            first, second = pair
+            merged = _get_bounding_box(first, second)
+            return _get_area(merged) - _get_area(first) - _get_area(second)
+
+        pairs = [(first, second) for index, first in enumerate(self.__dirty_regions)
+                 for second in self.__dirty_regions[index + 1:]]
+        first, second = min(pairs, key=added_area)
+        self.__dirty_regions.remove(first)
+        self.__dirty_regions.remove(second)
+        self.__add_dirty_region(_get_bounding_box(first, second))
+
+    def get_derived(self, key, compute):
+        """Return data worked out from the image, computing it only once.
+
+        This method returns the result of calling compute, which is kept
+        until the image is next changed through the Painting, so that
+        several effects or frames working on the same painting can share it.
+        Changes made directly through the pixels property or img.paste are
+        not noticed unless mark_dirty is called afterwards.
+
+        Arguments:
+        key -- hashable value identifying the data
+        compute -- function that takes no arguments and returns the data
+        """
+
+        self.__add_pixel_box()
+        if key not in self.__derived:
+            self.__derived[key] = compute()
+        return self.__derived[key]
+
+    def get_luminance(self):
+        """Return an "L" mode image of the luminance of each pixel.
+
+        The luminance is worked out the same way as color.Color.luminance,
+        the mean of the red, green and blue components rounded down,
+        without making a color.Color for every pixel.
+        """
+
+        return self.get_derived("luminance", self.__get_luminance)
+
+    def get_channels(self):
+        """Return a tuple of an "L" mode image of each band of the image"""
+
+        return self.get_derived("channels", self.img.split)
+
+    def get_histogram(self):
+        """Return the histogram of the image as a list of counts for each value of each band"""
+
+        return self.get_derived("histogram", self.img.histogram)
+
+    def get_colors(self):
+        """Return a list of (count, colour) for each different colour in the image"""
+
+        # Every pixel could be a different colour
+        return self.get_derived("colors", lambda: self.img.getcolors(self.width * self.height))
+
+    def get_unique_color_count(self):
+        return len(self.get_colors())
+
+    def __get_luminance(self):
+        if self.mode == "L":
+            return self.img.copy()
+
+        channels = self.get_channels() if self.mode in ("RGB", "RGBA") else self.img.convert("RGB").split()
+        red, green, blue = channels[:color.RGB_COMPONENT_COUNT]
+        return ImageMath.eval("convert((r + g + b) / 3, 'L')", r=red, g=green, b=blue)
+
+
+def _get_bounding_box(first, second):
+    """Return the smallest (left, top, right, bottom) rectangle containing two others"""
+
+    return (min(first[0], second[0]), min(first[1], second[1]),
+            max(first[2], second[2]), max(first[3], second[3]))
+
+
+def _get_area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
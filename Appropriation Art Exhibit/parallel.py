@@ -0,0 +1,163 @@
+"""Contain functions for applying effects to an image in strips.
+
+This module contains functions that split the result of an effect into
+horizontal strips, work out each strip either in this process or across
+a pool of worker processes, and paste the strips back together.
+Worker processes read the image from, and write their strips to, shared
+memory so that images aren't pickled between processes.
+
+Classes:
+WorkerDied -- exception raised when a worker process exits before finishing
+
+Functions:
+apply_in_strips -- apply an effect to a painting strip by strip
+get_strips -- return the rows of each strip of an image
+"""
+
+
+# Standard Python libraries
+import multiprocessing
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import painting
+import point
+import transport
+
+
+# Seconds between checks that the worker processes are still running
+WORKER_POLL_SECONDS = 0.1
+
+
+class WorkerDied(Exception):
+
+    """Exception raised when a worker process exits before its strips are finished"""
+
+
+def apply_in_strips(effect, painting_to_process, strip_height, workers=1):
+    """Apply an effect to a painting strip by strip.
+
+    This function works out each strip of the result of the effect using
+    effect.Effect.apply_strip and pastes them together into the painting.
+    The result is the same as calling do_effect, however many strips or
+    workers are used. Effects that would work out the whole result for
+    every strip are applied with do_effect instead, as splitting them
+    only makes them slower.
+    Paintings decoded at a reduced scale can only be processed with one
+    worker, as the workers only receive the decoded pixels.
+
+    Arguments:
+    effect -- the effect.Effect that should be applied
+    painting_to_process -- the painting.Painting the effect should be applied to
+    strip_height -- the number of rows in each strip as an int
+    workers -- the number of processes to work out the strips in as an int
+    """
+
+    output_size = effect.get_output_size(painting_to_process.source_size)
+    strips = get_strips(output_size[1], strip_height)
+    if not strips or not effect.splits_into_strips:
+        # A result without any rows has nothing to split, but do_effect may still reject it
+        effect.do_effect(painting_to_process)
+        return
+
+    if workers > 1:
+        if painting_to_process.is_reduced:
+            raise ValueError("Paintings decoded at a reduced scale can't be shared with workers")
+        painting_to_process.img = _apply_in_shared_strips(effect, painting_to_process, output_size,
+                                                          strips, workers)
+        return
+
+    canvas = painting.Painting(Image.new(painting_to_process.mode, output_size))
+    for top, bottom in strips:
+        strip = effect.apply_strip(painting_to_process, top, bottom)
+        canvas.paste(strip, point.Point(0, top))
+    painting_to_process.img = canvas
+
+
+def get_strips(height, strip_height):
+    """Return a list of (top, bottom) rows of each strip of an image.
+
+    Arguments:
+    height -- the height of the image as an int
+    strip_height -- the number of rows in each strip as an int
+    """
+
+    return [(top, min(top + strip_height, height)) for top in range(0, height, strip_height)]
+
+
+def _apply_in_shared_strips(effect, painting_to_process, output_size, strips, workers):
+    """Return the result of an effect worked out in strips by a process pool.
+
+    The painting is published to shared memory once, and the workers write
+    their strips into a shared output image. The workers are checked while
+    the strips are worked out, and if one exits, for example because it
+    crashed, the pool is terminated and WorkerDied is raised. Both segments
+    are unlinked when this function finishes, whether or not it succeeds.
+
+    Arguments:
+    effect -- the effect.Effect that should be applied
+    painting_to_process -- the painting.Painting the effect should be applied to
+    output_size -- the size of the result as a tuple
+    strips -- list of the (top, bottom) rows of each strip
+    workers -- the number of processes to work out the strips in as an int
+    """
+
+    transport.remove_stale_segments()
+    mode = painting_to_process.mode
+    with transport.SharedImage.create(mode, painting_to_process.size, painting_to_process.img) as source:
+        with transport.SharedImage.create(mode, output_size) as output:
+            jobs = [(effect, source.descriptor, output.descriptor, top, bottom) for top, bottom in strips]
+            other_children = set(multiprocessing.active_children())
+            pool = multiprocessing.Pool(workers)
+            pool_workers = [child for child in multiprocessing.active_children() if child not in other_children]
+            try:
+                _wait_for_results([pool.apply_async(_apply_shared_strip, (job,)) for job in jobs], pool_workers)
+            except BaseException:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+            return output.get_image().copy()
+
+
+def _wait_for_results(results, pool_workers):
+    """Wait for the results of a pool, raising WorkerDied if any of its workers exit.
+
+    A pool replaces workers that exit, but the work they were doing is
+    lost and its result would never be ready, so waiting on it would
+    block forever.
+    Exceptions raised by the work are raised again here.
+
+    Arguments:
+    results -- list of the multiprocessing.pool.AsyncResult to wait for
+    pool_workers -- list of the pool's worker multiprocessing.Process
+    """
+
+    for result in results:
+        while not result.ready():
+            for worker in pool_workers:
+                if not worker.is_alive():
+                    raise WorkerDied("Worker process %d exited with code %s" % (worker.pid, worker.exitcode))
+            result.wait(WORKER_POLL_SECONDS)
+        result.get()
+
+
+def _apply_shared_strip(job):
+    """Work out one strip of the result of an effect in shared memory.
+
+    This function is run in the worker processes. It attaches to the shared
+    source and output images and writes its strip into the output.
+
+    Arguments:
+    job -- tuple of the effect, the source and output descriptors and the top and bottom rows
+    """
+
+    effect, source_descriptor, output_descriptor, top, bottom = job
+    with transport.SharedImage.attach(source_descriptor) as source:
+        with transport.SharedImage.attach(output_descriptor) as output:
+            strip = effect.apply_strip(painting.Painting(source.get_image()), top, bottom)
+            output.write_rows(strip.img, top)
@@ -0,0 +1,132 @@
+"""Contain classes for reporting the progress of effects and cancelling them.
+
+This module contains a token that can be used to cancel an effect from
+another thread, and a class the effects use to report how far through
+they are and check whether they have been cancelled between rows or
+blocks of work.
+
+Classes:
+Cancelled -- exception raised when an effect is cancelled
+CancellationToken -- class for asking an effect to stop
+Tracker -- class for reporting progress and checking for cancellation
+"""
+
+
+# Standard Python libraries
+import threading
+
+
+# Most times the progress callback is called while an effect is applied
+REPORT_STEPS = 100
+
+
+class Cancelled(Exception):
+
+    """Exception raised when an effect is cancelled through a CancellationToken"""
+
+
+class CancellationToken(object):
+
+    """Store whether the work the token was given to should stop.
+
+    The token wraps an event, so it can be cancelled from another
+    thread. A multiprocessing.Event can be supplied to cancel work
+    running in another process.
+
+    Public methods:
+    cancel -- ask the work to stop
+    check -- raise Cancelled if the work has been cancelled
+    """
+
+    def __init__(self, event=None):
+        """Initialise the properties.
+
+        Arguments:
+        event -- the threading.Event or multiprocessing.Event that is set on cancel
+        """
+
+        self.__event = event if event is not None else threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.__event.is_set()
+
+    def cancel(self):
+        self.__event.set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled("The effect was cancelled")
+
+
+class Tracker(object):
+
+    """Store properties and methods relating to the progress of an effect.
+
+    Effects create a tracker with the total amount of work they have to
+    do, such as the number of rows, and advance it after each row or
+    block. Cancellation is checked every time it advances, but the
+    callback is called at most REPORT_STEPS times, and once more when
+    the work is finished.
+
+    Public methods:
+    advance -- record that some of the work has been done
+    finish -- record that all of the work has been done
+    """
+
+    def __init__(self, callback=None, cancel_token=None, total=1):
+        """Initialise the properties and check the work hasn't already been cancelled.
+
+        Arguments:
+        callback -- function called with the work done and the total work, or None
+        cancel_token -- CancellationToken the work can be cancelled with, or None
+        total -- the total amount of work as an int
+        """
+
+        self.__callback = callback
+        self.__cancel_token = cancel_token
+        self.__total = max(1, total)
+        self.__done = 0
+        self.__reported = None
+        self.__next_report = 0
+        self.__check()
+
+    @property
+    def done(self):
+        return self.__done
+
+    @property
+    def total(self):
+        return self.__total
+
+    def advance(self, amount=1):
+        """Record that some of the work has been done.
+
+        Raises Cancelled if the cancel token has been cancelled.
+
+        Arguments:
+        amount -- the amount of work that has been done since the last call
+        """
+
+        self.__check()
+        self.__done = min(self.__done + amount, self.__total)
+        if self.__done >= self.__next_report:
+            self.__report()
+            self.__next_report = self.__done + max(1, self.__total / REPORT_STEPS)
+
+    def finish(self):
+        """Record that all of the work has been done, unless it has been cancelled"""
+
+        self.__check()
+        self.__done = self.__total
+        if self.__reported != self.__done:
+            self.__report()
+
+    def __report(self):
+        if self.__callback is not None:
+            self.__callback(self.__done, self.__total)
+        self.__reported = self.__done
+
+    def __check(self):
+        if self.__cancel_token is not None:
+            self.__cancel_token.check()
@@ -0,0 +1,448 @@
+"""Contain the original per-pixel versions of the effects.
+
+This module contains the effects and circle drawing as they were first
+written, working one pixel at a time through painting.Painting. They are
+slow, but simple enough to be trusted, so the harness module checks that
+every faster version of an effect gives exactly the same pixels.
+This module should not be changed to make it faster. The only change
+from the original code is that ShuffleEffect takes a seed and picks the
+randomness of each square the same way as effect.ShuffleEffect, so that
+the results can be compared, and do_effect accepts the progress callback
+and cancel token of effect.Effect, which are ignored.
+
+Classes:
+Circle -- the original midpoint circle drawing
+DotEffect(effect.Effect) -- the original pointillism-like effect
+ShuffleEffect(effect.Effect) -- the original pixel shuffle, seeded per square
+ThreeColorEffect(effect.Effect) -- the original three colour reduction
+TileEffect(effect.Effect) -- the original posterise and tile effect
+"""
+
+
+# Standard Python libraries
+import hashlib
+import random
+
+# Own modules
+import color
+import effect
+import painting
+import point
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+
+
+class Circle():
+
+    """Store data required for drawing circles.
+
+    This class stores the information required to draw a circle
+    and contains a method for drawing a circle on a given image.
+    """
+
+    def __init__(self, centre, radius, color):
+        """Initialise the properties.
+
+        Arguments:
+        centre -- the centre of the circle as a point.Point
+        radius -- the radius of the circle
+        color -- the colour of the circle as a color.Color
+        """
+
+        self.__centre = centre
+        self.__radius = radius
+        self.__color = color
+
+    @property
+    def centre(self):
+        return self.__centre
+
+    @property
+    def radius(self):
+        return self.__radius
+
+    @property
+    def color(self):
+        return self.__color
+
+    def draw(self, canvas):
+        """Draw a circle on the supplied image.
+
+        This method draws a circle corresponding to the instance's
+        properties onto the supplied image, using the midpoint circle
+        algorithm and filling each quarter a row at a time.
+
+        Arguments:
+        canvas -- instance of painting.Painting object to be used as a canvas
+        """
+
+        x = self.radius
+        y = 0
+        decision_over_2 = 1 - x
+
+        while y <= x:
+            # Top quarter of circle
+            for x_coord in range(self.centre.x - y, self.centre.x + y):
+                coord = point.Point(x_coord, self.centre.y - x)
+                if canvas.is_in_image(coord):
+                    canvas.set_pixel_color(coord, self.color)
+
+            # Second quarter of circle
+            for x_coord in range(self.centre.x - x, self.centre.x + x):
+                coord = point.Point(x_coord, self.centre.y - y)
+                if canvas.is_in_image(coord):
+                    canvas.set_pixel_color(coord, self.color)
+
+            # Third quarter of circle
+            for x_coord in range(self.centre.x - x, self.centre.x + x):
+                coord = point.Point(x_coord, self.centre.y + y)
+                if canvas.is_in_image(coord):
+                    canvas.set_pixel_color(coord, self.color)
+
+            # Bottom quarter of circle
+            for x_coord in range(self.centre.x - y, self.centre.x + y):
+                coord = point.Point(x_coord, self.centre.y + x)
+                if canvas.is_in_image(coord):
+                    canvas.set_pixel_color(coord, self.color)
+
+            y += 1
+            if decision_over_2 <= 0:
+                decision_over_2 += 2 * y + 1
+            else:
+                x -= 1
+                decision_over_2 += 2 * (y - x) + 1
+
+
+class DotEffect(effect.Effect):
+
+    """Store fields and methods used to create a dot effect.
+
+    Public methods:
+    do_effect -- applies the effect to the supplied Painting
+    """
+
+    def __init__(self, radius, gap, background):
+        """Initialises the properties.
+
+        Arguments:
+        radius -- radius of the circle as an int
+        gap -- gap between the circles as an int
+        background -- background colour of the image as a color.Color
+        """
+
+        self.__radius = radius
+        self.__gap = gap
+        self.__background = background
+
+    @property
+    def radius(self):
+        return self.__radius
+
+    @property
+    def diameter(self):
+        return self.__radius*2
+
+    @property
+    def gap(self):
+        return self.__gap
+
+    @property
+    def background(self):
+        return self.__background
+
+    @property
+    def parameters(self):
+        return self.radius, self.gap, self.background.color
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
+        """Process an image so that it is made up of circles.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        """
+
+        distance_between_centres = self.diameter + self.gap
+        first_centre = distance_between_centres/2
+        canvas = painting.copy()
+        canvas.clear_image(self.background)
+
+        for x in range(first_centre, painting.width, distance_between_centres):
+            for y in range(first_centre, painting.height, distance_between_centres):
+                centre = point.Point(x, y)
+                centre_color = painting.get_pixel_color(centre)
+                circle = Circle(centre, self.radius, centre_color)
+                circle.draw(canvas)
+
+        painting.img = canvas
+
+
+class ShuffleEffect(effect.Effect):
+
+    """Store fields and methods used to create a shuffle effect.
+
+    Public methods:
+    do_effect -- applies the effect to the supplied Painting
+    """
+
+    def __init__(self, shuffle_step, randomness, seed):
+        """Initialise the properties.
+
+        Arguments:
+        shuffle_step -- base amount that the pixels are allowed to move as an int
+        randomness -- amount that the shuffle_step is allowed to vary for each pixel as an int
+        seed -- integer that the random square sizes and shuffles are derived from
+        """
+
+        self.__shuffle_step = shuffle_step
+        self.__randomness = randomness
+        self.__seed = seed
+
+    @property
+    def shuffle_step(self):
+        return self.__shuffle_step
+
+    @property
+    def randomness(self):
+        return self.__randomness
+
+    @property
+    def seed(self):
+        return self.__seed
+
+    @property
+    def parameters(self):
+        return self.shuffle_step, self.randomness, self.seed
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
+        """Process an image so that its pixels are shuffled.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        """
+
+        original_painting = painting.copy()
+        for x in range(0, painting.width, self.shuffle_step):
+            for y in range(0, painting.height, self.shuffle_step):
+                square_key = "%d:%d:%d" % (self.seed, x / self.shuffle_step, y / self.shuffle_step)
+                square_random = random.Random(int(hashlib.sha1(square_key).hexdigest(), 16))
+
+                current_coordinate = point.Point(x, y)
+                squaresize = square_random.randrange(self.shuffle_step,
+                                                     self.shuffle_step * self.randomness)
+                pixel_square = original_painting.get_square(current_coordinate,
+                                                            squaresize, squaresize)
+                shuffled_pixel_square = pixel_square
+                square_random.shuffle(shuffled_pixel_square)
+
+                for pixel in pixel_square:
+                    new_pixel_color = original_painting.get_pixel_color(pixel)
+                    pixel_to_be_replaced = shuffled_pixel_square.pop()
+                    painting.set_pixel_color(pixel_to_be_replaced, new_pixel_color)
+
+
+class ThreeColorEffect(effect.Effect):
+
+    """Store fields and methods used to reduce an image three colours.
+
+    Public methods:
+    do_effect -- applies the effect to the supplied Painting
+    """
+
+    def __init__(self, threshold, difference, replacement_colors):
+        """Initialises the properties.
+
+        Arguments:
+        threshold -- value that the color component must be at to change
+        difference -- amount that the component value must be larger than the other two
+        replacement_colors -- colors that each dominant component will be replaced by
+        """
+
+        self.__threshold = threshold
+        self.__difference = difference
+        self.__replacement_colors = replacement_colors
+
+    @property
+    def threshold(self):
+        return self.__threshold
+
+    @property
+    def difference(self):
+        return self.__difference
+
+    @property
+    def replacement_colors(self):
+        return self.__replacement_colors
+
+    @property
+    def parameters(self):
+        return (self.threshold, self.difference,
+                tuple(replacement_color.color for replacement_color in self.replacement_colors))
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
+        """Process an image so that it is made up of three colours and black.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        """
+
+        for component_index in range(color.RGB_COMPONENT_COUNT):
+            self.__change_dominant_color(component_index, painting)
+        self.__change_rest_to_black(painting)
+
+    def __change_dominant_color(self, current_component_index, painting):
+        for x in range(painting.width):
+            for y in range(painting.height):
+                current_coordinate = point.Point(x, y)
+                current_pixel_color = painting.get_pixel_color(current_coordinate)
+                can_change = self.__check_dominant_color(current_pixel_color, current_component_index)
+
+                if can_change:
+                    painting.set_pixel_color(current_coordinate, self.replacement_colors[current_component_index])
+
+    def __check_dominant_color(self, current_pixel_color, target_component_index):
+        can_change = True
+
+        for current_component_index in range(color.RGB_COMPONENT_COUNT):
+            current_component_value = current_pixel_color.get_component_by_index(current_component_index)
+            component_being_checked = current_pixel_color.get_component_by_index(target_component_index)
+
+            if current_component_index != target_component_index:
+                if (current_component_value >= component_being_checked * self.difference):
+                    can_change = False
+            elif current_component_value <= self.threshold:
+                can_change = False
+
+        return can_change
+
+    def __change_rest_to_black(self, painting):
+        for x in range(painting.width):
+            for y in range(painting.height):
+                current_coordinate = point.Point(x, y)
+                current_pixel_color = painting.get_pixel_color(current_coordinate)
+                if current_pixel_color not in self.replacement_colors:
+                    painting.set_pixel_color(current_coordinate, color.Color(*color.BLACK))
+
+
+class TileEffect(effect.Effect):
+
+    """Store fields and methods used to posterise and tile an image.
+
+    Public methods:
+    do_effect -- applies the effect to the supplied Painting
+    """
+
+    def __init__(self, colors, levels, size):
+        """Initialises the properties.
+
+        Arguments:
+        colors -- a list of color.Color that the posterisation will be based on
+        levels -- the number of posterisation levels as an integer
+        size -- the number of tiles vertically and horizontally as an integer
+        """
+
+        self.__colors = colors
+        self.__levels = levels
+        self.__size = size
+
+    @property
+    def colors(self):
+        return self.__colors
+
+    @property
+    def number_of_colors(self):
+        return len(self.colors)
+
+    @property
+    def levels(self):
+        return self.__levels
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def parameters(self):
+        return tuple(tile_color.color for tile_color in self.colors), self.levels, self.size
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
+        """Process an image so that it is posterised and tiled.
+
+        Arguments:
+        painting -- the painting.Painting that the effect should be applied to
+        """
+
+        paintings = self.__get_paintings(painting)
+        self.__color_posterise(paintings)
+        new_painting = self.__tile_images(paintings)
+        painting.img = new_painting
+
+    def get_output_size(self, size):
+        tile_width = size[0] / self.size
+        tile_height = size[1] / self.size
+        return tile_width * self.size, tile_height * self.size
+
+    def __get_paintings(self, painting):
+        paintings = []
+        smaller_painting = painting.resize(self.__get_tile_size(painting))
+
+        for i in range(self.number_of_colors):
+            new_painting = smaller_painting.copy()
+            paintings.append(new_painting)
+        return paintings
+
+    def __color_posterise(self, paintings):
+        for x in range(paintings[0].width):
+            for y in range(paintings[0].height):
+                current_coordinate = point.Point(x, y)
+                current_pixel_color = paintings[0].get_pixel_color(current_coordinate)
+                lum_step = float(color.MAX_COMPONENT_VALUE) / self.levels
+                difference = color.MAX_COMPONENT_VALUE / self.levels
+
+                if current_pixel_color.luminance <= lum_step:
+                    for i in range(self.number_of_colors):
+                        target_color = self.colors[i].copy()
+                        paintings[i].set_pixel_color(current_coordinate, target_color)
+                else:
+                    lum = lum_step
+                    next_lum = lum + lum_step
+                    iterations = 1
+
+                    while lum < color.MAX_COMPONENT_VALUE:
+                        if lum < current_pixel_color.luminance <= next_lum:
+                            for i in range(self.number_of_colors):
+                                target_color = self.colors[i].copy()
+                                target_color.color = target_color + (difference * iterations)
+                                paintings[i].set_pixel_color(current_coordinate, target_color)
+                            break
+
+                        else:
+                            lum = next_lum
+                            next_lum = lum + lum_step
+                            iterations += 1
+
+    def __get_tile_size(self, painting):
+        tile_width = painting.width / self.size
+        tile_height = painting.height / self.size
+        return tile_width, tile_height
+
+    def __tile_images(self, paintings):
+        index = 0
+        current_painting = paintings[index]
+        canvas_size = current_painting.width * self.size, current_painting.height * self.size
+        canvas = painting.Painting(Image.new(current_painting.mode, canvas_size))
+
+        for x in range(0, canvas.width, current_painting.width):
+            for y in range(0, canvas.height, current_painting.height):
+                coordinates = point.Point(x, y)
+                canvas.paste(current_painting, coordinates)
+                index += 1
+                current_painting = paintings[index % len(paintings)]
+        return canvas
+
+
+# The reference version of each effect, keyed by the name of the effect class
+EFFECTS = dict((effect_class.__name__, effect_class)
+               for effect_class in (DotEffect, ShuffleEffect, ThreeColorEffect, TileEffect))
@@ -0,0 +1,321 @@
+"""Contain classes for running batches of effects within a memory budget.
+
+This module contains a scheduler that runs effect jobs in separate
+processes, only starting a job while the estimated memory of all the
+running jobs stays under a budget. Estimates are based on the size and
+mode of the image and the type of effect, and are corrected using the
+peak memory each job is measured to have used.
+
+Classes:
+Job -- class for storing an effect to apply to an image file
+MemoryScheduler -- class for running jobs within a memory budget
+
+Functions:
+read_image_header -- return the mode and size of an image file without decoding it
+get_decoded_bytes -- return the number of bytes Pillow uses to store a decoded image
+get_image_bytes -- return the number of bytes a decoded image file uses
+"""
+
+
+# Standard Python libraries
+import collections
+import json
+import multiprocessing
+import os
+import Queue
+import resource
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import painting
+
+
+# Number of copies of the decoded image each effect holds at its peak,
+# used until the scheduler has measured the effect itself
+DEFAULT_COPIES = {"DotEffect": 3.0,
+                  "ShuffleEffect": 3.0,
+                  "ThreeColorEffect": 1.5,
+                  "TileEffect": 2.5,
+                  "QuantizeEffect": 3.0}
+UNKNOWN_EFFECT_COPIES = 4.0
+# How much each new measurement changes the learned number of copies
+LEARNING_RATE = 0.5
+# Bytes Pillow stores per pixel for single band and multi band images
+SINGLE_BAND_BYTES = 1
+MULTI_BAND_BYTES = 4
+# ru_maxrss is measured in kilobytes on Linux
+MAXRSS_UNIT = 1024
+# How long to wait for a result before checking for crashed workers, in seconds
+POLL_INTERVAL = 0.1
+
+
+class Job(object):
+
+    """Store an effect to apply to an image file and where to save it.
+
+    This class stores the information needed to run one effect on one
+    image, along with the result once the job has been run.
+    The mode and size of the image are read from its header the first
+    time they are needed, and kept for every later estimate.
+    """
+
+    def __init__(self, effect, source_path, output_path):
+        """Initialise the properties.
+
+        Arguments:
+        effect -- the effect.Effect that should be applied
+        source_path -- string containing the location of the image file
+        output_path -- string containing the location the result should be saved
+        """
+
+        self.__effect = effect
+        self.__source_path = source_path
+        self.__output_path = output_path
+        self.__image_header = None
+        self.peak_memory = None
+        self.error = None
+
+    @property
+    def effect(self):
+        return self.__effect
+
+    @property
+    def source_path(self):
+        return self.__source_path
+
+    @property
+    def output_path(self):
+        return self.__output_path
+
+    @property
+    def mode(self):
+        return self.__get_image_header()[0]
+
+    @property
+    def size(self):
+        return self.__get_image_header()[1]
+
+    @property
+    def image_bytes(self):
+        """Return the number of bytes Pillow uses to store the decoded image"""
+
+        return get_decoded_bytes(self.mode, self.size)
+
+    def __get_image_header(self):
+        """Return the mode and size of the image, reading them from its header the first time"""
+
+        if self.__image_header is None:
+            self.__image_header = read_image_header(self.source_path)
+        return self.__image_header
+
+
+class MemoryScheduler(object):
+
+    """Store properties and methods relating to running jobs within a memory budget.
+
+    This class runs jobs in their own processes, starting a new one only
+    while the total estimated memory of the running jobs stays under the
+    budget. A job is always started if nothing else is running, even if it
+    is estimated to be over the budget on its own, so every job gets run.
+
+    Public methods:
+    estimate -- return the estimated peak memory of a job in bytes
+    record -- learn from the measured peak memory of a job
+    run -- run a list of jobs
+    save -- save what has been learned about each effect
+    """
+
+    def __init__(self, budget, max_workers=None, learned_path=None):
+        """Initialise the properties.
+
+        Arguments:
+        budget -- the most memory the running jobs may use in bytes
+        max_workers -- the most jobs that may run at once, defaults to the number of CPUs
+        learned_path -- string containing the location learned estimates are kept in
+        """
+
+        self.__budget = budget
+        self.__max_workers = max_workers or multiprocessing.cpu_count()
+        self.__learned_path = learned_path
+        self.__copies = {}
+
+        if learned_path is not None and os.path.exists(learned_path):
+            with open(learned_path) as learned_file:
+                self.__copies = json.load(learned_file)
+
+    @property
+    def budget(self):
+        return self.__budget
+
+    @property
+    def max_workers(self):
+        return self.__max_workers
+
+    def estimate(self, job):
+        """Return the estimated peak memory of a job in bytes.
+
+        The size and mode of the image are read from its header without
+        decoding it, the first time the job is estimated.
+
+        Arguments:
+        job -- the Job to estimate
+        """
+
+        return int(job.image_bytes * self.__get_copies(job.effect, job.mode))
+
+    def record(self, job, peak_memory):
+        """Learn from the measured peak memory of a job.
+
+        Arguments:
+        job -- the Job that was run
+        peak_memory -- the peak memory the job was measured using in bytes
+        """
+
+        key = self.__get_key(job.effect, job.mode)
+        measured_copies = float(peak_memory) / max(1, job.image_bytes)
+        if key in self.__copies:
+            self.__copies[key] += LEARNING_RATE * (measured_copies - self.__copies[key])
+        else:
+            self.__copies[key] = measured_copies
+
+    def run(self, jobs):
+        """Run a list of jobs and return them once they have all finished.
+
+        Each job's peak_memory is set once it has run, or its error is set
+        if it failed.
+
+        Arguments:
+        jobs -- list of Job objects
+        """
+
+        pending = collections.deque(enumerate(jobs))
+        # Running jobs keyed by their index in jobs
+        running = {}
+        results = multiprocessing.Queue()
+        memory_in_use = 0
+
+        while pending or running:
+            while pending and len(running) < self.max_workers:
+                try:
+                    estimate = self.estimate(pending[0][1])
+                except IOError as error:
+                    index, job = pending.popleft()
+                    job.error = repr(error)
+                    continue
+                if running and memory_in_use + estimate > self.budget:
+                    break
+                index, job = pending.popleft()
+                process = multiprocessing.Process(target=_run_job, args=(index, job, results))
+                process.start()
+                running[index] = (process, estimate)
+                memory_in_use += estimate
+
+            try:
+                index, peak_memory, error = results.get(timeout=POLL_INTERVAL)
+            except Queue.Empty:
+                for index, (process, estimate) in running.items():
+                    if not process.is_alive() and results.empty():
+                        jobs[index].error = "Worker exited with code %s" % process.exitcode
+                        del running[index]
+                        memory_in_use -= estimate
+                continue
+
+            process, estimate = running.pop(index)
+            process.join()
+            memory_in_use -= estimate
+            if error is None:
+                jobs[index].peak_memory = peak_memory
+                self.record(jobs[index], peak_memory)
+            else:
+                jobs[index].error = error
+
+        return jobs
+
+    def save(self):
+        """Save what has been learned about each effect to the learned path"""
+
+        if self.__learned_path is not None:
+            with open(self.__learned_path, "w") as learned_file:
+                json.dump(self.__copies, learned_file, indent=4, sort_keys=True)
+
+    def __get_copies(self, effect, mode):
+        """Return the number of copies of the image an effect holds at its peak.
+
+        Arguments:
+        effect -- the effect.Effect being estimated
+        mode -- the mode of the image
+        """
+
+        key = self.__get_key(effect, mode)
+        if key in self.__copies:
+            return self.__copies[key]
+        return DEFAULT_COPIES.get(effect.__class__.__name__, UNKNOWN_EFFECT_COPIES)
+
+    def __get_key(self, effect, mode):
+        """Return the key that learned estimates for an effect and mode are stored under"""
+
+        return "%s:%s" % (effect.__class__.__name__, mode)
+
+
+def read_image_header(path):
+    """Return the mode and size of an image file without decoding it.
+
+    Arguments:
+    path -- string containing the location of the image file
+    """
+
+    with open(path, "rb") as image_file:
+        img = Image.open(image_file)
+        return img.mode, img.size
+
+
+def get_decoded_bytes(mode, size):
+    """Return the number of bytes Pillow uses to store a decoded image.
+
+    Arguments:
+    mode -- the mode of the image
+    size -- the size of the image as a tuple
+    """
+
+    if Image.getmodebands(mode) == 1:
+        bytes_per_pixel = SINGLE_BAND_BYTES
+    else:
+        bytes_per_pixel = MULTI_BAND_BYTES
+    return size[0] * size[1] * bytes_per_pixel
+
+
+def get_image_bytes(path):
+    """Return the number of bytes Pillow uses to store a decoded image.
+
+    Arguments:
+    path -- string containing the location of the image file
+    """
+
+    return get_decoded_bytes(*read_image_header(path))
+
+
+def _run_job(index, job, results):
+    """Run a job and put its index, peak memory and any error on the results queue.
+
+    This function is run in a new process for each job, so the increase in
+    the process's peak memory is the memory the job used.
+
+    Arguments:
+    index -- the index of the job in the list being run
+    job -- the Job to run
+    results -- multiprocessing.Queue the result is put on
+    """
+
+    start_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        job_painting = painting.Painting(job.source_path, job.effect.get_required_size)
+        job.effect.do_effect(job_painting)
+        job_painting.save(job.output_path)
+    except Exception as error:
+        results.put((index, None, repr(error)))
+        return
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_memory
+    results.put((index, peak_memory * MAXRSS_UNIT, None))
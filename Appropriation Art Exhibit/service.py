@@ -0,0 +1,286 @@
+"""Contain a local HTTP service that applies effects to images.
+
+This module contains a long-running service that other tools can send
+effect jobs to over HTTP on localhost. Jobs are run by a pool of worker
+processes that are started once, with Pillow and the effect, painting
+and color modules already imported, so each job doesn't pay for
+starting Python.
+
+Requests:
+POST /jobs -- run a job described by a JSON object with the keys
+    effect -- name of the effect class, such as "TileEffect"
+    parameters -- object of the effect's arguments, with colours as lists
+    source -- path of the image to process, or
+    image -- the image file to process encoded in base64
+    output -- optional path the result should be saved to
+    The response has the output path, or the result encoded in base64
+    under "image" if no output path was given. Invalid jobs are
+    answered with status 400, and jobs that fail or take longer than
+    the job timeout with status 500.
+GET /stats -- return the queue depth, job latencies and throughput
+
+Classes:
+JobError -- exception raised when a job is invalid
+JobService -- class for queuing jobs and keeping statistics about them
+JobRequestHandler -- class for handling HTTP requests to the service
+JobServer -- HTTP server that handles each request in its own thread
+
+Functions:
+main -- start the service from the command line
+"""
+
+
+# Standard Python libraries
+import argparse
+import base64
+import BaseHTTPServer
+import collections
+import importlib
+import io
+import json
+import multiprocessing
+import SocketServer
+import threading
+import time
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import effect
+import painting
+
+
+DEFAULT_PORT = 8120
+# Number of recent job latencies used for the statistics
+LATENCY_HISTORY = 100
+# Format results are returned in when they aren't saved to a file
+DEFAULT_FORMAT = "PNG"
+# Modules each worker imports when it starts, so that its first job
+# doesn't pay for them
+WARM_MODULES = ("PIL.Image", "PIL.ImageChops", "PIL.ImageMath", "color", "effect", "painting")
+# Seconds a job may take before the request fails, which also stops a
+# request waiting forever if the worker running its job dies
+DEFAULT_JOB_TIMEOUT = 600
+
+
+class JobError(Exception):
+
+    """Exception raised when a job is invalid, such as naming an unknown effect"""
+
+
+class JobService(object):
+
+    """Store the worker pool and statistics for the service.
+
+    This class queues jobs on a pool of worker processes that is started
+    when the service is created, and keeps track of how many jobs are
+    waiting and how long they take.
+
+    Public methods:
+    run_job -- run a job and return its result
+    get_stats -- return statistics about the jobs that have been run
+    close -- stop the worker processes
+    """
+
+    def __init__(self, workers=None, job_timeout=DEFAULT_JOB_TIMEOUT):
+        """Initialise the properties and start the worker processes.
+
+        Arguments:
+        workers -- the number of worker processes, defaults to the number of CPUs
+        job_timeout -- the most seconds to wait for a job's result
+        """
+
+        self.__pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(), _warm_worker)
+        self.__job_timeout = job_timeout
+        self.__lock = threading.Lock()
+        self.__start_time = time.time()
+        self.__queued = 0
+        self.__completed = 0
+        self.__failed = 0
+        self.__latencies = collections.deque(maxlen=LATENCY_HISTORY)
+
+    def run_job(self, job):
+        """Run a job on the worker pool and return its result.
+
+        This method blocks the calling thread until the job has finished.
+        Raises JobError if the job is invalid, and
+        multiprocessing.TimeoutError if there is no result within the
+        job timeout. A job that times out may still be running in its worker.
+
+        Arguments:
+        job -- dictionary describing the job, as sent to POST /jobs
+        """
+
+        start = time.time()
+        with self.__lock:
+            self.__queued += 1
+        try:
+            result = self.__pool.apply_async(_run_job, (job,)).get(self.__job_timeout)
+        except Exception:
+            with self.__lock:
+                self.__failed += 1
+            raise
+        else:
+            with self.__lock:
+                self.__completed += 1
+                self.__latencies.append(time.time() - start)
+            return result
+        finally:
+            with self.__lock:
+                self.__queued -= 1
+
+    @property
+    def job_timeout(self):
+        return self.__job_timeout
+
+    def get_stats(self):
+        """Return a dictionary of statistics about the jobs that have been run"""
+
+        with self.__lock:
+            uptime = time.time() - self.__start_time
+            latencies = list(self.__latencies)
+            stats = {"queue_depth": self.__queued,
+                     "completed": self.__completed,
+                     "failed": self.__failed,
+                     "uptime": uptime,
+                     "throughput": self.__completed / uptime if uptime else 0.0}
+
+        if latencies:
+            stats["latency"] = {"last": latencies[-1],
+                                "mean": sum(latencies) / len(latencies),
+                                "max": max(latencies)}
+        return stats
+
+    def close(self):
+        """Stop the worker processes once the jobs they are running finish"""
+
+        self.__pool.close()
+        self.__pool.join()
+
+
+class JobRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Handle HTTP requests to the service.
+
+    The server this handler is used with must have a job_service
+    attribute holding the JobService.
+    """
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.__send_json(200, self.server.job_service.get_stats())
+        else:
+            self.__send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            self.__send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            result = self.server.job_service.run_job(self.__read_job())
+        except JobError as error:
+            self.__send_json(400, {"error": str(error)})
+        except Exception as error:
+            self.__send_json(500, {"error": repr(error)})
+        else:
+            self.__send_json(200, result)
+
+    def __read_job(self):
+        """Return the job in the body of the request, raising JobError if it isn't a JSON object"""
+
+        try:
+            length = int(self.headers.getheader("content-length", 0))
+            job = json.loads(self.rfile.read(length))
+        except ValueError as error:
+            raise JobError("Request body isn't a JSON job: %s" % error)
+        if not isinstance(job, dict):
+            raise JobError("Job must be a JSON object")
+        return job
+
+    def __send_json(self, status, content):
+        """Send a response with a JSON body.
+
+        Arguments:
+        status -- the HTTP status code as an int
+        content -- object that should be sent as JSON
+        """
+
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class JobServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """HTTP server that handles each request in its own thread"""
+
+    daemon_threads = True
+
+
+def _warm_worker():
+    """Import the modules jobs use and register Pillow's file formats in a new worker process"""
+
+    for module_name in WARM_MODULES:
+        importlib.import_module(module_name)
+    Image.init()
+
+
+def _run_job(job):
+    """Run a job and return its result as a dictionary.
+
+    This function is run in the worker processes. JobError is raised if
+    the effect can't be created or the image can't be read.
+
+    Arguments:
+    job -- dictionary describing the job, as sent to POST /jobs
+    """
+
+    try:
+        job_effect = effect.create_effect(job["effect"], job.get("parameters", {}))
+        if "source" in job:
+            job_painting = painting.Painting(str(job["source"]), job_effect.get_required_size)
+        else:
+            job_painting = painting.Painting(Image.open(io.BytesIO(base64.b64decode(job["image"]))))
+    except (KeyError, TypeError, ValueError, AttributeError, IOError) as error:
+        raise JobError("Invalid job: %r" % error)
+    image_format = job_painting.img.format or DEFAULT_FORMAT
+
+    job_effect.do_effect(job_painting)
+
+    if "output" in job:
+        job_painting.save(str(job["output"]))
+        return {"output": job["output"]}
+
+    output = io.BytesIO()
+    job_painting.img.save(output, image_format)
+    return {"image": base64.b64encode(output.getvalue())}
+
+
+def main():
+    """Start the service from the command line"""
+
+    parser = argparse.ArgumentParser(description="Run the local effect job service.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--job-timeout", type=float, default=DEFAULT_JOB_TIMEOUT)
+    arguments = parser.parse_args()
+
+    server = JobServer(("127.0.0.1", arguments.port), JobRequestHandler)
+    server.job_service = JobService(arguments.workers, arguments.job_timeout)
+    print "Serving effect jobs on http://127.0.0.1:%d" % arguments.port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.job_service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,11 +6,24 @@ It currently only contains a class for circles.
 
 Classes:
 Circle -- class for storing circle information and drawing circles
+
+Functions:
+get_circle_spans -- return the rows of pixels that make up a filled circle
+get_circle_mask -- return an image of a filled circle for pasting through
 """
 
 
 # Own module
 import point
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+
+# Spans and masks of the circles drawn so far, keyed by radius
+_spans = {}
+_masks = {}
 
 
 class Circle():
@@ -46,60 +59,110 @@ class Circle():
     def color(self):
         return self.__color
 
+    @property
+    def spans(self):
+        """Return the horizontal spans of pixels that make up the circle.
+
+        The spans only depend on the radius, so they are worked out once for
+        each radius and shared by every circle of that size.
+        """
+
+        if self.radius not in _spans:
+            _spans[self.radius] = get_circle_spans(self.radius)
+        return _spans[self.radius]
+
     def draw(self, canvas):
         """Draw a circle on the supplied image.
 
         This method draws a circle corresponding to the instance's
         properties onto the supplied image.
 
-        Note:
-        It draws the circle using the midpoint circle algorithm described
-        here - https://en.wikipedia.org/wiki/Midpoint_circle_algorithm
-        This code is adapted from the C example halfway down the Wikipedia page.
-        The circle is then filled using the idea in the top answer at -
-        http://stackoverflow.com/questions/1201200/fast-algorithm-for-drawing-filled-circles
-
-        All of the literals present in this method were used in the algorithm
-        I was not sure what they represent so left them as literals
-
         Arguments:
         canvas -- instance of painting.Painting object to be used as a canvas
         """
 
-        x = self.radius
-        y = 0
-        # Named this variable the same as in the example on Wikipedia
-        decision_over_2 = 1 - x
-
-        while y <= x:
-            # Top quarter of circle
-            for x_coord in range(self.centre.x - y, self.centre.x + y):
-                coord = point.Point(x_coord, self.centre.y - x)
+        for y_offset, start_offset, end_offset in self.spans:
+            y_coord = self.centre.y + y_offset
+            for x_coord in range(self.centre.x + start_offset, self.centre.x + end_offset):
+                coord = point.Point(x_coord, y_coord)
                 if canvas.is_in_image(coord):
                     canvas.set_pixel_color(coord, self.color)
 
-            # Second quarter of circle
-            for x_coord in range(self.centre.x - x, self.centre.x + x):
-                coord = point.Point(x_coord, self.centre.y - y)
-                if canvas.is_in_image(coord):
-                    canvas.set_pixel_color(coord, self.color)
 
-            # Third quarter of circle
-            for x_coord in range(self.centre.x - x, self.centre.x + x):
-                coord = point.Point(x_coord, self.centre.y + y)
-                if canvas.is_in_image(coord):
-                    canvas.set_pixel_color(coord, self.color)
+def get_circle_spans(radius):
+    """Return the horizontal spans of pixels in a filled circle.
 
-            # Bottom quarter of circle
-            for x_coord in range(self.centre.x - y, self.centre.x + y):
-                coord = point.Point(x_coord, self.centre.y + x)
-                if canvas.is_in_image(coord):
-                    canvas.set_pixel_color(coord, self.color)
+    This function returns a list of (y_offset, start_offset, end_offset)
+    tuples, relative to the centre of the circle, where each tuple is a row
+    of pixels from start_offset up to but not including end_offset.
+    Spans can overlap.
+
+    Note:
+    It finds the circle using the midpoint circle algorithm described
+    here - https://en.wikipedia.org/wiki/Midpoint_circle_algorithm
+    This code is adapted from the C example halfway down the Wikipedia page.
+    The circle is then filled using the idea in the top answer at -
+    http://stackoverflow.com/questions/1201200/fast-algorithm-for-drawing-filled-circles
+
+    All of the literals present in this function were used in the algorithm
+    I was not sure what they represent so left them as literals
+
+    Arguments:
+    radius -- the radius of the circle
+    """
+
+    spans = []
+    x = radius
+    y = 0
+    # Named this variable the same as in the example on Wikipedia
+    decision_over_2 = 1 - x
+
+    while y <= x:
+        # Top quarter of circle
+        spans.append((-x, -y, y))
+        # Second quarter of circle
+        spans.append((-y, -x, x))
+        # Third quarter of circle
+        spans.append((y, -x, x))
+        # Bottom quarter of circle
+        spans.append((x, -y, y))
+
+        # Literals in algorithm, wasn't sure what they represent
+        y += 1
+        if decision_over_2 <= 0:
+            decision_over_2 += 2 * y + 1
+        else:
+            x -= 1
+            decision_over_2 += 2 * (y - x) + 1
+    return spans
+
+
+def get_circle_mask(radius):
+    """Return an "L" mode mask of a filled circle and its offset from the centre.
+
+    This function returns a tuple of the mask and the (x, y) offset of
+    its top left corner from the centre of the circle. The mask is 255
+    exactly where Circle.draw sets pixels, so pasting a colour through it
+    gives the same pixels, apart from draw never setting pixels in the
+    first row and column of the canvas.
+    The mask is None if a circle of the radius has no pixels.
+
+    Arguments:
+    radius -- the radius of the circle
+    """
 
-            # Literals in algorithm, wasn't sure what they represent
-            y += 1
-            if decision_over_2 <= 0:
-                decision_over_2 += 2 * y + 1
-            else:
-                x -= 1
-                decision_over_2 += 2 * (y - x) + 1
\ No newline at end of file
+    if radius not in _masks:
+        spans = [span for span in get_circle_spans(radius) if span[1] < span[2]]
+        if not spans:
+            _masks[radius] = None, (0, 0)
+        else:
+            left = min(start for y_offset, start, end in spans)
+            top = min(y_offset for y_offset, start, end in spans)
+            right = max(end for y_offset, start, end in spans)
+            bottom = max(y_offset for y_offset, start, end in spans) + 1
+
+            mask = Image.new("L", (right - left, bottom - top), 0)
+            for y_offset, start, end in spans:
+                mask.paste(255, (start - left, y_offset - top, end - left, y_offset - top + 1))
+            _masks[radius] = mask, (left, top)
+    return _masks[radius]
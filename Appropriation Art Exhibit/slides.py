@@ -0,0 +1,145 @@
+"""Contain a class and functions for loading slides of the gallery lazily.
+
+This module contains what the Kivy carousel needs to only keep the
+slides near the current one in memory: a cache that forgets the least
+recently used slides once they take up too much memory, a function that
+decodes an image no larger than the window, and a function that works
+out which slides to load next. None of it depends on Kivy.
+
+Classes:
+SlideCache -- class for keeping recently used slides within a memory cap
+
+Functions:
+load_slide_image -- return an image decoded and shrunk to fit a size
+get_slides_to_load -- return the slides around the current one, in the order to load them
+"""
+
+
+# Standard Python libraries
+import collections
+
+# Own modules
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+
+
+DEFAULT_CACHE_BYTES = 128 * 1024 * 1024
+# Number of slides loaded ahead in the direction the user is swiping
+PREFETCH_DISTANCE = 2
+
+
+class SlideCache(object):
+
+    """Store properties and methods relating to caching slides.
+
+    This class keeps slides, such as textures, keyed by the path of their
+    image. Once they take up more than max_bytes, the least recently used
+    slides are forgotten until they fit, apart from any that are in use.
+
+    Public methods:
+    get -- return a slide and mark it as recently used
+    put -- add a slide, forgetting old slides if the cache is too large
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        """Initialise the properties.
+
+        Arguments:
+        max_bytes -- the most memory the slides should take up, in bytes
+        """
+
+        self.__max_bytes = max_bytes
+        # Slides and their size in bytes, least recently used first
+        self.__slides = collections.OrderedDict()
+        self.__total_bytes = 0
+
+    @property
+    def max_bytes(self):
+        return self.__max_bytes
+
+    @property
+    def total_bytes(self):
+        return self.__total_bytes
+
+    def __len__(self):
+        return len(self.__slides)
+
+    def __contains__(self, path):
+        return path in self.__slides
+
+    def get(self, path):
+        """Return the slide for a path, or None if it isn't cached.
+
+        Arguments:
+        path -- the path of the slide's image
+        """
+
+        if path not in self.__slides:
+            return None
+        slide, size = self.__slides.pop(path)
+        self.__slides[path] = slide, size
+        return slide
+
+    def put(self, path, slide, size, in_use=()):
+        """Add a slide, forgetting the least recently used ones if the cache is too large.
+
+        Slides in use are never forgotten, so the cache can go over
+        max_bytes if the slides in use don't fit on their own.
+
+        Arguments:
+        path -- the path of the slide's image
+        slide -- the slide to cache
+        size -- the memory the slide takes up, in bytes
+        in_use -- paths of the slides that are being shown
+        """
+
+        if path in self.__slides:
+            self.__total_bytes -= self.__slides.pop(path)[1]
+        self.__slides[path] = slide, size
+        self.__total_bytes += size
+
+        for old_path in list(self.__slides):
+            if self.__total_bytes <= self.max_bytes:
+                break
+            if old_path != path and old_path not in in_use:
+                self.__total_bytes -= self.__slides.pop(old_path)[1]
+
+
+def load_slide_image(path, max_size):
+    """Return an "RGBA" image of a file shrunk to fit within a size.
+
+    JPEG files are decoded at a reduced scale where possible, so large
+    images don't need to be decoded in full.
+
+    Arguments:
+    path -- string containing the location of the image
+    max_size -- the largest size the image should be, such as the window size
+    """
+
+    slide_image = Image.open(path)
+    # thumbnail decodes JPEG files at the smallest scale that fits, with draft
+    slide_image.thumbnail(max_size, Image.ANTIALIAS)
+    return slide_image.convert("RGBA")
+
+
+def get_slides_to_load(index, previous_index, slide_count, distance=PREFETCH_DISTANCE):
+    """Return the indexes of the slides around the current one, in the order to load them.
+
+    The current slide comes first, then the slides ahead of it in the
+    direction the user last swiped, then the one slide behind it.
+
+    Arguments:
+    index -- the index of the current slide
+    previous_index -- the index of the slide before the last swipe
+    slide_count -- the number of slides
+    distance -- the number of slides to load ahead
+    """
+
+    direction = -1 if index < previous_index else 1
+    indexes = [index]
+    indexes.extend(index + direction * step for step in range(1, distance + 1))
+    indexes.append(index - direction)
+    return [slide_index for slide_index in indexes if 0 <= slide_index < slide_count]
@@ -0,0 +1,135 @@
+"""Contain classes for keeping the start-up of the application fast.
+
+This module contains a class for importing heavy modules such as Pillow
+only when they are first used, and a class for measuring how long each
+module takes to import so that start-up can be kept within a budget.
+
+Classes:
+LazyModule -- class that imports a module the first time it is used
+ImportProfiler -- class for measuring the import time of each module
+"""
+
+
+# Standard Python libraries
+import __builtin__
+import importlib
+import sys
+import time
+
+
+# Modules that import faster than this, in seconds, are left out of reports
+REPORT_THRESHOLD = 0.0001
+
+
+class LazyModule(object):
+
+    """Stand in for a module until one of its attributes is used.
+
+    This class can be assigned to a name in place of an import statement.
+    The module is imported the first time an attribute is looked up, so
+    modules that are imported but not used on a particular run cost nothing.
+    """
+
+    def __init__(self, name):
+        """Initialise the properties.
+
+        Arguments:
+        name -- the full name of the module, such as "PIL.Image"
+        """
+
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attribute)
+
+
+class ImportProfiler(object):
+
+    """Store properties and methods relating to measuring import times.
+
+    This class replaces the built in import function while it is running,
+    and records how long each module takes to import on its own, not
+    counting the modules it imports itself.
+
+    Public methods:
+    start -- start recording imports
+    stop -- stop recording imports
+    get_report -- return the recorded import times as a string
+    """
+
+    def __init__(self):
+        self.__original_import = None
+        self.__times = {}
+        # Time spent in modules imported by the module currently importing
+        self.__child_times = [0.0]
+
+    @property
+    def times(self):
+        """Return a dictionary of import time in seconds keyed by module name"""
+
+        return dict(self.__times)
+
+    @property
+    def total_time(self):
+        return sum(self.__times.values())
+
+    def start(self):
+        """Start recording the imports of modules that haven't been imported yet"""
+
+        self.__original_import = __builtin__.__import__
+        __builtin__.__import__ = self.__import
+
+    def stop(self):
+        """Stop recording imports and put back the built in import function"""
+
+        __builtin__.__import__ = self.__original_import
+
+    def get_report(self, budget=None):
+        """Return the recorded import times, slowest first, as a string.
+
+        Modules that took less than REPORT_THRESHOLD are left out, but are
+        still counted in the total.
+
+        Arguments:
+        budget -- the most time start-up should take in seconds, or None
+        """
+
+        lines = ["%10s  %s" % ("ms", "module")]
+        for name, seconds in sorted(self.__times.items(), key=lambda item: item[1], reverse=True):
+            if seconds >= REPORT_THRESHOLD:
+                lines.append("%10.1f  %s" % (seconds * 1000, name))
+        lines.append("%10.1f  total" % (self.total_time * 1000))
+        if budget is not None:
+            lines.append("%10.1f  budget (%s)" % (budget * 1000,
+                                                  "within" if self.total_time <= budget else "EXCEEDED"))
+        return "\n".join(lines)
+
+    def __import(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        """Import a module, recording the time it takes if it is new"""
+
+        # "from package import module" can import a new submodule of a loaded package
+        new_modules = ["%s.%s" % (name, submodule) for submodule in fromlist or ()
+                       if "%s.%s" % (name, submodule) not in sys.modules]
+        if name not in sys.modules:
+            new_modules.append(name)
+        if not new_modules:
+            return self.__original_import(name, globals, locals, fromlist, level)
+
+        self.__child_times.append(0.0)
+        start = time.time()
+        try:
+            return self.__original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.time() - start
+            child_time = self.__child_times.pop()
+            # Names in fromlist that turn out not to be modules aren't recorded
+            imported_modules = [module for module in new_modules if module in sys.modules]
+            if imported_modules:
+                module_name = ", ".join(imported_modules)
+                self.__times[module_name] = self.__times.get(module_name, 0.0) + elapsed - child_time
+                self.__child_times[-1] += elapsed
+            else:
+                self.__child_times[-1] += child_time
@@ -0,0 +1,123 @@
+"""Test applying effects to every frame of an animation.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import animation
+import color
+import effect
+import painting
+
+
+# Seconds a test waits before failing rather than hanging
+TEST_TIMEOUT = 60
+FRAME_DURATIONS = [40, 120, 80, 60, 100]
+FRAME_COLORS = [(220, 30, 30), (30, 220, 30), (30, 30, 220), (220, 220, 30), (20, 20, 20)]
+REPLACEMENT_COLORS = [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)]
+
+
+def get_effect():
+    return effect.ThreeColorEffect(100, 1.2, REPLACEMENT_COLORS)
+
+
+def save_frames(frames, path):
+    # Adaptive palettes keep every colour of a GIF, where the web palette would dither them
+    if path.endswith(".gif"):
+        frames = [frame.convert("P", palette=Image.ADAPTIVE) for frame in frames]
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=FRAME_DURATIONS)
+
+
+def get_frames():
+    """Return a list of RGB images that all differ, so the GIF encoder doesn't merge any of them"""
+
+    frames = []
+    for index, frame_color in enumerate(FRAME_COLORS):
+        frame = Image.new("RGB", (24, 18), frame_color)
+        frame.paste((240, 240, 240), (index * 4, 2, index * 4 + 6, 10))
+        frames.append(frame)
+    return frames
+
+
+class AnimationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        signal.signal(signal.SIGALRM, self.__fail_on_timeout)
+        signal.alarm(TEST_TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.__directory)
+
+    def test_every_frame_is_processed(self):
+        # Multi-page TIFFs keep the exact pixels of every frame
+        source_path = os.path.join(self.__directory, "source.tif")
+        save_frames(get_frames(), source_path)
+        expected = []
+        for frame in animation.iter_frames(source_path):
+            get_effect().do_effect(frame.painting)
+            expected.append(frame.painting.img.tobytes())
+
+        for workers in (1, 2):
+            output_path = os.path.join(self.__directory, "output-%d.tif" % workers)
+            animation.apply_to_frames(get_effect(), source_path, output_path, workers)
+            self.assertEqual([frame.painting.img.tobytes() for frame in animation.iter_frames(output_path)],
+                             expected)
+
+    def test_frame_durations_are_kept(self):
+        source_path = os.path.join(self.__directory, "source.gif")
+        save_frames(get_frames(), source_path)
+        for workers in (1, 2):
+            output_path = os.path.join(self.__directory, "output-%d.gif" % workers)
+            animation.apply_to_frames(get_effect(), source_path, output_path, workers)
+            self.assertEqual([frame.duration for frame in animation.iter_frames(output_path)], FRAME_DURATIONS)
+
+    def test_palette_frames_are_converted(self):
+        source_path = os.path.join(self.__directory, "source.gif")
+        frames = [Image.new("RGB", (8, 6), frame_color) for frame_color in FRAME_COLORS]
+        save_frames(frames, source_path)
+
+        frame_iterator = animation.iter_frames(source_path)
+        first_frame = next(frame_iterator)
+        self.assertEqual(first_frame.painting.mode, "RGB")
+        self.assertEqual(first_frame.painting.img.getcolors(), [(48, FRAME_COLORS[0])])
+        self.assertEqual(len(list(frame_iterator)), len(FRAME_COLORS) - 1)
+
+    def test_parameter_sweeps_render_a_frame_for_each_value(self):
+        source_path = os.path.join(self.__directory, "source.png")
+        get_frames()[0].save(source_path)
+        tile_colors = [color.Color(255, 0, 0), color.Color(0, 0, 255)]
+        levels = [1, 2, 4, 8]
+        expected = [effect.TileEffect(tile_colors, level, 2).get_result(painting.Painting(source_path)).img.tobytes()
+                    for level in levels]
+
+        for workers in (1, 2):
+            output_path = os.path.join(self.__directory, "sweep-%d.tif" % workers)
+            animation.render_parameter_sweep(source_path, output_path, effect.TileEffect, "levels", levels,
+                                             {"colors": tile_colors, "size": 2}, workers=workers)
+            self.assertEqual([frame.painting.img.tobytes() for frame in animation.iter_frames(output_path)],
+                             expected)
+
+        output_path = os.path.join(self.__directory, "sweep.gif")
+        animation.render_parameter_sweep(source_path, output_path, effect.TileEffect, "levels", levels,
+                                         {"colors": tile_colors, "size": 2}, 70)
+        self.assertEqual([frame.duration for frame in animation.iter_frames(output_path)], [70] * len(levels))
+
+    def __fail_on_timeout(self, signal_number, frame):
+        self.fail("The frames weren't processed within %d seconds" % TEST_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+"""Test the effects against simple reference versions of what they should do.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import painting
+import point
+import reference
+
+
+# Seconds a test waits for another thread before giving up
+TEST_TIMEOUT = 60
+
+
+def get_random_painting(random_generator, size, mode="RGB"):
+    img = Image.new(mode, size)
+    img.putdata([tuple(random_generator.randrange(256) for _ in mode) for _ in range(size[0] * size[1])])
+    return painting.Painting(img)
+
+
+def get_nearest(pixel_color, palette):
+    """Return the palette colour nearest to a colour, with ties going to the earlier one"""
+
+    distances = [sum((component - palette_component) ** 2
+                     for component, palette_component in zip(pixel_color, palette_color))
+                 for palette_color in palette]
+    return palette[distances.index(min(distances))]
+
+
+class QuantizeEffectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__random = random.Random(27)
+
+    def test_pixels_become_the_nearest_palette_colour(self):
+        for palette_size in (1, 2, 7, 64, 256):
+            palette = [tuple(self.__random.randrange(256) for _ in range(3)) for _ in range(palette_size)]
+            source = get_random_painting(self.__random, (24, 16))
+            self.__check_nearest(source, palette)
+
+    def test_close_colours_and_ties_are_exact(self):
+        # Colours a step apart, and colours exactly between two palette colours
+        palette = [(100, 100, 100), (104, 100, 100), (100, 100, 102), (0, 0, 0), (255, 255, 255)]
+        colors = [(red, green, blue) for red in range(98, 107) for green in (99, 100) for blue in range(98, 105)]
+        source = painting.Painting(Image.new("RGB", (len(colors), 1)))
+        source.img.putdata(colors)
+        self.__check_nearest(source, palette)
+
+    def test_many_runs_along_one_line(self):
+        # Every blue value with the same red and green, crossing each palette colour in turn
+        palette = [(50, 60, blue) for blue in range(0, 256, 9)]
+        source = painting.Painting(Image.new("RGB", (256, 2)))
+        source.img.putdata([(50, 61, blue) for blue in range(256)] + [(51, 60, 255 - blue) for blue in range(256)])
+        self.__check_nearest(source, palette)
+
+    def test_alpha_is_kept(self):
+        palette = [(0, 0, 0), (255, 255, 255), (255, 0, 0)]
+        source = get_random_painting(self.__random, (12, 10), "RGBA")
+        result = effect.QuantizeEffect([color.Color(*palette_color) for palette_color in palette]).get_result(source)
+        self.assertEqual(result.mode, "RGBA")
+        for source_pixel, result_pixel in zip(source.img.getdata(), result.img.getdata()):
+            self.assertEqual(result_pixel, get_nearest(source_pixel[:3], palette) + source_pixel[3:])
+
+    def test_images_with_no_more_than_k_colours_are_unchanged(self):
+        colors = [(10, 20, 30), (10, 20, 31), (200, 0, 0)]
+        source = painting.Painting(Image.new("RGB", (9, 4)))
+        source.img.putdata([colors[index % len(colors)] for index in range(36)])
+        for k in (3, 16):
+            self.assertEqual(effect.QuantizeEffect(k=k).get_result(source).img.tobytes(), source.img.tobytes())
+
+        result = effect.QuantizeEffect(k=2).get_result(source)
+        self.assertEqual(len(result.img.getcolors()), 2)
+
+    def test_built_palettes_have_k_colours_at_most(self):
+        source = get_random_painting(self.__random, (32, 32))
+        for k in (1, 5, 40):
+            result = effect.QuantizeEffect(k=k).get_result(source)
+            self.assertTrue(len(result.img.getcolors()) <= k)
+
+    def __check_nearest(self, source, palette):
+        """Check that quantizing to a palette gives the nearest palette colour for every pixel"""
+
+        quantize_effect = effect.QuantizeEffect([color.Color(*palette_color) for palette_color in palette])
+        result = quantize_effect.get_result(source)
+        expected = [get_nearest(pixel_color, palette) for pixel_color in source.img.getdata()]
+        self.assertEqual(list(result.img.getdata()), expected)
+
+
+class TileEffectTest(unittest.TestCase):
+
+    def test_results_match_the_reference(self):
+        random_generator = random.Random(26)
+        for mode in ("RGB", "RGBA"):
+            source = get_random_painting(random_generator, (37, 29), mode)
+            for color_count, levels, size in ((1, 1, 1), (3, 4, 2), (5, 10, 4), (2, 7, 3)):
+                colors = [color.Color(*[random_generator.randrange(256) for _ in range(3)])
+                          for _ in range(color_count)]
+                expected = reference.TileEffect(colors, levels, size).get_result(source)
+                for backend in effect.BACKENDS:
+                    with effect.using_backend(backend):
+                        result = effect.TileEffect(colors, levels, size).get_result(source)
+                    self.assertEqual((result.mode, result.size), (expected.mode, expected.size))
+                    self.assertEqual(result.img.tobytes(), expected.img.tobytes(), (mode, levels, size, backend))
+
+
+class ThreeColorEffectTest(unittest.TestCase):
+
+    def test_results_match_the_reference(self):
+        random_generator = random.Random(42)
+        replacement_colors = [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)]
+        for mode in ("RGB", "RGBA"):
+            source = get_random_painting(random_generator, (37, 29), mode)
+            for threshold, difference in ((0, 1), (100, 1.2), (180, 2.5)):
+                expected = reference.ThreeColorEffect(threshold, difference, replacement_colors).get_result(source)
+                for backend in effect.BACKENDS:
+                    with effect.using_backend(backend):
+                        result = effect.ThreeColorEffect(threshold, difference, replacement_colors).get_result(source)
+                    self.assertEqual(result.img.tobytes(), expected.img.tobytes(), (mode, threshold, backend))
+
+
+class DotEffectTest(unittest.TestCase):
+
+    def test_results_match_the_reference(self):
+        random_generator = random.Random(42)
+        background = color.Color(10, 20, 30)
+        for mode in ("RGB", "RGBA"):
+            source = get_random_painting(random_generator, (37, 29), mode)
+            for radius, gap in ((1, 0), (3, 1), (5, 4)):
+                expected = reference.DotEffect(radius, gap, background).get_result(source)
+                for backend in effect.BACKENDS:
+                    with effect.using_backend(backend):
+                        result = effect.DotEffect(radius, gap, background).get_result(source)
+                    self.assertEqual((result.mode, result.size), (expected.mode, expected.size))
+                    self.assertEqual(result.img.tobytes(), expected.img.tobytes(), (mode, radius, gap, backend))
+
+    def test_threads_can_share_an_effect_for_different_sizes(self):
+        dot_effect = effect.DotEffect(3, 1, color.Color(0, 0, 0))
+        random_generator = random.Random(30)
+        sources = [get_random_painting(random_generator, size) for size in ((40, 30), (31, 45))]
+        expected = [effect.DotEffect(3, 1, color.Color(0, 0, 0)).get_result(source).img.tobytes()
+                    for source in sources]
+        building = threading.Event()
+        other_finished = threading.Event()
+        results = []
+
+        def pausing_point(x, y):
+            # The first thread stops part way through its centres until the other thread has finished
+            if threading.current_thread() is first_thread and not building.is_set():
+                building.set()
+                other_finished.wait(TEST_TIMEOUT)
+            return new_point(x, y)
+
+        def apply_effect():
+            results.append(dot_effect.get_result(sources[0]).img.tobytes())
+
+        new_point = point.Point
+        point.Point = pausing_point
+        try:
+            first_thread = threading.Thread(target=apply_effect)
+            first_thread.start()
+            building.wait(TEST_TIMEOUT)
+            other_result = dot_effect.get_result(sources[1])
+            other_finished.set()
+            first_thread.join()
+        finally:
+            point.Point = new_point
+
+        self.assertEqual(other_result.img.tobytes(), expected[1])
+        self.assertEqual(results, [expected[0]])
+
+
+class RefinementTest(unittest.TestCase):
+
+    def test_refinements_end_on_the_result(self):
+        random_generator = random.Random(45)
+        background = color.Color(0, 0, 0)
+        tile_colors = [color.Color(255, 0, 0), color.Color(0, 0, 255)]
+        # Overlapping and separate circles, and tiles large and too small to shrink
+        refined_effects = [effect.DotEffect(4, 2, background), effect.DotEffect(4, 0, background),
+                           effect.TileEffect(tile_colors, 4, 2), effect.TileEffect(tile_colors, 4, 30)]
+        for mode in ("RGB", "RGBA"):
+            source = get_random_painting(random_generator, (60, 45), mode)
+            source_bytes = source.img.tobytes()
+            for refined_effect in refined_effects:
+                for backend in effect.BACKENDS:
+                    with effect.using_backend(backend):
+                        expected = refined_effect.get_result(source)
+                        refinements = [refinement.copy() for refinement in refined_effect.iter_refinements(source)]
+                    self.assertTrue(refinements)
+                    self.assertEqual((refinements[-1].mode, refinements[-1].size), (expected.mode, expected.size))
+                    self.assertEqual(refinements[-1].img.tobytes(), expected.img.tobytes(), (mode, backend))
+                    self.assertEqual(source.img.tobytes(), source_bytes)
+
+    def test_dots_are_refined_in_several_passes(self):
+        source = get_random_painting(random.Random(45), (60, 45))
+        dot_effect = effect.DotEffect(2, 1, color.Color(0, 0, 0))
+        refinements = [refinement.copy() for refinement in dot_effect.iter_refinements(source)]
+        self.assertEqual(len(refinements), len(effect.REFINEMENT_STRIDES))
+        self.assertEqual(len(set(refinement.img.tobytes() for refinement in refinements)), len(refinements))
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def test_batches_match_applying_each_painting(self):
+        replacement_colors = [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)]
+        palette = [color.Color(0, 0, 0), color.Color(255, 255, 255), color.Color(255, 0, 0)]
+        # Only some of the effects can be applied to "P" images
+        batch_effects = [(effect.ThreeColorEffect(100, 1.2, replacement_colors), False),
+                         (effect.QuantizeEffect(palette), True), (effect.DotEffect(2, 1, color.Color(0, 0, 0)), False),
+                         (effect.TileEffect([color.Color(255, 0, 0), color.Color(0, 0, 255)], 4, 2), True)]
+        batch_stack_pixels = effect.BATCH_STACK_PIXELS
+        # Small enough that the paintings of the same width are split into several stacks
+        effect.BATCH_STACK_PIXELS = 24 * 40
+        try:
+            for batch_effect, with_palettes in batch_effects:
+                paintings = self.__get_paintings(with_palettes)
+                expected = [batch_painting.copy() for batch_painting in paintings]
+                for expected_painting in expected:
+                    batch_effect.do_effect(expected_painting)
+                batch_effect.apply_batch(paintings)
+                for batch_painting, expected_painting in zip(paintings, expected):
+                    self.assertEqual((batch_painting.mode, batch_painting.size, batch_painting.source_size),
+                                     (expected_painting.mode, expected_painting.size, expected_painting.source_size))
+                    self.assertEqual(batch_painting.img.tobytes(), expected_painting.img.tobytes(), batch_effect)
+        finally:
+            effect.BATCH_STACK_PIXELS = batch_stack_pixels
+
+    def __get_paintings(self, with_palettes):
+        """Return paintings of mixed modes and sizes, with several of each mode and width to stack"""
+
+        random_generator = random.Random(46)
+        paintings = [get_random_painting(random_generator, size, mode)
+                     for mode in ("RGB", "RGBA") for size in ((24, 16), (24, 9), (31, 20), (24, 30))]
+        for palette_size in (4, 9) if with_palettes else ():
+            palette_painting = get_random_painting(random_generator, (24, 16))
+            palette_painting.img = palette_painting.img.convert("P", palette=Image.ADAPTIVE, colors=palette_size)
+            paintings.append(palette_painting)
+
+        jpeg_path = os.path.join(self.__directory, "source.jpg")
+        get_random_painting(random_generator, (192, 64)).img.save(jpeg_path)
+        reduced = painting.Painting(jpeg_path, lambda size: (24, 8))
+        self.assertTrue(reduced.is_reduced)
+        paintings.append(reduced)
+        return paintings
+
+
+if __name__ == '__main__':
+    unittest.main()
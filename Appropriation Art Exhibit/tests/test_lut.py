@@ -0,0 +1,160 @@
+"""Test compiling pointwise effects into colour lookup tables.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import lut
+import painting
+
+
+# Threads applying effects through the same tables at once
+THREAD_COUNT = 4
+REPLACEMENT_COLORS = [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)]
+
+
+def get_effects():
+    palette = [color.Color(0, 0, 0), color.Color(255, 255, 255), color.Color(90, 140, 30), color.Color(20, 20, 230)]
+    return [effect.ThreeColorEffect(100, 1.2, REPLACEMENT_COLORS), effect.QuantizeEffect(palette)]
+
+
+def get_random_painting(random_generator, size, mode="RGB", levels=256):
+    img = Image.new(mode, size)
+    img.putdata([tuple(random_generator.randrange(levels) * 255 // (levels - 1) for _ in mode)
+                 for _ in range(size[0] * size[1])])
+    return painting.Painting(img)
+
+
+def get_expected(effect_to_apply, source):
+    expected = source.copy()
+    effect_to_apply.do_effect(expected)
+    return expected
+
+
+class ColorLUTTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__random = random.Random(28)
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+        lut._luts.clear()
+
+    def test_results_match_the_effect(self):
+        for mode in ("RGB", "RGBA"):
+            # Many colours, and few enough colours to be remapped through a palette
+            for levels in (256, 4):
+                source = get_random_painting(self.__random, (40, 30), mode, levels)
+                for effect_to_apply in get_effects():
+                    result = source.copy()
+                    lut.ColorLUT(effect_to_apply, mode, self.__directory).apply(result)
+                    self.assertEqual(result.img.tobytes(), get_expected(effect_to_apply, source).img.tobytes(),
+                                     (mode, levels, effect_to_apply.__class__.__name__))
+
+    def test_saved_tables_are_used_again(self):
+        source = get_random_painting(self.__random, (32, 24))
+        three_color_effect = effect.ThreeColorEffect(100, 1.2, REPLACEMENT_COLORS)
+        color_lut = lut.ColorLUT(three_color_effect, "RGB", self.__directory)
+        color_lut.apply(source.copy())
+        color_lut.save()
+        self.assertTrue(os.path.exists(color_lut.path))
+
+        loaded_lut = lut.ColorLUT(three_color_effect, "RGB", self.__directory)
+        self.assertEqual(loaded_lut.size, source.get_unique_color_count())
+        result = source.copy()
+        loaded_lut.apply(result)
+        self.assertEqual(loaded_lut.size, source.get_unique_color_count())
+        self.assertEqual(result.img.tobytes(), get_expected(three_color_effect, source).img.tobytes())
+
+    def test_tables_are_limited_in_size(self):
+        max_table_colors = lut.MAX_TABLE_COLORS
+        lut.MAX_TABLE_COLORS = 1000
+        try:
+            color_lut = lut.ColorLUT(get_effects()[0], "RGB", self.__directory)
+            for _ in range(3):
+                source = get_random_painting(self.__random, (30, 20))
+                result = source.copy()
+                color_lut.apply(result)
+                self.assertTrue(color_lut.size <= lut.MAX_TABLE_COLORS)
+                self.assertEqual(result.img.tobytes(), get_expected(color_lut.effect, source).img.tobytes())
+        finally:
+            lut.MAX_TABLE_COLORS = max_table_colors
+
+    def test_other_modes_are_left_to_the_effect(self):
+        self.assertRaises(ValueError, lut.ColorLUT, get_effects()[0], "CMYK", self.__directory)
+        self.assertRaises(ValueError, lut.ColorLUT, effect.DotEffect(5, 1, color.BLACK), "RGB", self.__directory)
+
+    def test_palette_images_only_have_their_palette_changed(self):
+        source = painting.Painting(get_random_painting(self.__random, (40, 30)).img.quantize(12))
+        for effect_to_apply in get_effects():
+            result = source.copy()
+            self.assertTrue(lut.apply_effect(effect_to_apply, result, self.__directory))
+            self.assertEqual(result.mode, "P")
+            self.assertEqual(result.img.tobytes(), source.img.tobytes())
+            expected = get_expected(effect_to_apply, painting.Painting(source.img.convert("RGB")))
+            self.assertEqual(result.img.convert("RGB").tobytes(), expected.img.tobytes())
+
+    def test_paintings_with_too_many_colours_are_left_to_the_effect(self):
+        source = get_random_painting(self.__random, (20, 10))
+        three_color_effect = get_effects()[0]
+        expected = get_expected(three_color_effect, source).img.tobytes()
+
+        result = source.copy()
+        self.assertFalse(lut.apply_effect(three_color_effect, result, self.__directory, 10))
+        self.assertEqual(result.img.tobytes(), expected)
+        self.assertEqual(os.listdir(self.__directory), [])
+
+        result = source.copy()
+        self.assertTrue(lut.apply_effect(three_color_effect, result, self.__directory, 200))
+        self.assertEqual(result.img.tobytes(), expected)
+        self.assertEqual(os.listdir(self.__directory), [lut.get_table_name(three_color_effect, "RGB")])
+
+    def test_threads_can_share_tables(self):
+        sources = [get_random_painting(self.__random, (24, 16)) for _ in range(THREAD_COUNT * 3)]
+        three_color_effect = get_effects()[0]
+        results = {}
+        errors = []
+
+        def apply_effects(thread_index):
+            try:
+                for source_index in range(thread_index, len(sources), THREAD_COUNT):
+                    result = sources[source_index].copy()
+                    lut.apply_effect(three_color_effect, result, self.__directory)
+                    results[source_index] = result.img.tobytes()
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=apply_effects, args=(thread_index,))
+                   for thread_index in range(THREAD_COUNT)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for source_index, source in enumerate(sources):
+            self.assertEqual(results[source_index], get_expected(three_color_effect, source).img.tobytes())
+        self.assertTrue(lut.get_lut(three_color_effect, "RGB", self.__directory)
+                        is lut.get_lut(three_color_effect, "RGB", self.__directory))
+        color_lut = lut.ColorLUT(three_color_effect, "RGB", self.__directory)
+        self.assertEqual(color_lut.size, len(set(pixel_color for source in sources
+                                                 for count, pixel_color in source.get_colors())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Test running gallery manifests.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import manifest
+
+
+THREE_COLOR_PARAMETERS = {"threshold": 100, "difference": 20,
+                          "replacement_colors": [[200, 0, 0], [0, 200, 0], [0, 0, 200]]}
+TILE_PARAMETERS = {"colors": [[150, 0, 150]], "levels": 4, "size": 2}
+# Without replacement colours, the source's red pixels raise IndexError once the stage runs
+FAILING_PARAMETERS = dict(THREE_COLOR_PARAMETERS, replacement_colors=[])
+
+
+class GalleryRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.__directory, "src"))
+        Image.new("RGB", (32, 24), (180, 40, 40)).save(os.path.join(self.__directory, "src", "source.png"))
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def test_finished_stages_are_recorded_when_another_fails(self):
+        ran = []
+        gallery = self.__write_gallery(FAILING_PARAMETERS)
+        self.assertRaises(IndexError, gallery.run, 2, False, lambda stage, seconds: ran.append(stage["name"]))
+        self.assertEqual(ran, ["tiles"])
+
+        del ran[:]
+        gallery = self.__write_gallery(THREE_COLOR_PARAMETERS)
+        gallery.run(2, False, lambda stage, seconds: ran.append(stage["name"]))
+        self.assertEqual(ran, ["colors"])
+
+    def test_up_to_date_stages_are_skipped(self):
+        gallery = self.__write_gallery(THREE_COLOR_PARAMETERS)
+        self.assertEqual(sorted(gallery.run(2)), ["colors", "tiles"])
+        self.assertEqual(gallery.run(2), {})
+
+    def __write_gallery(self, three_color_parameters):
+        """Write a manifest with a ThreeColorEffect stage and a TileEffect stage, and return its Gallery"""
+
+        gallery_manifest = {"source_dir": "src",
+                            "output_dir": "out",
+                            "sources": {"source": "source.png"},
+                            "stages": [{"name": "colors", "input": "source", "effect": "ThreeColorEffect",
+                                        "parameters": three_color_parameters, "output": "colors.png"},
+                                       {"name": "tiles", "input": "source", "effect": "TileEffect",
+                                        "parameters": TILE_PARAMETERS, "output": "tiles.png"}]}
+        manifest_path = os.path.join(self.__directory, "gallery.json")
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(gallery_manifest, manifest_file)
+        return manifest.Gallery(manifest_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
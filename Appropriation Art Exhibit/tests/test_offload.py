@@ -0,0 +1,186 @@
+"""Test applying effects and saving paintings in the background.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import offload
+import painting
+import progress
+
+
+# Seconds a test waits before failing rather than hanging
+TEST_TIMEOUT = 60
+# Rows of work SlowEffect does, each taking STEP_SECONDS
+SLOW_STEPS = 50
+STEP_SECONDS = 0.02
+REPLACEMENT_COLORS = [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)]
+
+
+def get_effect(replacement_colors=REPLACEMENT_COLORS):
+    return effect.ThreeColorEffect(100, 20, replacement_colors)
+
+
+def get_painting():
+    return painting.Painting(Image.frombytes("RGB", (64, 48), os.urandom(64 * 48 * 3)))
+
+
+class SlowEffect(effect.Effect):
+
+    """Effect that checks for cancellation between slow steps and records how many run at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most_running = 0
+
+    def get_result(self, painting, progress_callback=None, cancel_token=None):
+        with self.lock:
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            tracker = progress.Tracker(progress_callback, cancel_token, SLOW_STEPS)
+            for _ in range(SLOW_STEPS):
+                time.sleep(STEP_SECONDS)
+                tracker.advance()
+        finally:
+            with self.lock:
+                self.running -= 1
+        return painting.copy()
+
+
+class OffloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        signal.signal(signal.SIGALRM, self.__fail_on_timeout)
+        signal.alarm(TEST_TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.__directory)
+
+    def test_results_match_get_result(self):
+        for kind in offload.EXECUTOR_KINDS:
+            source = get_painting()
+            source_data = source.img.tobytes()
+            expected = get_effect().get_result(source)
+            with offload.Executor(2, kind) as executor:
+                futures = [get_effect().apply_async(source, executor) for _ in range(3)]
+                for future in futures:
+                    self.assertEqual(future.result().img.tobytes(), expected.img.tobytes(), kind)
+                    self.assertTrue(future.done() and not future.cancelled())
+            self.assertEqual(source.img.tobytes(), source_data)
+
+    def test_backend_of_caller_is_used(self):
+        source = get_painting()
+        with offload.Executor(1) as executor:
+            with effect.using_backend(effect.PYTHON_BACKEND):
+                future = get_effect().apply_async(source, executor)
+            self.assertEqual(future.result().img.tobytes(), get_effect().get_result(source).img.tobytes())
+
+    def test_saves_write_the_image(self):
+        for kind in offload.EXECUTOR_KINDS:
+            source = get_painting()
+            path = os.path.join(self.__directory, "%s.png" % kind)
+            with offload.Executor(1, kind) as executor:
+                self.assertEqual(source.save_async(path, executor).result(), None)
+            self.assertEqual(Image.open(path).tobytes(), source.img.tobytes())
+
+    def test_exceptions_are_passed_on(self):
+        for kind in offload.EXECUTOR_KINDS:
+            with offload.Executor(1, kind) as executor:
+                # Without replacement colours, the red pixels raise IndexError
+                red_painting = painting.Painting(Image.new("RGB", (8, 6), (180, 40, 40)))
+                future = get_effect([]).apply_async(red_painting, executor)
+                self.assertTrue(isinstance(future.exception(), IndexError), kind)
+                self.assertRaises(IndexError, future.result)
+                self.assertTrue(future.done() and not future.cancelled())
+
+                save_future = get_painting().save_async(os.path.join(self.__directory, "missing", "x.png"), executor)
+                self.assertTrue(isinstance(save_future.exception(), IOError), kind)
+                self.assertRaises(IOError, save_future.result)
+
+    def test_default_executor_is_used_without_one(self):
+        previous_executor = offload.get_default_executor()
+        with offload.Executor(1) as executor:
+            offload.set_default_executor(executor)
+            try:
+                self.assertTrue(offload.get_default_executor() is executor)
+                source = get_painting()
+                path = os.path.join(self.__directory, "default.png")
+                self.assertEqual(get_effect().apply_async(source).result().img.tobytes(),
+                                 get_effect().get_result(source).img.tobytes())
+                source.save_async(path).result()
+                self.assertEqual(Image.open(path).tobytes(), source.img.tobytes())
+            finally:
+                offload.set_default_executor(previous_executor)
+
+    def test_concurrency_is_limited(self):
+        slow_effect = SlowEffect()
+        with offload.Executor(2) as executor:
+            futures = [executor.apply_async(slow_effect, get_painting()) for _ in range(5)]
+            for future in futures:
+                future.result()
+        self.assertEqual(slow_effect.most_running, 2)
+
+    def test_cancelling_before_start_skips_the_work(self):
+        slow_effect = SlowEffect()
+        called = []
+        with offload.Executor(1) as executor:
+            running_future = executor.apply_async(slow_effect, get_painting())
+            waiting_future = executor.apply_async(slow_effect, get_painting())
+            waiting_future.add_done_callback(lambda future: called.append(future.cancelled()))
+            self.assertTrue(waiting_future.cancel())
+            self.assertEqual(called, [True])
+            running_future.result()
+        self.assertRaises(progress.Cancelled, waiting_future.result)
+        self.assertFalse(running_future.cancel())
+
+    def test_cancelling_stops_running_effects(self):
+        source = get_painting()
+        source_data = source.img.tobytes()
+        with offload.Executor(1) as executor:
+            future = executor.apply_async(SlowEffect(), source)
+            while not future.running():
+                time.sleep(STEP_SECONDS)
+            start = time.time()
+            self.assertTrue(future.cancel())
+            self.assertRaises(progress.Cancelled, future.exception)
+        # Closing waits for the work, so it stopped at its next progress check
+        self.assertTrue(time.time() - start < SLOW_STEPS * STEP_SECONDS / 2)
+        self.assertEqual(source.img.tobytes(), source_data)
+
+    def test_waiting_can_time_out(self):
+        self.assertRaises(multiprocessing.TimeoutError, offload.Future().result, 0.01)
+
+    def test_reduced_paintings_are_rejected_by_process_executors(self):
+        path = os.path.join(self.__directory, "large.jpg")
+        Image.new("RGB", (256, 256)).save(path)
+        reduced = painting.Painting(path, lambda size: (32, 32))
+        self.assertTrue(reduced.is_reduced)
+        with offload.Executor(1, offload.PROCESS_EXECUTOR) as executor:
+            self.assertRaises(ValueError, executor.apply_async, get_effect(), reduced)
+
+    def __fail_on_timeout(self, signal_number, frame):
+        self.fail("The work didn't finish within %d seconds" % TEST_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+"""Test the Painting class's dirty regions, the data it derives from its image and reduced decoding.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import painting
+import point
+
+
+def get_painting(size=(64, 48)):
+    new_painting = painting.Painting(Image.new("RGB", size))
+    new_painting.pop_dirty_regions()
+    return new_painting
+
+
+def touches(first, second):
+    return first[0] <= second[2] and second[0] <= first[2] and first[1] <= second[3] and second[1] <= first[3]
+
+
+def covers(regions, box):
+    return any(region[0] <= box[0] and region[1] <= box[1] and box[2] <= region[2] and box[3] <= region[3]
+               for region in regions)
+
+
+class DirtyRegionsTest(unittest.TestCase):
+
+    def test_new_image_is_dirty_everywhere(self):
+        new_painting = painting.Painting(Image.new("RGB", (64, 48)))
+        self.assertEqual(new_painting.pop_dirty_regions(), [(0, 0, 64, 48)])
+        self.assertEqual(new_painting.pop_dirty_regions(), [])
+
+    def test_neighbouring_pixels_merge(self):
+        dirty_painting = get_painting()
+        for x in range(10, 20):
+            dirty_painting.set_pixel_color(point.Point(x, 5), color.Color(255, 0, 0))
+        self.assertEqual(dirty_painting.dirty_regions, [(10, 5, 20, 6)])
+
+    def test_pixels_grow_one_box_until_the_regions_are_used(self):
+        dirty_painting = get_painting()
+        dirty_painting.mark_dirty((40, 30, 50, 40))
+        dirty_painting.set_pixel_color(point.Point(3, 4), color.Color(255, 0, 0))
+        dirty_painting.set_pixel_color(point.Point(10, 2), color.Color(255, 0, 0))
+        self.assertEqual(sorted(dirty_painting.pop_dirty_regions()), [(3, 2, 11, 5), (40, 30, 50, 40)])
+        self.assertEqual(dirty_painting.pop_dirty_regions(), [])
+
+        dirty_painting.set_pixel_color(point.Point(60, 0), color.Color(255, 0, 0))
+        self.assertEqual(dirty_painting.dirty_regions, [(60, 0, 61, 1)])
+        self.assertEqual(dirty_painting.pop_dirty_regions(), [(60, 0, 61, 1)])
+
+    def test_regions_are_clipped_to_the_image(self):
+        dirty_painting = get_painting()
+        dirty_painting.mark_dirty((-5, 40, 10, 100))
+        dirty_painting.mark_dirty((70, 0, 80, 10))
+        self.assertEqual(dirty_painting.dirty_regions, [(0, 40, 10, 48)])
+
+    def test_more_than_the_maximum_regions_collapse(self):
+        dirty_painting = get_painting()
+        boxes = [(x, y, x + 1, y + 1) for x in range(0, 64, 8) for y in range(0, 24, 8)]
+        for box in boxes:
+            dirty_painting.mark_dirty(box)
+
+        regions = dirty_painting.dirty_regions
+        self.assertEqual(len(regions), painting.MAX_DIRTY_REGIONS)
+        self.assertTrue(all(covers(regions, box) for box in boxes))
+
+    def test_collapsed_regions_never_overlap_or_touch(self):
+        random_generator = random.Random(1)
+        dirty_painting = get_painting()
+        boxes = []
+        for _ in range(200):
+            left = random_generator.randrange(64)
+            top = random_generator.randrange(48)
+            box = (left, top, left + random_generator.randint(1, 6), top + random_generator.randint(1, 6))
+            dirty_painting.mark_dirty(box)
+            boxes.append((box[0], box[1], min(box[2], 64), min(box[3], 48)))
+
+            regions = dirty_painting.dirty_regions
+            self.assertTrue(len(regions) <= painting.MAX_DIRTY_REGIONS)
+            self.assertTrue(all(covers(regions, marked_box) for marked_box in boxes))
+            for index, region in enumerate(regions):
+                for other_region in regions[index + 1:]:
+                    self.assertFalse(touches(region, other_region), (region, other_region))
+
+
+class DerivedDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__painting = get_painting((8, 6))
+        self.__computed = []
+
+    def test_data_is_computed_once(self):
+        self.assertEqual(self.__get_count(), 1)
+        self.assertEqual(self.__get_count(), 1)
+        self.assertEqual(len(self.__computed), 1)
+
+    def test_setting_img_invalidates(self):
+        self.__get_count()
+        self.__painting.img = Image.new("RGB", (8, 6), (1, 2, 3))
+        self.__get_count()
+        self.assertEqual(len(self.__computed), 2)
+        self.assertEqual(self.__painting.get_colors(), [(48, (1, 2, 3))])
+
+    def test_changing_pixels_invalidates(self):
+        self.assertEqual(self.__painting.get_unique_color_count(), 1)
+        self.__painting.set_pixel_color(point.Point(1, 1), color.Color(255, 0, 0))
+        self.assertEqual(self.__painting.get_unique_color_count(), 2)
+
+        self.__painting.paste(painting.Painting(Image.new("RGB", (2, 2), (0, 0, 255))), point.Point(4, 4))
+        self.assertEqual(self.__painting.get_unique_color_count(), 3)
+
+        self.__painting.clear_image(color.Color(0, 255, 0))
+        self.assertEqual(self.__painting.get_colors(), [(48, (0, 255, 0))])
+
+    def test_mark_dirty_invalidates_direct_changes(self):
+        self.__get_count()
+        self.__painting.img.paste((255, 255, 255), (0, 0, 2, 2))
+        self.__get_count()
+        self.assertEqual(len(self.__computed), 1)
+
+        self.__painting.mark_dirty((0, 0, 2, 2))
+        self.__get_count()
+        self.assertEqual(len(self.__computed), 2)
+
+    def test_marking_outside_the_image_keeps_data(self):
+        self.__get_count()
+        self.__painting.mark_dirty((10, 10, 12, 12))
+        self.__get_count()
+        self.assertEqual(len(self.__computed), 1)
+
+    def test_crops_and_copies_work_out_their_own_data(self):
+        self.__painting.set_pixel_color(point.Point(0, 0), color.Color(255, 0, 0))
+        self.assertEqual(self.__painting.get_unique_color_count(), 2)
+        colors = self.__painting.get_colors()
+
+        cropped = self.__painting.crop((2, 2, 4, 4))
+        self.assertEqual(cropped.get_colors(), [(4, (0, 0, 0))])
+        painting_copy = self.__painting.copy()
+        painting_copy.set_pixel_color(point.Point(5, 5), color.Color(0, 0, 255))
+        self.assertEqual(painting_copy.get_unique_color_count(), 3)
+        self.assertTrue(self.__painting.get_colors() is colors)
+
+    def __get_count(self):
+        def compute():
+            self.__computed.append(1)
+            return len(self.__computed)
+
+        return self.__painting.get_derived("count", compute)
+
+
+class ReducedDecodingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__jpeg_path = os.path.join(self.__directory, "source.jpg")
+        Image.frombytes("RGB", (256, 192), os.urandom(256 * 192 * 3)).save(self.__jpeg_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def test_jpegs_are_decoded_at_the_smallest_scale_needed(self):
+        reduced = painting.Painting(self.__jpeg_path, lambda size: (40, 30))
+        self.assertTrue(reduced.is_reduced)
+        # JPEGs can be reduced to 1/2, 1/4 or 1/8 of their size, so this is the smallest at least 40x30
+        self.assertEqual((reduced.size, reduced.source_size), ((64, 48), (256, 192)))
+        self.assertEqual(reduced.copy().source_size, (256, 192))
+
+        full = painting.Painting(self.__jpeg_path, lambda size: size)
+        self.assertFalse(full.is_reduced)
+        self.assertEqual(full.img.tobytes(), painting.Painting(self.__jpeg_path).img.tobytes())
+
+    def test_other_files_are_decoded_in_full(self):
+        png_path = os.path.join(self.__directory, "source.png")
+        Image.new("RGB", (256, 192)).save(png_path)
+        png_painting = painting.Painting(png_path, lambda size: (40, 30))
+        self.assertFalse(png_painting.is_reduced)
+        self.assertEqual(png_painting.size, (256, 192))
+
+    def test_effects_give_full_size_results_from_reduced_paintings(self):
+        for reduced_effect in (effect.DotEffect(6, 2, color.Color(0, 0, 0)),
+                               effect.TileEffect([color.Color(255, 0, 0), color.Color(0, 0, 255)], 4, 2)):
+            reduced = painting.Painting(self.__jpeg_path, reduced_effect.get_required_size)
+            self.assertTrue(reduced.is_reduced)
+            required_size = reduced_effect.get_required_size((256, 192))
+            self.assertTrue(reduced.width >= required_size[0] and reduced.height >= required_size[1])
+            result = reduced_effect.get_result(reduced)
+            self.assertEqual(result.size, reduced_effect.get_output_size((256, 192)))
+            self.assertFalse(result.is_reduced)
+
+
+if __name__ == '__main__':
+    unittest.main()
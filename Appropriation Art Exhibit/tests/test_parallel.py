@@ -0,0 +1,134 @@
+"""Test applying effects in strips across worker processes.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import os
+import signal
+import tempfile
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import painting
+import parallel
+import transport
+
+
+# Seconds a test waits before failing rather than hanging
+TEST_TIMEOUT = 30
+# Odd and even heights, so strips line up with the circles, squares and tiles in different ways
+STRIP_HEIGHTS = (1, 5, 7, 16, 100)
+
+
+class CrashingEffect(effect.ThreeColorEffect):
+
+    """ThreeColorEffect whose strips make the worker process exit"""
+
+    def apply_strip(self, painting, top, bottom):
+        os._exit(1)
+
+
+class WholeImageEffect(effect.ThreeColorEffect):
+
+    """ThreeColorEffect that isn't pointwise and so can't be split into strips"""
+
+    pointwise = False
+
+    def __init__(self, *arguments):
+        effect.ThreeColorEffect.__init__(self, *arguments)
+        self.applied = 0
+
+    def do_effect(self, painting, progress_callback=None, cancel_token=None):
+        self.applied += 1
+        effect.ThreeColorEffect.do_effect(self, painting, progress_callback, cancel_token)
+
+
+def get_effect(effect_class=effect.ThreeColorEffect):
+    return effect_class(100, 20, [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)])
+
+
+def get_painting():
+    img = Image.frombytes("RGB", (64, 48), os.urandom(64 * 48 * 3))
+    return painting.Painting(img)
+
+
+def get_own_segments():
+    prefix = "%s-%d-" % (transport.SEGMENT_PREFIX, os.getpid())
+    return [name for name in os.listdir(transport.SEGMENT_DIR) if name.startswith(prefix)]
+
+
+class ApplyInStripsTest(unittest.TestCase):
+
+    def setUp(self):
+        signal.signal(signal.SIGALRM, self.__fail_on_timeout)
+        signal.alarm(TEST_TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+
+    def test_workers_match_do_effect(self):
+        source = get_painting()
+        expected = source.copy()
+        get_effect().do_effect(expected)
+
+        parallel.apply_in_strips(get_effect(), source, 10, 2)
+        self.assertEqual(source.img.tobytes(), expected.img.tobytes())
+        self.assertEqual(get_own_segments(), [])
+
+    def test_strips_match_do_effect_for_every_height(self):
+        effects = [effect.DotEffect(3, 1, color.Color(10, 20, 30)),
+                   effect.DotEffect(4, -3, color.Color(10, 20, 30)),
+                   effect.TileEffect([color.Color(150, 0, 150), color.Color(0, 90, 0)], 4, 3),
+                   effect.ShuffleEffect(4, 3, 2016)]
+        for backend in effect.BACKENDS:
+            with effect.using_backend(backend):
+                for strip_effect in effects:
+                    source = get_painting()
+                    expected = strip_effect.get_result(source)
+                    for strip_height in STRIP_HEIGHTS:
+                        result = source.copy()
+                        parallel.apply_in_strips(strip_effect, result, strip_height)
+                        self.assertEqual(result.img.tobytes(), expected.img.tobytes(),
+                                         (backend, strip_effect.__class__.__name__, strip_height))
+
+    def test_strips_of_reduced_paintings_match_do_effect(self):
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as source_file:
+            Image.frombytes("RGB", (256, 192), os.urandom(256 * 192 * 3)).save(source_file.name)
+            for strip_effect in (effect.DotEffect(3, 1, color.Color(10, 20, 30)),
+                                 effect.TileEffect([color.Color(150, 0, 150)], 4, 3)):
+                reduced = painting.Painting(source_file.name, strip_effect.get_required_size)
+                self.assertTrue(reduced.is_reduced)
+                expected = strip_effect.get_result(reduced)
+                parallel.apply_in_strips(strip_effect, reduced, 7)
+                self.assertEqual(reduced.img.tobytes(), expected.img.tobytes())
+
+    def test_effects_that_cant_be_split_are_applied_once(self):
+        whole_image_effect = get_effect(WholeImageEffect)
+        self.assertFalse(whole_image_effect.splits_into_strips)
+        self.assertTrue(get_effect().splits_into_strips)
+        self.assertTrue(effect.DotEffect(3, 1, color.Color(0, 0, 0)).splits_into_strips)
+
+        source = get_painting()
+        expected = get_effect().get_result(source)
+        parallel.apply_in_strips(whole_image_effect, source, 5, 2)
+        self.assertEqual(whole_image_effect.applied, 1)
+        self.assertEqual(source.img.tobytes(), expected.img.tobytes())
+
+    def test_crashed_worker_raises_and_unlinks_segments(self):
+        self.assertRaises(parallel.WorkerDied, parallel.apply_in_strips,
+                          get_effect(CrashingEffect), get_painting(), 10, 2)
+        self.assertEqual(get_own_segments(), [])
+
+    def __fail_on_timeout(self, signal_number, frame):
+        self.fail("Applying the effect didn't finish within %d seconds" % TEST_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
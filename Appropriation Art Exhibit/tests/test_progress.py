@@ -0,0 +1,101 @@
+"""Test reporting the progress of effects and cancelling them.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import os
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import painting
+import progress
+
+
+def get_effects():
+    return [effect.DotEffect(2, 1, color.Color(0, 0, 0)),
+            effect.ShuffleEffect(4, 3, 44),
+            effect.ThreeColorEffect(100, 1.2, [color.Color(200, 0, 0), color.Color(0, 200, 0),
+                                               color.Color(0, 0, 200)]),
+            effect.TileEffect([color.Color(255, 0, 0), color.Color(0, 0, 255)], 4, 2),
+            effect.QuantizeEffect([color.Color(0, 0, 0), color.Color(255, 255, 255)])]
+
+
+def get_painting():
+    return painting.Painting(Image.frombytes("RGB", (60, 40), os.urandom(60 * 40 * 3)))
+
+
+class TrackerTest(unittest.TestCase):
+
+    def test_reports_are_limited_and_end_at_the_total(self):
+        reports = []
+        tracker = progress.Tracker(lambda done, total: reports.append((done, total)), total=1000)
+        for _ in range(1000):
+            tracker.advance()
+        tracker.finish()
+        self.assertTrue(len(reports) <= progress.REPORT_STEPS + 1)
+        self.assertEqual(reports[-1], (1000, 1000))
+        self.assertEqual(reports, sorted(set(reports)))
+
+    def test_cancelled_tokens_stop_the_next_advance(self):
+        cancel_token = progress.CancellationToken()
+        tracker = progress.Tracker(total=10, cancel_token=cancel_token)
+        tracker.advance()
+        cancel_token.cancel()
+        self.assertRaises(progress.Cancelled, tracker.advance)
+        self.assertRaises(progress.Cancelled, tracker.finish)
+        self.assertEqual(tracker.done, 1)
+        self.assertRaises(progress.Cancelled, progress.Tracker, cancel_token=cancel_token)
+
+
+class EffectProgressTest(unittest.TestCase):
+
+    def test_progress_increases_to_the_total(self):
+        for backend in effect.BACKENDS:
+            for progress_effect in get_effects():
+                reports = []
+                with effect.using_backend(backend):
+                    progress_effect.get_result(get_painting(), lambda done, total: reports.append((done, total)))
+                self.assertTrue(reports, (progress_effect, backend))
+                total = reports[-1][1]
+                self.assertEqual(reports[-1], (total, total))
+                self.assertEqual([done for done, _ in reports], sorted(set(done for done, _ in reports)))
+                self.assertEqual(set(report_total for _, report_total in reports), set([total]))
+
+    def test_cancelling_stops_at_the_next_check(self):
+        for backend in effect.BACKENDS:
+            for progress_effect in get_effects():
+                source = get_painting()
+                source_bytes = source.img.tobytes()
+                cancel_token = progress.CancellationToken()
+                reports = []
+
+                def cancel_on_first_report(done, total):
+                    reports.append(done)
+                    cancel_token.cancel()
+
+                with effect.using_backend(backend):
+                    self.assertRaises(progress.Cancelled, progress_effect.do_effect, source,
+                                      cancel_on_first_report, cancel_token)
+                # Nothing is reported after the first report, and the painting keeps its image
+                self.assertEqual(len(reports), 1, (progress_effect, backend))
+                self.assertEqual(source.img.tobytes(), source_bytes)
+
+    def test_cancelled_effects_do_no_work(self):
+        cancel_token = progress.CancellationToken()
+        cancel_token.cancel()
+        for progress_effect in get_effects():
+            reports = []
+            self.assertRaises(progress.Cancelled, progress_effect.get_result, get_painting(),
+                              lambda done, total: reports.append(done), cancel_token)
+            self.assertEqual(reports, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Test running batches of effects within a memory budget.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import scheduler
+
+
+# Seconds a test waits before failing rather than hanging
+TEST_TIMEOUT = 60
+# Seconds each stand in job runs for, long enough for jobs to overlap
+JOB_SECONDS = 0.3
+JOB_COUNT = 6
+REPLACEMENT_COLORS = [color.Color(200, 0, 0), color.Color(0, 200, 0), color.Color(0, 0, 200)]
+
+
+def get_effect():
+    return effect.ThreeColorEffect(100, 1.2, REPLACEMENT_COLORS)
+
+
+def run_job_slowly(index, job, results):
+    """Stand in for scheduler._run_job, recording when it ran and using exactly its default estimate"""
+
+    start = time.time()
+    time.sleep(JOB_SECONDS)
+    with open(job.output_path, "w") as output_file:
+        json.dump([start, time.time()], output_file)
+    copies = scheduler.DEFAULT_COPIES[job.effect.__class__.__name__]
+    results.put((index, int(job.image_bytes * copies), None))
+
+
+class MemorySchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        signal.signal(signal.SIGALRM, self.__fail_on_timeout)
+        signal.alarm(TEST_TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.__directory)
+
+    def test_running_jobs_stay_within_the_budget(self):
+        jobs = [self.__get_job(index, (100, 100)) for index in range(JOB_COUNT)]
+        estimate = scheduler.MemoryScheduler(0).estimate(jobs[0])
+        # Room for two jobs at once, though there are workers for four
+        memory_scheduler = scheduler.MemoryScheduler(estimate * 2 + 1, 4)
+
+        run_job = scheduler._run_job
+        scheduler._run_job = run_job_slowly
+        try:
+            memory_scheduler.run(jobs)
+        finally:
+            scheduler._run_job = run_job
+
+        times = []
+        for job in jobs:
+            self.assertEqual((job.error, job.peak_memory), (None, estimate))
+            with open(job.output_path) as output_file:
+                times.append(json.load(output_file))
+        most_running = max(sum(1 for start, end in times if start <= time_point < end)
+                           for time_point, _ in times)
+        self.assertEqual(most_running, 2)
+
+    def test_jobs_over_the_budget_run_on_their_own(self):
+        jobs = [self.__get_job(index, (100, 100)) for index in range(2)]
+        jobs.append(self.__get_job(2, (30, 20)))
+        memory_scheduler = scheduler.MemoryScheduler(1)
+        memory_scheduler.run(jobs)
+        for job in jobs:
+            self.assertEqual(job.error, None)
+            self.assertTrue(job.peak_memory >= 0)
+            self.assertEqual(Image.open(job.output_path).size, job.size)
+
+    def test_unreadable_sources_are_errors(self):
+        job = scheduler.Job(get_effect(), os.path.join(self.__directory, "missing.png"),
+                            os.path.join(self.__directory, "output.png"))
+        scheduler.MemoryScheduler(1).run([job])
+        self.assertTrue("IOError" in job.error)
+        self.assertFalse(os.path.exists(job.output_path))
+
+    def test_estimates_learn_from_measurements(self):
+        learned_path = os.path.join(self.__directory, "learned.json")
+        job = self.__get_job(0, (100, 50))
+        self.assertEqual((job.mode, job.size, job.image_bytes), ("RGB", (100, 50), 20000))
+
+        memory_scheduler = scheduler.MemoryScheduler(1, learned_path=learned_path)
+        self.assertEqual(memory_scheduler.estimate(job), int(20000 * scheduler.DEFAULT_COPIES["ThreeColorEffect"]))
+        # The first measurement replaces the default, later ones move the estimate towards them
+        memory_scheduler.record(job, 20000 * 4)
+        self.assertEqual(memory_scheduler.estimate(job), 20000 * 4)
+        memory_scheduler.record(job, 20000 * 2)
+        self.assertEqual(memory_scheduler.estimate(job), int(20000 * (4 + scheduler.LEARNING_RATE * (2 - 4))))
+        memory_scheduler.save()
+
+        loaded_scheduler = scheduler.MemoryScheduler(1, learned_path=learned_path)
+        self.assertEqual(loaded_scheduler.estimate(job), memory_scheduler.estimate(job))
+
+    def __get_job(self, index, size):
+        source_path = os.path.join(self.__directory, "source-%d.png" % index)
+        Image.new("RGB", size, (150, 20 * index, 20)).save(source_path)
+        return scheduler.Job(get_effect(), source_path, os.path.join(self.__directory, "output-%d.png" % index))
+
+    def __fail_on_timeout(self, signal_number, frame):
+        self.fail("The jobs didn't finish within %d seconds" % TEST_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
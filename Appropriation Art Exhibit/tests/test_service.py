@@ -0,0 +1,155 @@
+"""Test the local effect job service.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import base64
+import contextlib
+import httplib
+import io
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import service
+
+
+# Seconds a test waits before failing rather than hanging
+TEST_TIMEOUT = 60
+THREE_COLOR_PARAMETERS = {"threshold": 100, "difference": 20,
+                          "replacement_colors": [[200, 0, 0], [0, 200, 0], [0, 0, 200]]}
+
+
+def get_loaded_modules(job):
+    """Stand in for service._run_job, returning which warm modules the worker had already imported"""
+
+    return [module_name for module_name in service.WARM_MODULES if module_name in sys.modules]
+
+
+class QuietRequestHandler(service.JobRequestHandler):
+
+    """Request handler that doesn't log each request to the test output"""
+
+    def log_message(self, format, *arguments):
+        pass
+
+
+class JobServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        signal.signal(signal.SIGALRM, self.__fail_on_timeout)
+        signal.alarm(TEST_TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.__directory)
+
+    def test_workers_are_warm_before_their_first_job(self):
+        run_job = service._run_job
+        # The workers are forked with this module's stand in for running jobs
+        service._run_job = get_loaded_modules
+        try:
+            job_service = service.JobService(1)
+        finally:
+            service._run_job = run_job
+        try:
+            self.assertEqual(job_service.run_job({}), list(service.WARM_MODULES))
+        finally:
+            job_service.close()
+
+    def test_jobs_are_answered_over_http(self):
+        source_path = os.path.join(self.__directory, "source.png")
+        output_path = os.path.join(self.__directory, "output.png")
+        Image.new("RGB", (16, 12), (180, 40, 40)).save(source_path)
+        job = {"effect": "ThreeColorEffect", "parameters": THREE_COLOR_PARAMETERS}
+
+        with self.__serve() as request:
+            status, response = request("POST", "/jobs", json.dumps(dict(job, source=source_path, output=output_path)))
+            self.assertEqual((status, response), (200, {"output": output_path}))
+            self.assertTrue(os.path.exists(output_path))
+
+            with open(source_path, "rb") as source_file:
+                image_job = dict(job, image=base64.b64encode(source_file.read()))
+            status, response = request("POST", "/jobs", json.dumps(image_job))
+            self.assertEqual(status, 200)
+            result = Image.open(io.BytesIO(base64.b64decode(response["image"])))
+            self.assertEqual((result.format, result.size), ("PNG", (16, 12)))
+
+            status, response = request("GET", "/stats")
+            self.assertEqual((status, response["completed"], response["failed"]), (200, 2, 0))
+
+    def test_invalid_jobs_are_bad_requests(self):
+        with self.__serve() as request:
+            self.assertEqual(request("POST", "/jobs", "not json")[0], 400)
+            self.assertEqual(request("POST", "/jobs", "[]")[0], 400)
+            self.assertEqual(request("POST", "/jobs", json.dumps({"effect": "NoSuchEffect", "source": "x.png"}))[0],
+                             400)
+            missing_path = os.path.join(self.__directory, "missing.png")
+            self.assertEqual(request("POST", "/jobs", json.dumps({"effect": "ThreeColorEffect",
+                                                                  "parameters": THREE_COLOR_PARAMETERS,
+                                                                  "source": missing_path}))[0], 400)
+            self.assertEqual(request("GET", "/nowhere")[0], 404)
+
+    def test_failed_jobs_are_server_errors(self):
+        source_path = os.path.join(self.__directory, "source.png")
+        Image.new("RGB", (16, 12), (180, 40, 40)).save(source_path)
+        # Without replacement colours, the red pixels raise IndexError once the effect runs
+        job = {"effect": "ThreeColorEffect", "parameters": dict(THREE_COLOR_PARAMETERS, replacement_colors=[]),
+               "source": source_path}
+        with self.__serve() as request:
+            status, response = request("POST", "/jobs", json.dumps(job))
+            self.assertEqual(status, 500)
+            self.assertTrue("IndexError" in response["error"])
+
+    def test_slow_jobs_time_out(self):
+        source_path = os.path.join(self.__directory, "source.png")
+        Image.frombytes("RGB", (400, 300), os.urandom(400 * 300 * 3)).save(source_path)
+        job = {"effect": "ThreeColorEffect", "parameters": THREE_COLOR_PARAMETERS, "source": source_path}
+        with self.__serve(job_timeout=0.001) as request:
+            self.assertEqual(request("POST", "/jobs", json.dumps(job))[0], 500)
+            self.assertEqual(request("GET", "/stats")[1]["failed"], 1)
+
+    @contextlib.contextmanager
+    def __serve(self, job_timeout=service.DEFAULT_JOB_TIMEOUT):
+        """Serve jobs on a free port, giving a function that makes a request and returns its status and JSON"""
+
+        def request(method, path, body=None):
+            connection = httplib.HTTPConnection("127.0.0.1", server.server_address[1])
+            try:
+                connection.request(method, path, body)
+                response = connection.getresponse()
+                self.assertEqual(response.getheader("Content-Type"), "application/json")
+                return response.status, json.loads(response.read())
+            finally:
+                connection.close()
+
+        server = service.JobServer(("127.0.0.1", 0), QuietRequestHandler)
+        server.job_service = service.JobService(1, job_timeout)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            yield request
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+            server.job_service.close()
+
+    def __fail_on_timeout(self, signal_number, frame):
+        self.fail("The service didn't answer within %d seconds" % TEST_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
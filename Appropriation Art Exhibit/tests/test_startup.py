@@ -0,0 +1,42 @@
+"""Test which of the application's modules import Pillow when they are imported.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import subprocess
+import sys
+import unittest
+
+
+# Modules that can be imported without importing Pillow, and that shouldn't
+# import the modules that only running the gallery needs
+LIGHT_MODULES = ("exhibit", "effect", "painting", "manifest")
+HEAVY_MODULES = ("PIL.Image", "tuner", "lut", "parallel", "transport")
+# Modules that run in worker processes, which import Pillow before forking so
+# that no worker pays for it on its first job
+WORKER_MODULES = ("service", "parallel", "transport", "scheduler", "animation", "lut", "tuner")
+
+
+def get_imported(module_name):
+    """Return the heavy modules that importing a module imports, worked out in a new interpreter"""
+
+    check = "import sys, %s; print ' '.join(name for name in %r if name in sys.modules)" % (module_name,
+                                                                                            HEAVY_MODULES)
+    return subprocess.check_output([sys.executable, "-c", check]).split()
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_light_modules_import_nothing_heavy(self):
+        for module_name in LIGHT_MODULES:
+            self.assertEqual(get_imported(module_name), [], module_name)
+
+    def test_worker_modules_import_pillow(self):
+        for module_name in WORKER_MODULES:
+            self.assertTrue("PIL.Image" in get_imported(module_name), module_name)
+
+
+if __name__ == '__main__':
+    unittest.main()
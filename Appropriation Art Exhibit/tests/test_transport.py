@@ -0,0 +1,88 @@
+"""Test sharing image data between processes through shared memory.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import transport
+
+
+def get_exited_pid():
+    """Return the process id of a process that has already exited"""
+
+    process = multiprocessing.Process(target=os.getpid)
+    process.start()
+    process.join()
+    return process.pid
+
+
+def create_segment(owner_pid):
+    """Create an empty segment file named as if a process owned it, and return its path"""
+
+    path = os.path.join(transport.SEGMENT_DIR, "%s-%d-segment" % (transport.SEGMENT_PREFIX, owner_pid))
+    open(path, "wb").close()
+    return path
+
+
+class SharedImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__segment_dir = transport.SEGMENT_DIR
+        transport.SEGMENT_DIR = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(transport.SEGMENT_DIR)
+        transport.SEGMENT_DIR = self.__segment_dir
+
+    def test_images_are_shared_with_attached_segments(self):
+        img = Image.frombytes("RGB", (8, 6), os.urandom(8 * 6 * 3))
+        with transport.SharedImage.create("RGB", img.size, img) as shared_image:
+            with transport.SharedImage.attach(shared_image.descriptor) as attached_image:
+                self.assertEqual(attached_image.get_image().tobytes(), img.tobytes())
+                attached_image.write_rows(Image.new("RGB", (8, 2), (1, 2, 3)), 4)
+            self.assertEqual(shared_image.get_image().crop((0, 4, 8, 6)).getcolors(), [(16, (1, 2, 3))])
+            self.assertTrue(os.path.exists(shared_image.path))
+        self.assertEqual(os.listdir(transport.SEGMENT_DIR), [])
+
+    def test_only_segments_of_exited_owners_are_removed(self):
+        stale_path = create_segment(get_exited_pid())
+        live_path = create_segment(os.getpid())
+        other_path = os.path.join(transport.SEGMENT_DIR, "other-file")
+        open(other_path, "wb").close()
+
+        transport.remove_stale_segments()
+        self.assertFalse(os.path.exists(stale_path))
+        self.assertTrue(os.path.exists(live_path))
+        self.assertTrue(os.path.exists(other_path))
+
+    def test_segments_removed_by_others_are_skipped(self):
+        stale_path = create_segment(get_exited_pid())
+        listdir = os.listdir
+
+        def listdir_then_remove(path):
+            # Another process removes the segment after it has been listed
+            names = listdir(path)
+            os.remove(stale_path)
+            return names
+
+        os.listdir = listdir_then_remove
+        try:
+            transport.remove_stale_segments()
+        finally:
+            os.listdir = listdir
+        self.assertEqual(os.listdir(transport.SEGMENT_DIR), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""Test calibrating effects and keeping their costs.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import color
+import effect
+import painting
+import tuner
+
+
+# Threads saving the same table at once
+THREAD_COUNT = 4
+
+
+def get_effect():
+    return effect.QuantizeEffect([color.Color(0, 0, 0), color.Color(255, 255, 255)])
+
+
+class AutoTunerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__table_path = os.path.join(self.__directory, "costs.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def test_saved_costs_are_loaded_again(self):
+        auto_tuner = tuner.AutoTuner(self.__table_path)
+        auto_tuner.calibrate(get_effect(), "RGB")
+        auto_tuner.save()
+        self.assertEqual(os.listdir(self.__directory), ["costs.json"])
+
+        loaded_tuner = tuner.AutoTuner(self.__table_path)
+        for size in (16, 1024):
+            sized_painting = painting.Painting(Image.new("RGB", (size, size)))
+            self.assertEqual(loaded_tuner.get_configuration(get_effect(), sized_painting),
+                             auto_tuner.get_configuration(get_effect(), sized_painting))
+        self.assertEqual(os.listdir(self.__directory), ["costs.json"])
+
+    def test_threads_can_save_the_same_table(self):
+        auto_tuners = [tuner.AutoTuner(self.__table_path) for _ in range(THREAD_COUNT)]
+        for auto_tuner in auto_tuners:
+            auto_tuner.calibrate(get_effect(), "RGB")
+        errors = []
+
+        def save(auto_tuner):
+            try:
+                auto_tuner.save()
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=save, args=(auto_tuner,)) for auto_tuner in auto_tuners]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.__directory), ["costs.json"])
+        with open(self.__table_path) as table_file:
+            self.assertEqual(len(json.load(table_file)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Test sharing jobs between worker processes through a work queue.
+
+Run from the application directory with python -m unittest discover tests
+"""
+
+
+# Standard Python libraries
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+# External libraries
+from PIL import Image
+
+# Own modules
+import workqueue
+
+
+JOB_COUNT = 12
+WORKERS = 3
+SHORT_LEASE_SECONDS = 1
+# Seconds a test waits before failing rather than hanging
+TEST_TIMEOUT = 60
+THREE_COLOR_PARAMETERS = {"threshold": 100, "difference": 20,
+                          "replacement_colors": [[200, 0, 0], [0, 200, 0], [0, 0, 200]]}
+
+
+def run_worker(arguments):
+    """Run a worker in a pool process and return the number of jobs it ran"""
+
+    queue_dir, worker_name, lease_seconds = arguments
+    return workqueue.run_worker(queue_dir, lease_seconds, worker_name)
+
+
+def claim_and_wait(queue_dir, claimed):
+    """Claim a job as a worker that then hangs until it is killed"""
+
+    workqueue.WorkQueue(queue_dir).claim("doomed")
+    claimed.set()
+    signal.pause()
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__queue_dir = os.path.join(self.__directory, "queue")
+        self.__queue = workqueue.WorkQueue(self.__queue_dir)
+        signal.signal(signal.SIGALRM, self.__fail_on_timeout)
+        signal.alarm(TEST_TIMEOUT)
+
+    def tearDown(self):
+        signal.alarm(0)
+        shutil.rmtree(self.__directory)
+
+    def test_every_job_runs_exactly_once(self):
+        jobs = [self.__submit(index) for index in range(JOB_COUNT)]
+        self.assertEqual(len(set(job_name for job_name, job in jobs)), JOB_COUNT)
+
+        pool = multiprocessing.Pool(WORKERS)
+        try:
+            jobs_run = pool.map(run_worker, [(self.__queue_dir, "worker-%d" % index, workqueue.DEFAULT_LEASE_SECONDS)
+                                             for index in range(WORKERS)])
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(sum(jobs_run), JOB_COUNT)
+        self.assertEqual(self.__queue.get_counts(), {workqueue.PENDING: 0, workqueue.LEASED: 0,
+                                                     workqueue.DONE: JOB_COUNT, workqueue.FAILED: 0})
+        for job_name, job in jobs:
+            self.assertTrue(os.path.exists(job["output"]))
+
+    def test_submitting_again_skips_done_jobs(self):
+        job_name, job = self.__submit(0)
+        self.assertEqual(run_worker((self.__queue_dir, "worker", workqueue.DEFAULT_LEASE_SECONDS)), 1)
+        self.assertEqual(self.__queue.submit(job), job_name)
+        self.assertEqual(self.__queue.get_counts()[workqueue.PENDING], 0)
+
+    def test_expired_lease_of_killed_worker_is_reclaimed(self):
+        job_name, job = self.__submit(0)
+        claimed = multiprocessing.Event()
+        holder = multiprocessing.Process(target=claim_and_wait, args=(self.__queue_dir, claimed))
+        holder.start()
+        claimed.wait(TEST_TIMEOUT)
+        os.kill(holder.pid, signal.SIGKILL)
+        holder.join()
+        self.assertEqual(self.__queue.get_counts()[workqueue.LEASED], 1)
+
+        self.assertEqual(run_worker((self.__queue_dir, "rescuer", SHORT_LEASE_SECONDS)), 1)
+        self.assertEqual(self.__queue.get_counts()[workqueue.DONE], 1)
+        self.assertEqual(self.__queue.get_counts()[workqueue.LEASED], 0)
+        self.assertTrue(os.path.exists(job["output"]))
+
+    def test_other_hosts_writing_the_same_job_are_left_alone(self):
+        job = {"source": "source.png", "effects": [], "output": "output.png"}
+        job_file_name = workqueue.get_job_name(job) + workqueue.JOB_EXTENSION
+        pending_dir = os.path.join(self.__queue_dir, workqueue.PENDING)
+        # A worker on another machine with the same pid, part way through writing the job
+        other_file_name = "%s.%d.tmp" % (job_file_name, os.getpid())
+        other_path = os.path.join(pending_dir, other_file_name)
+        with open(other_path, "w") as other_file:
+            other_file.write("{")
+
+        self.__queue.submit(job)
+        with open(other_path) as other_file:
+            self.assertEqual(other_file.read(), "{")
+        self.assertEqual(sorted(os.listdir(pending_dir)), sorted([other_file_name, job_file_name]))
+        self.assertEqual(self.__queue.claim("worker"), (workqueue.get_job_name(job), job))
+
+    def __submit(self, index):
+        """Save a small source image, submit a job for it and return the job's name and description"""
+
+        source_path = os.path.join(self.__directory, "source-%d.png" % index)
+        Image.new("RGB", (16, 12), (100 + index, 40, 40)).save(source_path)
+        job = {"source": source_path,
+               "effects": [{"effect": "ThreeColorEffect", "parameters": THREE_COLOR_PARAMETERS}],
+               "output": os.path.join(self.__directory, "out", "output-%d.png" % index)}
+        return self.__queue.submit(job), job
+
+    def __fail_on_timeout(self, signal_number, frame):
+        self.fail("The workers didn't finish within %d seconds" % TEST_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
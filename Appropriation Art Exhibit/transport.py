@@ -0,0 +1,216 @@
+"""Contain a class for sharing image data between processes.
+
+This module contains a class that stores the pixel data of an image in
+a named shared memory segment, so that worker processes can read an
+image and write their results without the image being pickled and sent
+through a pipe.
+Segments are files in /dev/shm where it exists, otherwise in the
+temporary directory, mapped into memory with mmap.
+
+Classes:
+SharedImage -- class for storing an image in shared memory
+
+Functions:
+remove_stale_segments -- remove segments left behind by processes that have exited
+"""
+
+
+# Standard Python libraries
+import errno
+import mmap
+import os
+import tempfile
+import uuid
+
+# External libraries
+from PIL import Image
+
+
+# Directory that shared memory segments are created in
+SEGMENT_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+# Start of the name of every segment, followed by the owner's process id
+SEGMENT_PREFIX = "tinkering-graphics"
+# Modes that store one byte per band, so rows can be written independently
+SUPPORTED_MODES = ("L", "LA", "RGB", "RGBA", "CMYK")
+
+
+class SharedImage(object):
+
+    """Store an image in a named shared memory segment.
+
+    This class stores the pixel data of an image in shared memory.
+    The process that creates a SharedImage owns it and must unlink it
+    when it is finished with it. Using the SharedImage in a with statement
+    does this automatically when the block is left, including by an
+    exception, so the segment is only left behind if the owner itself is
+    killed. Other processes attach to it using its descriptor.
+
+    Public methods:
+    create -- create a new segment, optionally holding a copy of an image
+    attach -- attach to a segment created by another process
+    get_image -- return an Image.Image of the data in the segment
+    write_rows -- write an image into the segment starting at a given row
+    close -- close this process's mapping of the segment
+    unlink -- remove the segment so that its memory is freed
+    """
+
+    def __init__(self, name, mode, size, owner):
+        """Initialise the properties and map the segment into memory.
+
+        SharedImage.create and SharedImage.attach should be used rather than
+        calling this directly.
+
+        Arguments:
+        name -- the name of the segment as a string
+        mode -- the mode of the image
+        size -- the size of the image as a tuple
+        owner -- whether this process created the segment
+        """
+
+        if mode not in SUPPORTED_MODES:
+            raise ValueError("Images of mode %s can't be shared" % mode)
+
+        self.__name = name
+        self.__mode = mode
+        self.__size = size
+        self.__owner = owner
+        self.__row_length = size[0] * Image.getmodebands(mode)
+
+        segment_file = open(self.path, "r+b" if not owner else "w+b")
+        try:
+            if owner:
+                segment_file.truncate(self.length)
+            self.__buffer = mmap.mmap(segment_file.fileno(), self.length)
+            self.__closed = False
+        finally:
+            segment_file.close()
+
+    @classmethod
+    def create(cls, mode, size, img=None):
+        """Return a new SharedImage owned by this process.
+
+        Arguments:
+        mode -- the mode of the image
+        size -- the size of the image as a tuple
+        img -- Image.Image whose data should be copied into the segment
+        """
+
+        name = "%s-%d-%s" % (SEGMENT_PREFIX, os.getpid(), uuid.uuid4().hex)
+        shared_image = cls(name, mode, size, True)
+        if img is not None:
+            shared_image.write_rows(img, 0)
+        return shared_image
+
+    @classmethod
+    def attach(cls, descriptor):
+        """Return a SharedImage attached to an existing segment.
+
+        Arguments:
+        descriptor -- the descriptor property of the SharedImage to attach to
+        """
+
+        name, mode, size = descriptor
+        return cls(name, mode, size, False)
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def path(self):
+        return os.path.join(SEGMENT_DIR, self.name)
+
+    @property
+    def length(self):
+        """Return the number of bytes in the segment"""
+
+        return max(1, self.__row_length * self.size[1])
+
+    @property
+    def descriptor(self):
+        """Return a tuple that can be sent to other processes to attach to the segment"""
+
+        return self.name, self.mode, self.size
+
+    def get_image(self):
+        """Return an Image.Image of the data in the segment.
+
+        For modes that Pillow stores the same way as the segment, such as
+        "L" and "RGBA", the image uses the segment's memory directly rather
+        than a copy, so it must not be used after the segment is closed.
+        """
+
+        return Image.frombuffer(self.mode, self.size, self.__buffer, "raw", self.mode, 0, 1)
+
+    def write_rows(self, img, top):
+        """Write an image into the segment starting at the given row.
+
+        Arguments:
+        img -- Image.Image that is as wide as the segment and in the same mode
+        top -- the row of the segment that the first row of img is written to
+        """
+
+        if img.mode != self.mode or img.size[0] != self.size[0]:
+            raise ValueError("Image must be as wide as the segment and in the same mode")
+
+        start = top * self.__row_length
+        data = img.tobytes()
+        self.__buffer[start:start + len(data)] = data
+
+    def close(self):
+        """Close this process's mapping of the segment"""
+
+        if not self.__closed:
+            self.__buffer.close()
+            self.__closed = True
+
+    def unlink(self):
+        """Remove the segment so that its memory is freed once every process closes it"""
+
+        _remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if self.__owner:
+            self.unlink()
+
+
+def remove_stale_segments():
+    """Remove segments whose owner process has exited.
+
+    Owners unlink their segments when they leave the with block they
+    created them in. This function cleans up after an owner that was
+    killed before it could. Segments that another process removes first
+    are skipped.
+    """
+
+    for name in os.listdir(SEGMENT_DIR):
+        if not name.startswith(SEGMENT_PREFIX + "-"):
+            continue
+        owner_pid = int(name.split("-")[2])
+        try:
+            os.kill(owner_pid, 0)
+        except OSError as error:
+            if error.errno == errno.ESRCH:
+                _remove(os.path.join(SEGMENT_DIR, name))
+
+
+def _remove(path):
+    """Remove a segment's file, unless it has already been removed"""
+
+    try:
+        os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
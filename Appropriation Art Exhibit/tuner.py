@@ -0,0 +1,352 @@
+"""Contain classes for picking the fastest way to apply an effect on this computer.
+
+This module contains a class that times each way of applying an effect,
+with each backend and either in one go or in strips across several
+processes, on small calibration images. It fits a fixed cost and a cost
+per pixel to each, so it can pick the fastest for an image of any size,
+and saves them in a table so the calibration only happens once per
+effect and image mode on each computer.
+Pointwise effects are applied once per distinct colour through a
+lut.ColorLUT instead when the image has few enough colours.
+
+Classes:
+Configuration -- class for storing one way of applying an effect
+AutoTuner -- class for picking and using the fastest configuration
+"""
+
+
+# Standard Python libraries
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+# Own modules
+import effect
+import lut
+import painting
+import parallel
+import startup
+
+
+# Pillow is only imported once an image is first used
+Image = startup.LazyModule("PIL.Image")
+
+
+DEFAULT_TABLE_PATH = "tuning.json"
+# Square calibration images are timed at two sizes to fit the fixed and per pixel costs
+CALIBRATION_SIZES = (64, 128)
+# Each configuration is timed this many times and the fastest is kept
+CALIBRATION_REPEATS = 2
+# Number of strips each worker gets when an image is split between processes
+STRIPS_PER_WORKER = (1, 4)
+
+
+class Configuration(object):
+
+    """Store properties relating to one way of applying an effect.
+
+    Public methods:
+    get_strip_height -- return the height of the strips for an image
+    to_dict -- return the configuration as a dictionary of plain values
+    """
+
+    def __init__(self, backend, workers=1, strips_per_worker=0):
+        """Initialise the properties.
+
+        Arguments:
+        backend -- the effect backend, such as effect.NATIVE_BACKEND
+        workers -- the number of processes the image is split between
+        strips_per_worker -- the number of strips for each worker, or 0 to apply the effect in one go
+        """
+
+        self.__backend = backend
+        self.__workers = workers
+        self.__strips_per_worker = strips_per_worker
+
+    @property
+    def backend(self):
+        return self.__backend
+
+    @property
+    def workers(self):
+        return self.__workers
+
+    @property
+    def strips_per_worker(self):
+        return self.__strips_per_worker
+
+    def __eq__(self, other):
+        return isinstance(other, Configuration) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Configuration(%r, %d, %d)" % (self.backend, self.workers, self.strips_per_worker)
+
+    def get_strip_height(self, height):
+        """Return the height of the strips for an image, or None if it isn't split.
+
+        Arguments:
+        height -- the height of the image's result in pixels
+        """
+
+        if not self.strips_per_worker:
+            return None
+        strips = self.workers * self.strips_per_worker
+        return max(1, int(math.ceil(float(height) / strips)))
+
+    def to_dict(self):
+        return {"backend": self.backend, "workers": self.workers, "strips_per_worker": self.strips_per_worker}
+
+
+class AutoTuner(object):
+
+    """Store properties and methods relating to picking how effects are applied.
+
+    This class picks the configuration that is fastest for an effect and
+    image, calibrating the effect first if it hasn't been seen on this
+    computer, and can apply the effect with it.
+    Any settings in forced override what the calibration picked, for
+    example {"backend": "python"} to always use the python backend while
+    still picking the number of workers automatically.
+    Pointwise effects are applied through a colour table to "P" images,
+    which only has to change their palette, and to images with at most
+    max_unique_colors colours if that is likely to be faster: when there
+    are few enough colours to remap the image through a palette, or when
+    the python backend was picked for the image.
+
+    Public methods:
+    get_configuration -- return the configuration to apply an effect to a painting with
+    calibrate -- time each configuration of an effect and record their costs
+    apply -- apply an effect to a painting with the configuration picked for it
+    get_result -- return the result of an effect without changing the painting
+    save -- save the table of costs
+    """
+
+    def __init__(self, table_path=DEFAULT_TABLE_PATH, forced=None, max_workers=None,
+                 max_unique_colors=lut.MAX_UNIQUE_COLORS):
+        """Initialise the properties and load the table if it has been saved.
+
+        Arguments:
+        table_path -- string containing the location of the table, or None not to keep one
+        forced -- dictionary of Configuration settings that override the calibrated choice
+        max_workers -- the most processes to split an image between, defaults to the number of CPUs
+        max_unique_colors -- the most colours an image can have to use a colour table, or None never to
+        """
+
+        self.__table_path = table_path
+        self.__forced = dict(forced or {})
+        self.__max_workers = max_workers or multiprocessing.cpu_count()
+        self.__max_unique_colors = max_unique_colors
+        self.__table = {}
+        self.__changed = False
+        # Calibrations are timed one at a time so they don't slow each other down,
+        # and the table is only saved between them
+        self.__lock = threading.Lock()
+
+        if table_path is not None and os.path.exists(table_path):
+            with open(table_path) as table_file:
+                self.__table = json.load(table_file)
+
+    @property
+    def table_path(self):
+        return self.__table_path
+
+    @property
+    def forced(self):
+        return dict(self.__forced)
+
+    @property
+    def max_workers(self):
+        return self.__max_workers
+
+    @property
+    def max_unique_colors(self):
+        return self.__max_unique_colors
+
+    def get_configuration(self, effect_to_apply, painting_to_process):
+        """Return the Configuration expected to apply an effect to a painting fastest.
+
+        Arguments:
+        effect_to_apply -- the effect.Effect to apply
+        painting_to_process -- the painting.Painting it will be applied to
+        """
+
+        key = self.__get_key(effect_to_apply, painting_to_process.mode)
+        if key not in self.__table:
+            with self.__lock:
+                if key not in self.__table:
+                    self.calibrate(effect_to_apply, painting_to_process.mode)
+
+        pixels = painting_to_process.width * painting_to_process.height
+        costs = self.__table[key]
+        fastest = min(costs, key=lambda cost: cost["fixed"] + cost["per_pixel"] * pixels)
+        settings = dict(fastest["configuration"])
+        settings.update(self.__forced)
+        return Configuration(**dict((str(name), value) for name, value in settings.items()))
+
+    def calibrate(self, effect_to_apply, mode):
+        """Time each configuration of an effect and record their costs.
+
+        Configurations that fail on the calibration image, such as
+        splitting a ShuffleEffect without a seed, are left out.
+
+        Arguments:
+        effect_to_apply -- the effect.Effect to calibrate
+        mode -- the mode of the images the effect will be applied to
+        """
+
+        costs = []
+        for configuration in self.__get_candidates(effect_to_apply):
+            try:
+                times = [self.__time(effect_to_apply, configuration, mode, size) for size in CALIBRATION_SIZES]
+            except ValueError:
+                continue
+            small_pixels, large_pixels = [size * size for size in CALIBRATION_SIZES]
+            per_pixel = max(0.0, (times[1] - times[0]) / (large_pixels - small_pixels))
+            fixed = max(0.0, times[0] - per_pixel * small_pixels)
+            costs.append({"configuration": configuration.to_dict(), "fixed": fixed, "per_pixel": per_pixel})
+
+        self.__table[self.__get_key(effect_to_apply, mode)] = costs
+        self.__changed = True
+
+    def apply(self, effect_to_apply, painting_to_process):
+        """Apply an effect to a painting with the configuration picked for it.
+
+        If the painting can't be split between processes, for example
+        because it was decoded at a reduced scale, it is processed in one go.
+
+        Arguments:
+        effect_to_apply -- the effect.Effect to apply
+        painting_to_process -- the painting.Painting it should be applied to
+        """
+
+        if self.__uses_color_table(effect_to_apply, painting_to_process):
+            if painting_to_process.mode == "P":
+                lut.apply_effect(effect_to_apply, painting_to_process)
+                return
+            configuration = self.get_configuration(effect_to_apply, painting_to_process)
+            with effect.using_backend(configuration.backend):
+                lut.apply_effect(effect_to_apply, painting_to_process)
+            return
+
+        configuration = self.get_configuration(effect_to_apply, painting_to_process)
+        try:
+            _apply_configuration(effect_to_apply, painting_to_process, configuration)
+        except ValueError:
+            if not configuration.strips_per_worker:
+                raise
+            _apply_configuration(effect_to_apply, painting_to_process, Configuration(configuration.backend))
+
+    def get_result(self, effect_to_apply, painting_to_process):
+        """Return the result of an effect as a new painting.Painting.
+
+        The supplied painting is left unchanged, so it can be shared.
+
+        Arguments:
+        effect_to_apply -- the effect.Effect to apply
+        painting_to_process -- the painting.Painting it should be applied to
+        """
+
+        if not self.__uses_color_table(effect_to_apply, painting_to_process):
+            configuration = self.get_configuration(effect_to_apply, painting_to_process)
+            if not configuration.strips_per_worker:
+                with effect.using_backend(configuration.backend):
+                    return effect_to_apply.get_result(painting_to_process)
+
+        result = painting_to_process.copy()
+        self.apply(effect_to_apply, result)
+        return result
+
+    def save(self):
+        """Save the table of costs if any calibrations have been added.
+
+        The table is written to a temporary file with a name of its own
+        that is then renamed, so other threads and processes saving the
+        same table never share the file, and never read a half written table.
+        """
+
+        if self.table_path is None:
+            return
+
+        with self.__lock:
+            if not self.__changed:
+                return
+            table_descriptor, temporary_path = tempfile.mkstemp(".tmp", os.path.basename(self.table_path) + ".",
+                                                                os.path.dirname(self.table_path) or os.curdir)
+            with os.fdopen(table_descriptor, "w") as table_file:
+                json.dump(self.__table, table_file, indent=4, sort_keys=True)
+            os.rename(temporary_path, self.table_path)
+            self.__changed = False
+
+    def __uses_color_table(self, effect_to_apply, painting_to_process):
+        """Return whether a pointwise effect should be applied to a painting through a colour table"""
+
+        if not effect_to_apply.pointwise or self.max_unique_colors is None:
+            return False
+        if painting_to_process.mode == "P":
+            return True
+        color_count = painting_to_process.get_unique_color_count()
+        if color_count > self.max_unique_colors:
+            return False
+        if color_count <= lut.MAX_PALETTE_COLORS and painting_to_process.mode == lut.PALETTE_MODE:
+            return True
+        return self.get_configuration(effect_to_apply, painting_to_process).backend == effect.PYTHON_BACKEND
+
+    def __get_key(self, effect_to_apply, mode):
+        """Return the key of an effect's costs in the table.
+
+        The configurations timed depend on how many processes an image can
+        be split between, so max_workers is part of the key.
+        """
+
+        return "%s:%s:%d" % (effect_to_apply.__class__.__name__, mode, self.max_workers)
+
+    def __get_candidates(self, effect_to_apply):
+        """Return every Configuration worth timing for an effect.
+
+        Effects are only split between processes if there is more than one
+        CPU, and if they can work out a strip without the whole result.
+        """
+
+        candidates = [Configuration(backend) for backend in effect.BACKENDS]
+        if self.max_workers > 1 and effect_to_apply.splits_into_strips:
+            for backend in effect.BACKENDS:
+                for strips_per_worker in STRIPS_PER_WORKER:
+                    candidates.append(Configuration(backend, self.max_workers, strips_per_worker))
+        return candidates
+
+    def __time(self, effect_to_apply, configuration, mode, size):
+        """Return the fewest seconds a configuration took to apply an effect to a calibration image"""
+
+        calibration_image = Image.frombytes(mode, (size, size), os.urandom(size * size * Image.getmodebands(mode)))
+        times = []
+        for _ in range(CALIBRATION_REPEATS):
+            calibration_painting = painting.Painting(calibration_image.copy())
+            start = time.time()
+            _apply_configuration(effect_to_apply, calibration_painting, configuration)
+            times.append(time.time() - start)
+        return min(times)
+
+
+def _apply_configuration(effect_to_apply, painting_to_process, configuration):
+    """Apply an effect to a painting with a configuration.
+
+    Arguments:
+    effect_to_apply -- the effect.Effect to apply
+    painting_to_process -- the painting.Painting it should be applied to
+    configuration -- the Configuration to apply it with
+    """
+
+    with effect.using_backend(configuration.backend):
+        if not configuration.strips_per_worker:
+            effect_to_apply.do_effect(painting_to_process)
+            return
+        output_height = effect_to_apply.get_output_size(painting_to_process.source_size)[1]
+        parallel.apply_in_strips(effect_to_apply, painting_to_process,
+                                 configuration.get_strip_height(output_height), configuration.workers)
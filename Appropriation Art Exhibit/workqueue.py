@@ -0,0 +1,421 @@
+"""Contain a class for sharing batches of effect jobs between machines.
+
+This module contains a work queue kept in a directory, so any number of
+worker processes, on one machine or on several machines that share the
+directory, can take jobs from it without any other service.
+Each job is a file that moves between the subdirectories
+pending -- jobs waiting to be claimed
+leased -- jobs a worker is running, named after the worker
+done -- records of the jobs that have finished and their outputs
+failed -- records of the jobs that raised an error
+Workers claim a job by renaming it from pending to leased, which only
+one of them can do, and keep touching the lease while the job runs.
+Leases that haven't been touched for lease_seconds, because their
+worker died, are moved back to pending by the next worker to look.
+Jobs are named after a hash of their description, so submitting a
+batch again skips the jobs that are already queued or done, and an
+interrupted run is resumed by starting more workers.
+
+Jobs are dictionaries with the keys of manifest.Gallery.get_jobs, and
+"effects" applied to "source" in order and saved to "output".
+
+Classes:
+WorkQueue -- class for submitting, claiming and recording jobs
+
+Functions:
+run_worker -- run jobs from a queue until there are none left
+run_workers -- run several workers on this machine in their own processes
+main -- submit a gallery, run workers or show the state of a queue from the command line
+"""
+
+
+# Standard Python libraries
+import argparse
+import errno
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+# Own modules
+import effect
+import manifest
+import painting
+
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, LEASED, DONE, FAILED)
+
+# Leases not touched for this many seconds are treated as abandoned.
+# It should be much longer than any difference between the clocks of the machines
+DEFAULT_LEASE_SECONDS = 300
+# Number of times a lease is touched in each lease period
+RENEWALS_PER_LEASE = 3
+# How long a worker waits before looking again while other workers hold leases, in seconds
+POLL_INTERVAL = 1.0
+JOB_EXTENSION = ".json"
+# Separates the job name from the worker's name in the name of a lease
+LEASE_SEPARATOR = "@"
+
+
+class WorkQueue(object):
+
+    """Store properties and methods relating to a directory of jobs.
+
+    Every change to the queue is a single rename or a file written under
+    a temporary name and then renamed, so the queue is never left half
+    changed, even if a worker is killed.
+
+    Public methods:
+    submit -- add a job unless it is already queued or done
+    claim -- take the next pending job for a worker
+    renew -- touch a worker's lease so it doesn't expire
+    complete -- record that a job has finished
+    fail -- record that a job raised an error
+    requeue_expired -- move abandoned leases back to pending
+    get_counts -- return the number of jobs in each state
+    """
+
+    def __init__(self, queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Initialise the properties and create the queue's directories if they don't exist.
+
+        Arguments:
+        queue_dir -- string containing the location of the queue's directory
+        lease_seconds -- how long a lease lasts without being touched, in seconds
+        """
+
+        self.__queue_dir = queue_dir
+        self.__lease_seconds = lease_seconds
+        for state in STATES:
+            try:
+                os.makedirs(self.__get_state_dir(state))
+            except OSError as error:
+                # Another worker may have just created it
+                if error.errno != errno.EEXIST:
+                    raise
+
+    @property
+    def queue_dir(self):
+        return self.__queue_dir
+
+    @property
+    def lease_seconds(self):
+        return self.__lease_seconds
+
+    def submit(self, job):
+        """Add a job to the queue and return its name.
+
+        Jobs that are already pending, leased or done are left as they are.
+        Jobs that failed are queued again.
+
+        Arguments:
+        job -- dictionary describing the job
+        """
+
+        job_name = get_job_name(job)
+        if self.__find(job_name, (PENDING, LEASED, DONE)) is None:
+            _write_json(self.__get_path(PENDING, job_name), job)
+            _remove(self.__get_path(FAILED, job_name))
+        return job_name
+
+    def claim(self, worker_name):
+        """Take the next pending job and return its name and description, or None if there are none.
+
+        Abandoned leases are moved back to pending first.
+
+        Arguments:
+        worker_name -- name of the worker claiming the job, unique across all machines
+        """
+
+        self.requeue_expired()
+        for file_name in sorted(os.listdir(self.__get_state_dir(PENDING))):
+            if not file_name.endswith(JOB_EXTENSION):
+                continue
+            job_name = file_name[:-len(JOB_EXTENSION)]
+            pending_path = self.__get_path(PENDING, job_name)
+            lease_path = self.__get_lease_path(job_name, worker_name)
+            try:
+                # The lease starts when it is claimed, not when the job was submitted
+                os.utime(pending_path, None)
+                # Only one worker can rename the file, the others get ENOENT
+                os.rename(pending_path, lease_path)
+            except OSError as error:
+                if error.errno == errno.ENOENT:
+                    continue
+                raise
+            with open(lease_path) as job_file:
+                return job_name, json.load(job_file)
+        return None
+
+    def renew(self, job_name, worker_name):
+        """Touch a worker's lease and return whether the worker still holds it.
+
+        Arguments:
+        job_name -- the name of the job
+        worker_name -- the name of the worker holding the lease
+        """
+
+        try:
+            os.utime(self.__get_lease_path(job_name, worker_name), None)
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return False
+            raise
+        return True
+
+    def complete(self, job_name, worker_name, record):
+        """Record that a job has finished and release its lease.
+
+        The record is kept even if the lease expired while the job ran,
+        as the output has still been saved.
+
+        Arguments:
+        job_name -- the name of the job
+        worker_name -- the name of the worker that ran it
+        record -- dictionary of information about the run, such as the output path
+        """
+
+        _write_json(self.__get_path(DONE, job_name), dict(record, worker=worker_name))
+        _remove(self.__get_lease_path(job_name, worker_name))
+        # A job requeued after its lease expired doesn't need running again
+        _remove(self.__get_path(PENDING, job_name))
+
+    def fail(self, job_name, worker_name, error):
+        """Record that a job raised an error and release its lease.
+
+        Failed jobs aren't retried, as they would fail the same way, until
+        they are submitted again.
+
+        Arguments:
+        job_name -- the name of the job
+        worker_name -- the name of the worker that ran it
+        error -- string describing the error
+        """
+
+        _write_json(self.__get_path(FAILED, job_name), {"error": error, "worker": worker_name})
+        _remove(self.__get_lease_path(job_name, worker_name))
+
+    def requeue_expired(self):
+        """Move leases that haven't been touched for lease_seconds back to pending and return how many were"""
+
+        requeued = 0
+        leased_dir = self.__get_state_dir(LEASED)
+        for file_name in os.listdir(leased_dir):
+            lease_path = os.path.join(leased_dir, file_name)
+            job_name = file_name.split(LEASE_SEPARATOR)[0]
+            try:
+                if time.time() - os.path.getmtime(lease_path) < self.lease_seconds:
+                    continue
+                if os.path.exists(self.__get_path(DONE, job_name)):
+                    os.remove(lease_path)
+                else:
+                    os.rename(lease_path, self.__get_path(PENDING, job_name))
+                    requeued += 1
+            except OSError as error:
+                # Another worker requeued it first, or its worker has just finished
+                if error.errno != errno.ENOENT:
+                    raise
+        return requeued
+
+    def get_counts(self):
+        """Return a dictionary of the number of jobs in each state"""
+
+        return dict((state, len(os.listdir(self.__get_state_dir(state)))) for state in STATES)
+
+    def __find(self, job_name, states):
+        """Return the first of the states a job is in, or None if it isn't in any of them"""
+
+        for state in states:
+            if state == LEASED:
+                prefix = job_name + LEASE_SEPARATOR
+                if any(file_name.startswith(prefix) for file_name in os.listdir(self.__get_state_dir(LEASED))):
+                    return state
+            elif os.path.exists(self.__get_path(state, job_name)):
+                return state
+        return None
+
+    def __get_state_dir(self, state):
+        return os.path.join(self.queue_dir, state)
+
+    def __get_path(self, state, job_name):
+        return os.path.join(self.__get_state_dir(state), job_name + JOB_EXTENSION)
+
+    def __get_lease_path(self, job_name, worker_name):
+        return os.path.join(self.__get_state_dir(LEASED), job_name + LEASE_SEPARATOR + worker_name + JOB_EXTENSION)
+
+
+def get_job_name(job):
+    """Return the name of a job, which is a hash of its description.
+
+    Arguments:
+    job -- dictionary describing the job
+    """
+
+    return hashlib.sha1(json.dumps(job, sort_keys=True)).hexdigest()
+
+
+def get_worker_name():
+    """Return a name for a worker in this process that is unique across machines"""
+
+    return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+def run_worker(queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS, worker_name=None):
+    """Run jobs from a queue until there are none pending or leased, and return how many were run.
+
+    While other workers still hold leases, this worker waits in case one
+    of them expires and needs running again.
+
+    Arguments:
+    queue_dir -- string containing the location of the queue's directory
+    lease_seconds -- how long a lease lasts without being touched, in seconds
+    worker_name -- name of the worker, defaults to the host name and process ID
+    """
+
+    work_queue = WorkQueue(queue_dir, lease_seconds)
+    worker_name = worker_name or get_worker_name()
+    jobs_run = 0
+
+    while True:
+        claimed = work_queue.claim(worker_name)
+        if claimed is None:
+            if not work_queue.get_counts()[LEASED]:
+                return jobs_run
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        job_name, job = claimed
+        stop_renewing = threading.Event()
+        renewer = threading.Thread(target=_renew_lease, args=(work_queue, job_name, worker_name, stop_renewing))
+        renewer.daemon = True
+        renewer.start()
+        start = time.time()
+        try:
+            _run_job(job, worker_name)
+        except Exception as error:
+            work_queue.fail(job_name, worker_name, repr(error))
+        else:
+            work_queue.complete(job_name, worker_name, {"output": job["output"], "seconds": time.time() - start})
+        finally:
+            stop_renewing.set()
+            renewer.join()
+        jobs_run += 1
+
+
+def run_workers(queue_dir, workers, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Run several workers on this machine in their own processes until the queue is empty.
+
+    Arguments:
+    queue_dir -- string containing the location of the queue's directory
+    workers -- the number of worker processes as an int
+    lease_seconds -- how long a lease lasts without being touched, in seconds
+    """
+
+    processes = [multiprocessing.Process(target=run_worker, args=(queue_dir, lease_seconds))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def _renew_lease(work_queue, job_name, worker_name, stop_renewing):
+    """Touch a lease regularly until told to stop or the lease is lost.
+
+    This function is run in a thread while the job runs.
+    """
+
+    while not stop_renewing.wait(float(work_queue.lease_seconds) / RENEWALS_PER_LEASE):
+        if not work_queue.renew(job_name, worker_name):
+            return
+
+
+def _run_job(job, worker_name):
+    """Apply a job's effects to its source and save the result.
+
+    The result is saved under a temporary name in the output directory
+    and then renamed, so a worker that dies never leaves half an image.
+
+    Arguments:
+    job -- dictionary describing the job
+    worker_name -- name of the worker, used for the temporary file name
+    """
+
+    effects = [effect.create_effect(job_effect["effect"], job_effect.get("parameters", {}))
+               for job_effect in job["effects"]]
+    required_size = effects[0].get_required_size if effects else None
+    job_painting = painting.Painting(str(job["source"]), required_size)
+    for job_effect in effects:
+        job_effect.do_effect(job_painting)
+
+    output_path = str(job["output"])
+    output_dir, output_name = os.path.split(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir)
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                raise
+    # The extension is kept so the image is saved in the same format
+    temporary_path = os.path.join(output_dir, ".%s.%s" % (worker_name, output_name))
+    job_painting.save(temporary_path)
+    os.rename(temporary_path, output_path)
+
+
+def _write_json(path, content):
+    """Write JSON to a temporary file and rename it into place.
+
+    The temporary file is named after the worker and a random id, as
+    workers on other machines sharing the queue can have the same pid.
+    """
+
+    temporary_path = "%s.%s.%s.tmp" % (path, get_worker_name(), uuid.uuid4().hex)
+    with open(temporary_path, "w") as json_file:
+        json.dump(content, json_file, indent=4, sort_keys=True)
+    os.rename(temporary_path, path)
+
+
+def _remove(path):
+    """Remove a file if it exists"""
+
+    try:
+        os.remove(path)
+    except OSError as error:
+        if error.errno != errno.ENOENT:
+            raise
+
+
+def main():
+    """Submit a gallery to a queue, run workers on it or show its state from the command line"""
+
+    parser = argparse.ArgumentParser(description="Share batches of effect jobs through a directory.")
+    parser.add_argument("queue_dir")
+    subparsers = parser.add_subparsers(dest="command")
+    submit_parser = subparsers.add_parser("submit", help="queue every saved stage of a gallery manifest")
+    submit_parser.add_argument("manifest")
+    work_parser = subparsers.add_parser("work", help="run jobs until the queue is empty")
+    work_parser.add_argument("--workers", type=int, default=1)
+    work_parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    subparsers.add_parser("status", help="show the number of jobs in each state")
+    arguments = parser.parse_args()
+
+    if arguments.command == "submit":
+        work_queue = WorkQueue(arguments.queue_dir)
+        for job in manifest.Gallery(arguments.manifest).get_jobs():
+            print work_queue.submit(job), job["output"]
+    elif arguments.command == "work":
+        run_workers(arguments.queue_dir, arguments.workers, arguments.lease_seconds)
+
+    counts = WorkQueue(arguments.queue_dir).get_counts()
+    print ", ".join("%s %d" % (state, counts[state]) for state in STATES)
+
+
+if __name__ == '__main__':
+    main()